@@ -2,74 +2,69 @@
 #As we're provding an interpreter we want warnings to show everytime we run into one.
 #And we will import the various parts of the interpreter next
 from vm import VM
-import lexer
-import parsing
-import prefixChecking
-import expanding
+from models import models, defaultModel
+from program import buildCode
+import tracing
+import timing
+import history
 #We need this so that we can take in arguments at launch
-import sys
+import argparse
 
 #This provides a wrapper for the series of steps executed
 class Interpreter:
-	def __init__(self):
+	def __init__(self, tracer = None, model = defaultModel, engine = 'interpret', timed = False, waitStates = 0, onChipBytes = None, recorded = False):
 		#The VM is the only thing that persists throughout running chunks of code
 		#The lexer and parser are better off refershing line numbers and such when 
 		#made to run on a new chunk of code
-		self.vm = VM()
+		#The model picks which transputer the VM simulates
+		self.vm = VM(models[model])
+		#The tracer decides what we see of the VM while it runs
+		self.vm.tracer = tracer
+		#And the engine whether the VM interprets or compiles the code it's given
+		self.vm.engine = engine
+		#With timing on we count the cycles the real chip would take
+		self.vm.timing = timed
+		self.vm.waitStates = waitStates
+		if onChipBytes != None:
+			self.vm.onChipBytes = onChipBytes
+		#A recorded run can be gone back through once it stops, the history stands in
+		#for the tracer and passes on whatever it traces
+		self.history = None
+		if recorded:
+			self.history = history.History(self.vm, tracer)
+			self.vm.tracer = self.history
 		
 	def run(self,code):
-		#First we scan for tokens
-		scanner = lexer.Scanner(code.upper())
-		tokens = scanner.scanTokens()
-		#We use None as a way to return Errors
-		if (tokens == None):
-			print("Lexical error encountered. Not executing")
-			return 
-
-		#Next we parse the tokens we've generated into trees
-		parser = parsing.Parser(tokens)
-		trees = parser.parse()
-		if (trees == None):
-			print("Parsing error encountered. Not executing")
-			return
-
-		#The next section forms a middle end, that changes the not so assembly code so far
-		#into proper assembly code that the actual transputer would be able to handle
-
-		#We should check for any prefix errors that may come up and be undetecable
-		#at run time after we expand out illegal operands in the expansion step
-
-		prefixChanger= prefixChecking.PrefixPreparer(trees)
-		trees = prefixChanger.prepare()
-		if (trees == None):
-			print("Illegal prefix sequence encountered. Not executing")
+		assembled = self.assemble(code)
+		if assembled == None:
 			return
-
-		#Then we use an expander to expand out double length instructions
-		#And operands longer than 4 bits
-		#We also check if there is any overflow when expanding out jumps
-
-		expander = expanding.Expander(trees)
-		trees = expander.expand()
-		if (trees == None):
-			print("Ran into a problem while correcting Jumps. Not executing")
-			return
-		
 		#After this we're ready to interpret!
-		self.vm.run(trees)
+		if self.vm.boot(assembled):
+			if self.history != None:
+				self.history.start()
+			self.vm.resume()
+
+	#Turn code into the expanded reps.Code the VM loads, None if there was an error
+	def assemble(self,code):
+		assembled, failure = buildCode(code)
+		if failure != None:
+			print(failure)
+		return assembled
 
 #This provides a way to read an entire file of assembly code at once
-def read_file(filePath):
+def read_file(filePath, tracer = None, model = defaultModel, engine = 'interpret', timed = False, waitStates = 0, onChipBytes = None):
 	#We need to initialse a VM
-	interp = Interpreter()
-	#Now we load the contents of the flie
+	interp = Interpreter(tracer, model, engine, timed, waitStates, onChipBytes)
+	#Now we get the VM to run the file, it's read as it's assembled
 	with open(filePath,"r") as f:
-		contents = f.read()
-	#Get the VM to run it
-	interp.run(contents)
+		interp.run(f)
+	if timed:
+		print(timing.report(interp.vm))
+	return interp
 
 #This provides a REPL environment,
-def repl():
+def repl(tracer = None, model = defaultModel, engine = 'interpret', timed = False, waitStates = 0, onChipBytes = None,
+		historyLimit = history.defaultMemoryCap, checkpointInterval = history.defaultInterval):
 	#This allows us to properly take input from the user
 	#And return it in a way that the interpreter will accept
 	def readCode(prompt, followLine):
@@ -90,31 +85,119 @@ def repl():
 		return response
 
 	#We need to initialse a VM
-	interp = Interpreter()
+	#Runs in the REPL are recorded so we can go back through them
+	interp = Interpreter(tracer, model, engine, timed, waitStates, onChipBytes, recorded = True)
+	interp.history.memoryCap = historyLimit
+	interp.history.interval = checkpointInterval
 	#Provide options to end, print or intereact
 	print ("Welcome to the REPL \n Please enter instructions as appropriate")
 	print ("Type 'print' to print the current state of the VM or press Enter to leave REPL")
+	print ("Type 'step-back N' to go back N instructions in the last run or 'run-back-to L' to go back to")
+	print ("the last time line L was about to run")
+	if timed:
+		print ("Type 'timing' to see where the cycles of the last run went")
 	while True:
 		instructions = readCode("> "," >")
 		if instructions == "":
 			break
 		elif instructions.upper() == "PRINT":
-			print(interp)
+			print(interp.vm)
+		elif timed and instructions.upper() == "TIMING":
+			print(timing.report(interp.vm))
+		elif isHistoryCommand(instructions):
+			goBack(interp, instructions)
 		else:
 			interp.run(instructions)
 
+#Commands that go back through the last run, the word and whether it needs a number
+historyCommands = {'STEP-BACK': False, 'RUN-BACK-TO': True}
+
+def isHistoryCommand(instructions):
+	words = instructions.upper().split()
+	return len(words) > 0 and words[0] in historyCommands
+
+def goBack(interp, instructions):
+	words = instructions.upper().split()
+	command = words[0]
+	if len(words) > 2 or (historyCommands[command] and len(words) != 2) or (len(words) == 2 and not words[1].isdigit()):
+		print("Use 'step-back N' or 'run-back-to L' where N and L are numbers")
+		return
+	vm = interp.vm
+	if command == 'STEP-BACK':
+		steps = 1 if len(words) == 1 else int(words[1])
+		went = interp.history.stepBack(steps)
+		print(f'Went back {went} instructions')
+	elif not interp.history.runBackTo(int(words[1])):
+		print(f'Line {words[1]} didn\'t run in the history we still have')
+		return
+	print(f'Instruction {vm.instructionCount}, about to run line {vm.lineAt(vm.Iptr)}')
+	print(vm)
+
+#This builds the tracer asked for on the command line
+def buildTracer(arguments):
+	level = tracing.TraceLevel(arguments.trace)
+	if level == tracing.TraceLevel.OFF:
+		return None
+	sinks = []
+	#States either go to a trace file or get printed
+	if arguments.trace_file != None:
+		sinks.append(tracing.BinaryTraceWriter(arguments.trace_file))
+	else:
+		sinks.append(tracing.PrintSink())
+	if arguments.trace_ring != None:
+		sinks.append(tracing.RingBufferSink(arguments.trace_ring))
+	return tracing.Tracer(level, sinks)
+
+#If the run failed we show the last states we kept hold of
+def printRing(interp, tracer):
+	vm = interp.vm
+	if tracer == None or not (vm.haltFlag or vm.error):
+		return
+	for sink in tracer.sinks:
+		if isinstance(sink, tracing.RingBufferSink):
+			print(f'Last {len(sink)} states before stopping:')
+			for state in sink:
+				print(tracing.formatState(state))
+
 def start():
-	arguments = sys.argv
-	#We offer the user options here according how many arguments are provided
-	#The if statement checks if 1 argument is provided and that it has the correct file extension
-	#If no argument is provided we enter the REPL environment
-	if (len(arguments) == 2) and (len(arguments[1]) > 3) and (arguments[1][-3:] == ".tn"):
-		read_file(arguments[1])
-	elif (len(arguments)== 1) :
-		repl()
+	argumentParser = argparse.ArgumentParser(prog = 'interpreter.py', description = 'A simulator of the Transputer by Inmos')
+	argumentParser.add_argument('file', nargs = '?', help = 'a .tn file to run, leave out to access the REPL')
+	argumentParser.add_argument('--model', choices = list(models), default = defaultModel,
+		help = 'the transputer to simulate, which fixes the word size')
+	argumentParser.add_argument('--engine', choices = ['interpret', 'compile'], default = 'interpret',
+		help = 'interpret instructions one at a time or compile the program into Python functions')
+	argumentParser.add_argument('--trace', choices = [level.value for level in tracing.TraceLevel], default = 'instruction',
+		help = 'show the state of the VM after every instruction, only at the end of a run, or not at all')
+	argumentParser.add_argument('--trace-file', help = 'write traced states to this binary trace file instead of printing them')
+	argumentParser.add_argument('--trace-ring', type = int, help = 'keep the last N traced states and print them if the run fails')
+	argumentParser.add_argument('--timing', action = 'store_true',
+		help = 'count the cycles the real chip would take and show where they went')
+	argumentParser.add_argument('--wait-states', type = int, default = 0,
+		help = 'with --timing, the extra cycles each access to external memory costs')
+	argumentParser.add_argument('--on-chip', type = int,
+		help = 'with --timing, how many bytes from MostNeg are fast on-chip RAM, by default as much as the model has')
+	argumentParser.add_argument('--history-limit', type = int, default = history.defaultMemoryCap // (1024*1024),
+		help = 'in the REPL, how many MB of checkpoints to keep for going back through a run')
+	argumentParser.add_argument('--checkpoint-interval', type = int, default = history.defaultInterval,
+		help = 'in the REPL, how many instructions apart checkpoints are taken')
+	arguments = argumentParser.parse_args()
+	tracer = buildTracer(arguments)
+
+	#We offer the user options here according to the arguments provided
+	#If a file is given it must have the correct file extension
+	#If no file is provided we enter the REPL environment
+	if arguments.file != None and (len(arguments.file) > 3) and (arguments.file[-3:] == ".tn"):
+		interp = read_file(arguments.file, tracer, arguments.model, arguments.engine, arguments.timing, arguments.wait_states, arguments.on_chip)
+		printRing(interp, tracer)
+	elif arguments.file == None:
+		repl(tracer, arguments.model, arguments.engine, arguments.timing, arguments.wait_states, arguments.on_chip,
+			arguments.history_limit*1024*1024, arguments.checkpoint_interval)
 	else:
-		print("Usage: interpreter.py [file name].tn , or to access the REPL: interpreter.py")
+		argumentParser.print_usage()
+	if tracer != None:
+		tracer.close()
 
 	input("Press Enter to close...")
 
-start()
\ No newline at end of file
+if __name__ == '__main__':
+	start()
@@ -0,0 +1,130 @@
+#Runs many programs at once across a pool of processes, each on a fresh VM, and gives back
+#a JSON record of how each one ended
+from Interpreter import Interpreter
+from models import models, defaultModel
+import multiprocessing
+import contextlib
+import warnings
+import argparse
+import glob
+import json
+import time
+import io
+import os
+
+'''
+Programs are run a chunk of instructions at a time so that a program that doesn't end can
+be stopped once it has run too many instructions or for too long. Every record has the
+same fields:
+
+file         the program that was run
+status       finished, halted, error, step-limit, time-limit, not-assembled or crashed
+registers    Areg, Breg, Creg, Oreg, Wptr and Iptr when it stopped
+haltFlag     whether the VM halted
+error        whether the VM ran into an error
+instructions how many instructions were run
+wallTime     the seconds it took to assemble and run
+warnings     everything that was reported while it ran
+output       anything it printed
+exception    what went wrong if the simulator itself crashed, otherwise null
+
+Records are written one to a line, in the same order as the programs
+'''
+
+#How many instructions we run between checking the limits
+chunkSteps = 10000
+
+#Every .tn file in a directory, or every file a glob matches, in order of name
+def findPrograms(pattern):
+	if os.path.isdir(pattern):
+		pattern = os.path.join(pattern, '*.tn')
+	return sorted(glob.glob(pattern))
+
+#Run the VM until its program ends or it reaches a limit, giving back how it stopped
+def runWithLimits(vm, maxSteps, timeLimit, startTime):
+	while True:
+		steps = chunkSteps
+		if maxSteps != None:
+			steps = min(steps, maxSteps - vm.instructionCount)
+			if steps <= 0:
+				return 'step-limit'
+		vm.resume(steps)
+		if vm.haltFlag:
+			return 'halted'
+		if vm.error:
+			return 'error'
+		if not vm.scheduler.runnable():
+			return 'finished'
+		if timeLimit != None and time.perf_counter() - startTime > timeLimit:
+			return 'time-limit'
+
+#Assemble and run a single program, this is what each process in the pool runs
+def runProgram(filePath, model = defaultModel, engine = 'interpret', maxSteps = None, timeLimit = None):
+	startTime = time.perf_counter()
+	output = io.StringIO()
+	with warnings.catch_warnings(record = True) as reported, contextlib.redirect_stdout(output):
+		warnings.simplefilter('always')
+		interp = Interpreter(model = model, engine = engine)
+		vm = interp.vm
+		exception = None
+		#One program going wrong shouldn't stop the rest of the batch
+		try:
+			with open(filePath, 'r') as f:
+				assembled = interp.assemble(f)
+			if assembled == None or not vm.boot(assembled):
+				status = 'not-assembled'
+			else:
+				status = runWithLimits(vm, maxSteps, timeLimit, startTime)
+		except Exception as inst:
+			status = 'crashed'
+			exception = repr(inst)
+	return {
+		'file': filePath,
+		'status': status,
+		'registers': {name: getattr(vm, name) for name in ('Areg', 'Breg', 'Creg', 'Oreg', 'Wptr', 'Iptr')},
+		'haltFlag': vm.haltFlag,
+		'error': vm.error,
+		'instructions': vm.instructionCount,
+		'wallTime': time.perf_counter() - startTime,
+		'warnings': [str(warning.message) for warning in reported],
+		'output': output.getvalue(),
+		'exception': exception,
+	}
+
+#Pool.imap only passes one argument so the settings ride along with each file
+def runJob(job):
+	return runProgram(*job)
+
+#Run every program across workers processes, giving back the records in the same order
+def runBatch(files, model = defaultModel, engine = 'interpret', maxSteps = None, timeLimit = None, workers = None):
+	jobs = [(filePath, model, engine, maxSteps, timeLimit) for filePath in files]
+	with multiprocessing.Pool(workers) as pool:
+		for record in pool.imap(runJob, jobs):
+			yield record
+
+def start():
+	parser = argparse.ArgumentParser(description = 'Run many .tn programs, each on its own VM, and write a JSON record for each')
+	parser.add_argument('programs', nargs = '+', help = 'directories of .tn files or globs matching them')
+	parser.add_argument('--model', choices = sorted(models), default = defaultModel)
+	parser.add_argument('--engine', choices = ['interpret', 'compile'], default = 'interpret')
+	parser.add_argument('--max-steps', type = int, help = 'stop a program once it has run this many instructions')
+	parser.add_argument('--time-limit', type = float, help = 'stop a program once it has run for this many seconds')
+	parser.add_argument('--workers', type = int, help = 'how many processes to run programs in, by default one per core')
+	parser.add_argument('--output', help = 'write the records to this file instead of printing them')
+	arguments = parser.parse_args()
+	files = []
+	for pattern in arguments.programs:
+		files += findPrograms(pattern)
+	if len(files) == 0:
+		parser.error('no programs found')
+	records = runBatch(files, arguments.model, arguments.engine, arguments.max_steps, arguments.time_limit, arguments.workers)
+	if arguments.output == None:
+		for record in records:
+			print(json.dumps(record))
+	else:
+		with open(arguments.output, 'w') as f:
+			for record in records:
+				f.write(json.dumps(record) + '\n')
+
+if __name__ == '__main__':
+	start()
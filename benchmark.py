@@ -0,0 +1,44 @@
+#This times how quickly the VM gets through a program so that changes to the
+#VM can be compared against each other in instructions per second
+from Interpreter import Interpreter
+import contextlib
+import time
+import sys
+import os
+
+#We default to a loop heavy program since that's where the VM spends most of its time
+defaultProgram = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'loop.tn')
+
+def benchmark(filePath, engine = 'interpret', repeats = 5):
+	with open(filePath,"r") as f:
+		contents = f.read()
+	best = None
+	for i in range(repeats):
+		interp = Interpreter(engine = engine)
+		#We don't want the time spent writing to the terminal to be counted
+		with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+			startTime = time.perf_counter()
+			interp.run(contents)
+			elapsed = time.perf_counter() - startTime
+		instructions = interp.vm.instructionCount
+		#We keep the fastest run since it's the one least disturbed by anything else
+		if best == None or elapsed < best[1]:
+			best = (instructions, elapsed)
+	return best
+
+def start():
+	arguments = sys.argv
+	if len(arguments) == 2:
+		filePath = arguments[1]
+	elif len(arguments) == 1:
+		filePath = defaultProgram
+	else:
+		print("Usage: benchmark.py [file name].tn")
+		return
+	#We time each engine so they can be compared
+	for engine in ['interpret', 'compile']:
+		instructions, elapsed = benchmark(filePath, engine)
+		print(f'{filePath} ({engine}): {instructions} instructions in {elapsed:.3f}s, {instructions/elapsed:,.0f} instructions per second')
+
+if __name__ == '__main__':
+	start()
@@ -0,0 +1,368 @@
+import reps
+
+'''
+The block compiler is an optional way of running programs that turns the byte code in
+memory into Python functions, so that the VM doesn't have to dispatch every instruction.
+
+The program is split into basic blocks, which start at the start of the program, at the
+destination of every J/CJ/CALL and after every J/CJ/CALL/RET. When we're asked to run
+from an address we compile a region: the block starting there and every block we can
+reach from it through jumps and calls (up to a limit). The region becomes one generated
+function where the registers live in local variables and prefix chains have been folded
+into constant operands, and where moving from one block to another is just a change to
+a local program counter.
+
+We only compile instructions whose behaviour we can reproduce exactly. Any instruction
+that might raise a warning or an error is guarded, and if the guard fails the generated
+code writes its registers back to the VM with Iptr pointing at the start of that
+instruction and returns, so the VM's interpreter runs it and reports whatever it
+should. Instructions we don't compile at all end the region the same way.
+
+We assume the program doesn't overwrite its own code while running.
+'''
+
+#Direct function codes, taken from their TokenTypes
+def functionCode(name):
+	return int(reps.TokenType[name].instructionCode(),16)
+
+PFIX = functionCode('PFIX')
+NFIX = functionCode('NFIX')
+OPR = functionCode('OPR')
+LDC = functionCode('LDC')
+LDL = functionCode('LDL')
+STL = functionCode('STL')
+LDLP = functionCode('LDLP')
+ADC = functionCode('ADC')
+EQC = functionCode('EQC')
+J = functionCode('J')
+CJ = functionCode('CJ')
+LDNL = functionCode('LDNL')
+CALL = functionCode('CALL')
+
+#Secondary function codes
+REV = functionCode('REV')
+ADD = functionCode('ADD')
+RET = functionCode('RET')
+
+#The most blocks we put in a single region
+maxRegionBlocks = 32
+
+#How many instructions a block runs, prefixes included
+def blockLength(instructions):
+	return sum(instruction.length for instruction in instructions)
+
+#A decoded instruction with its prefix chain folded into the operand
+class Instruction:
+	def __init__(self, address, function, operand, nextAddress, length):
+		self.address = address
+		self.function = function
+		self.operand = operand
+		self.nextAddress = nextAddress
+		#The number of instructions, prefixes included, this stands for
+		self.length = length
+
+	#Where a J/CJ/CALL goes to
+	def target(self):
+		return self.nextAddress + self.operand
+
+	#Does this end a basic block?
+	def endsBlock(self):
+		if self.function == OPR:
+			return self.operand == RET
+		return self.function in (J, CJ, CALL)
+
+	#Can we reproduce this instruction in generated code?
+	def compilable(self):
+		if self.function == OPR:
+			return self.operand in (REV, ADD, RET)
+		return self.function in (LDC, LDL, STL, LDLP, ADC, EQC, J, CJ, LDNL, CALL)
+
+#Fold the prefix chain starting at address into a single instruction
+def decodeInstruction(memory, address, codeEnd):
+	start = address
+	operand = 0
+	length = 0
+	while address < codeEnd:
+		byte = memory[address]
+		function = byte >> 4
+		#We build up the operand exactly as the VM builds up Oreg
+		operand += byte & 0xF
+		address += 1
+		length += 1
+		if function == PFIX:
+			operand = operand << 4
+		elif function == NFIX:
+			operand = ~operand << 4
+		else:
+			return Instruction(start, function, operand, address, length)
+	#The chain runs off the end of the program
+	return None
+
+class BlockCompiler:
+	def __init__(self, vm):
+		self.vm = vm
+		self.codeStart = vm.codeStart
+		self.codeEnd = vm.codeEnd
+		#Compiled regions by the address they are entered at, None means we can't compile there
+		self.regions = {}
+		self.instructions = self.decodeProgram()
+		self.leaders = self.findLeaders()
+
+	def decode(self, address):
+		return decodeInstruction(self.vm.memory, address, self.codeEnd)
+
+	#Decode the whole program from its start, by the address each instruction starts at
+	def decodeProgram(self):
+		instructions = {}
+		address = self.codeStart
+		while address < self.codeEnd:
+			instruction = self.decode(address)
+			if instruction == None:
+				break
+			instructions[address] = instruction
+			address = instruction.nextAddress
+		return instructions
+
+	def findLeaders(self):
+		leaders = {self.codeStart}
+		for instruction in self.instructions.values():
+			if instruction.function in (J, CJ, CALL):
+				leaders.add(instruction.target())
+			if instruction.endsBlock():
+				leaders.add(instruction.nextAddress)
+		return leaders
+
+	#Give back the compiled region entered at address, or None if we can't compile there
+	def regionAt(self, address):
+		if address in self.regions:
+			return self.regions[address]
+		region = self.compileRegion(address)
+		self.regions[address] = region
+		return region
+
+	#Gather the instructions of the block starting at address
+	def block(self, address):
+		instructions = []
+		while address < self.codeEnd:
+			#Blocks normally start at instruction boundaries, if we've been sent
+			#somewhere else we decode from there
+			instruction = self.instructions.get(address)
+			if instruction == None:
+				instruction = self.decode(address)
+			if instruction == None or not instruction.compilable():
+				break
+			instructions.append(instruction)
+			if instruction.endsBlock():
+				break
+			address = instruction.nextAddress
+			if address in self.leaders:
+				break
+		return instructions
+
+	#The blocks a block can pass control to that we know of before running
+	def successors(self, instructions):
+		last = instructions[-1]
+		if last.function == J:
+			return [last.target()]
+		if last.function == CJ:
+			return [last.target(), last.nextAddress]
+		#We expect a call to come back to the instruction after it
+		if last.function == CALL:
+			return [last.target(), last.nextAddress]
+		if last.function == OPR and last.operand == RET:
+			return []
+		return [last.nextAddress]
+
+	def compileRegion(self, entry):
+		blocks = {}
+		toVisit = [entry]
+		while len(toVisit) > 0 and len(blocks) < maxRegionBlocks:
+			address = toVisit.pop(0)
+			if address in blocks or address < self.codeStart or address >= self.codeEnd:
+				continue
+			instructions = self.block(address)
+			if len(instructions) == 0:
+				continue
+			blocks[address] = instructions
+			toVisit += self.successors(instructions)
+		if entry not in blocks:
+			return None
+		generator = RegionGenerator(self.vm, entry, blocks)
+		return generator.build()
+
+'''
+The generator writes out the Python source for a region and compiles it
+'''
+class RegionGenerator:
+	def __init__(self, vm, entry, blocks):
+		self.vm = vm
+		self.entry = entry
+		self.blocks = blocks
+		self.lines = []
+		self.wordMask = vm.wordMask
+		self.signBit = vm.signBit
+		self.byteSelectMask = vm.byteSelectMask
+		self.bytesPerWord = vm.bytesPerWord
+
+	def emit(self, level, line):
+		self.lines.append('\t'*level + line)
+
+	#Write the registers back to the VM, leaving Iptr at address, and return
+	def emitExit(self, level, address, executed):
+		self.emit(level, 'vm.Areg = A; vm.Breg = B; vm.Creg = C; vm.stackdepth = depth; vm.Wptr = W')
+		self.emit(level, f'vm.Iptr = {address}')
+		self.emit(level, f'vm.instructionCount += steps + {executed}')
+		self.emit(level, 'return')
+
+	def build(self):
+		self.emit(0, 'def region(vm, budget, eventLimit):')
+		self.emit(1, 'A = vm.Areg; B = vm.Breg; C = vm.Creg; depth = vm.stackdepth; W = vm.Wptr')
+		self.emit(1, f'pc = {self.entry}')
+		self.emit(1, 'steps = 0')
+		self.emit(1, 'while steps < budget:')
+		#We put the entry block first since it's where loops usually go back to
+		order = [self.entry] + [address for address in self.blocks if address != self.entry]
+		keyword = 'if'
+		for address in order:
+			self.emit(2, f'{keyword} pc == {address}:')
+			#A block that would run past the budget is left for next time
+			self.emit(3, f'if steps + {blockLength(self.blocks[address])} > budget:')
+			self.emit(4, 'break')
+			self.emitBlock(3, self.blocks[address])
+			keyword = 'elif'
+		#Anywhere outside the region is left to the VM
+		self.emit(2, 'else:')
+		self.emit(3, 'break')
+		self.emit(1, 'vm.Areg = A; vm.Breg = B; vm.Creg = C; vm.stackdepth = depth; vm.Wptr = W')
+		self.emit(1, 'vm.Iptr = pc')
+		self.emit(1, 'vm.instructionCount += steps')
+		source = '\n'.join(self.lines) + '\n'
+		namespace = {'readWord': self.vm.memory.readWord, 'writeWord': self.vm.memory.writeWord}
+		exec(compile(source, f'<region {self.entry}>', 'exec'), namespace)
+		region = namespace['region']
+		region.source = source
+		#How many instructions the block it's entered at runs, if they all run
+		region.entryLength = blockLength(self.blocks[self.entry])
+		return region
+
+	def emitBlock(self, level, instructions):
+		#Within a block we track what we know about the stack so we can leave out guards
+		#that can't fail. knownDepth is the least stackdepth can be and knownInts is how many
+		#registers from the top of the stack are known to hold numbers rather than None
+		self.knownDepth = 0
+		self.knownInts = 0
+		executed = 0
+		for instruction in instructions:
+			self.emitInstruction(level, instruction, executed)
+			executed += instruction.length
+		last = instructions[-1]
+		#If the block doesn't set pc itself it falls through to the next instruction
+		self.emit(level, f'steps += {executed}')
+		if not last.endsBlock():
+			self.emit(level, f'pc = {last.nextAddress}')
+
+	#The Python that mimics pushing a number onto the stack
+	def emitPush(self, level, value):
+		self.emit(level, f'C = B; B = A; A = {value}')
+		if self.knownDepth < 3:
+			self.emit(level, 'if depth < 3: depth += 1')
+		self.knownDepth = min(self.knownDepth + 1, 3)
+		self.knownInts = min(self.knownInts + 1, 3)
+
+	#The Python that mimics popping from the stack, the guards make sure it's safe
+	def emitPop(self, level):
+		self.emit(level, 'A = B; B = C; depth -= 1')
+		self.knownDepth = max(self.knownDepth - 1, 0)
+		self.knownInts = max(self.knownInts - 1, 0)
+
+	#We need to leave the instruction to the VM when any of the conditions are true,
+	#conditions that we know can't be true are left out
+	def emitGuard(self, level, conditions, instruction, executed):
+		if 'depth == 0' in conditions and self.knownDepth > 0:
+			conditions.remove('depth == 0')
+		for register, position in (('A is None', 1), ('B is None', 2), ('C is None', 3)):
+			if register in conditions and self.knownInts >= position:
+				conditions.remove(register)
+		if len(conditions) == 0:
+			return
+		self.emit(level, f'if {" or ".join(conditions)}:')
+		self.emitExit(level+1, instruction.address, executed)
+
+	#Convert a register holding a word to its signed value
+	def signed(self, register):
+		return f'((({register}) & {self.wordMask}) ^ {self.signBit}) - {self.signBit}'
+
+	def emitInstruction(self, level, instruction, executed):
+		function = instruction.function
+		operand = instruction.operand
+		address = instruction.address
+		offset = operand*self.bytesPerWord
+		aligned = f'address & {self.byteSelectMask}'
+		if function == LDC:
+			self.emitPush(level, operand)
+		elif function == LDL:
+			self.emit(level, f'address = (W + {offset}) & {self.wordMask}')
+			self.emitGuard(level, [aligned], instruction, executed)
+			self.emitPush(level, 'readWord(address)')
+		elif function == STL:
+			self.emit(level, f'address = (W + {offset}) & {self.wordMask}')
+			self.emitGuard(level, ['depth == 0', 'A is None', aligned], instruction, executed)
+			self.emit(level, f'writeWord(address, A & {self.wordMask})')
+			self.emitPop(level)
+		elif function == LDLP:
+			self.emitPush(level, f'W + {offset}')
+		elif function == ADC:
+			self.emitGuard(level, ['A is None'], instruction, executed)
+			self.emit(level, f'value = {self.signed("A")} + {self.vm.fromSigned(operand)}')
+			self.emitGuard(level, [f'value > {self.vm.mostPos} or value < {self.vm.mostNeg}'], instruction, executed)
+			self.emit(level, 'A = value')
+			self.knownInts = max(self.knownInts, 1)
+		elif function == EQC:
+			#Words read from memory are unsigned so both sides are wrapped to a word
+			self.emit(level, f'A = 1 if A is not None and A & {self.wordMask} == {operand & self.wordMask} else 0')
+			self.knownInts = max(self.knownInts, 1)
+		elif function == J:
+			#J can call the scheduler so once eventLimit instructions have run the VM runs it
+			self.emitGuard(level, [f'steps + {executed} >= eventLimit'], instruction, executed)
+			self.emit(level, f'pc = {instruction.target()}')
+		elif function == CJ:
+			self.emit(level, 'if A == 0:')
+			self.emit(level+1, f'pc = {instruction.target()}')
+			self.emit(level, 'else:')
+			self.emitGuard(level+1, ['depth == 0'], instruction, executed)
+			self.emitPop(level+1)
+			self.emit(level+1, f'pc = {instruction.nextAddress}')
+		elif function == LDNL:
+			self.emitGuard(level, ['A is None', f'A & {self.byteSelectMask}'], instruction, executed)
+			self.emit(level, f'A = readWord((A + {offset}) & {self.wordMask})')
+		elif function == CALL:
+			#The space CALL makes below Wptr must be word aligned and we must have
+			#something in each register to save
+			self.emit(level, f'newW = W - {4*self.bytesPerWord}')
+			self.emit(level, f'address = newW & {self.wordMask}')
+			self.emitGuard(level, ['A is None', 'B is None', 'C is None', aligned], instruction, executed)
+			self.emit(level, f'writeWord(address, {instruction.nextAddress & self.wordMask})')
+			self.emit(level, f'writeWord((newW + {self.bytesPerWord}) & {self.wordMask}, A & {self.wordMask})')
+			self.emit(level, f'writeWord((newW + {2*self.bytesPerWord}) & {self.wordMask}, B & {self.wordMask})')
+			self.emit(level, f'writeWord((newW + {3*self.bytesPerWord}) & {self.wordMask}, C & {self.wordMask})')
+			self.emit(level, f'A = {instruction.nextAddress}')
+			self.emit(level, 'W = newW')
+			self.emit(level, f'pc = {instruction.target()}')
+		elif function == OPR and operand == REV:
+			self.emit(level, 'A, B = B, A')
+			if self.knownInts < 2:
+				self.knownInts = 0
+		elif function == OPR and operand == ADD:
+			self.emitGuard(level, ['A is None', 'B is None', 'depth == 0'], instruction, executed)
+			self.emit(level, f'value = {self.signed("B")} + {self.signed("A")}')
+			self.emitGuard(level, [f'value > {self.vm.mostPos} or value < {self.vm.mostNeg}'], instruction, executed)
+			self.emit(level, 'A = value; B = C; depth -= 1')
+			self.knownDepth = max(self.knownDepth - 1, 0)
+			self.knownInts = 1 + max(self.knownInts - 2, 0)
+		elif function == OPR and operand == RET:
+			self.emit(level, f'address = W & {self.wordMask}')
+			self.emitGuard(level, [aligned], instruction, executed)
+			self.emit(level, 'pc = readWord(address)')
+			self.emit(level, f'W = W + {4*self.bytesPerWord}')
+		else:
+			raise AssertionError(f'{function} {operand} cannot be compiled')
@@ -0,0 +1,303 @@
+#A network can be shared between worker processes so that a large network uses every core
+from network import Node, defaultQuantum
+from models import defaultModel
+import multiprocessing
+import warnings
+
+'''
+The nodes of the network are split into contiguous blocks, one for each worker process.
+Each worker runs its own nodes in rounds just like a Network does, and the workers are kept
+in step by a coordinator which starts each round once every worker has finished the last.
+The coordinator only hears whether each worker ran, sent anything and when its first timer
+is due, which is all it needs to decide whether to run another round, skip to a timer or
+stop.
+
+Links that cross between workers can't copy straight from one VM to another, so in a
+distributed network every link works the same way: what is sent in one round arrives at
+the start of the next. A process that outputs sends its whole message and waits. The
+message is held at the input end until processes there have read all of it, then an
+acknowledgement goes back and the outputting process carries on once that arrives.
+
+Link traffic goes straight between workers. Every two workers that share a link have a
+pipe between them, a Unix socket pair, and at the end of each round a worker sends each of
+them a single batch of everything it sent their way, even when that's nothing, and reads
+the batch they sent it. So a worker never starts a round until it has heard everything its
+neighbours sent in the last one, which keeps the synchronisation conservative. Workers
+swap batches with their neighbours in order of worker number, the lower numbered of the
+two sending first, so no two workers are ever both stuck waiting to send to each other.
+What a worker sends its own nodes it keeps for itself.
+
+Each worker applies what it's been sent in order of channel before running anything and
+nodes only hear from each other between rounds, so the network runs the same way whatever
+order the workers finish in and however many workers there are.
+'''
+
+#The output end of one direction of a link
+class LinkSender:
+	def __init__(self, channel, vm, outputLink, outbox):
+		self.channel = channel
+		self.vm = vm
+		self.address = vm.linkStart + outputLink*vm.bytesPerWord
+		self.outbox = outbox
+		#The Wdesc of the process waiting for its message to be read
+		self.waiting = None
+
+	def output(self, wdesc, pointer, count):
+		self.waiting = wdesc
+		self.outbox.append((self.channel, 'data', self.vm.memory.readBytes(pointer, count)))
+
+	#The whole message has been read
+	def acknowledged(self):
+		vm = self.vm
+		vm.memory.writeWord(self.address, vm.scheduler.notProcess)
+		vm.scheduler.enqueue(self.waiting)
+		self.waiting = None
+
+#The input end of one direction of a link
+class LinkReceiver:
+	def __init__(self, channel, vm, inputLink, outbox):
+		self.channel = channel
+		self.vm = vm
+		self.address = vm.linkStart + (4 + inputLink)*vm.bytesPerWord
+		self.outbox = outbox
+		#What's left of the message that has arrived, None if there isn't one
+		self.message = None
+		#[Wdesc, pointer, bytes left] for the process waiting to input
+		self.inputting = None
+
+	def ready(self):
+		return self.message != None
+
+	def input(self, wdesc, pointer, count):
+		self.inputting = [wdesc, pointer, count]
+		self.transfer()
+
+	def arrived(self, data):
+		self.message = memoryview(data)
+		if self.inputting == None:
+			#If there's an ALT waiting it's woken
+			vm = self.vm
+			word = vm.memory.readWord(self.address)
+			if word != vm.scheduler.notProcess:
+				vm.scheduler.altReady(word)
+		self.transfer()
+
+	def transfer(self):
+		if self.message == None or self.inputting == None:
+			return
+		inputting = self.inputting
+		count = min(len(self.message), inputting[2])
+		self.vm.memory.writeBytes(inputting[1], self.message[:count])
+		self.message = self.message[count:]
+		inputting[1] += count
+		inputting[2] -= count
+		if len(self.message) == 0:
+			self.message = None
+			self.outbox.append((self.channel, 'ack', None))
+		if inputting[2] == 0:
+			vm = self.vm
+			self.inputting = None
+			vm.memory.writeWord(self.address, vm.scheduler.notProcess)
+			vm.scheduler.enqueue(inputting[0])
+
+#The part of the network a worker runs
+class Partition:
+	def __init__(self, model, engine, sources, channels):
+		self.nodes = [Node(number, source, model, engine) for number, source in sources]
+		byNumber = {node.number: node for node in self.nodes}
+		#What we send to other nodes in a round, and what's been sent to ours to be
+		#delivered at the start of the next
+		self.outbox = []
+		self.inbox = []
+		self.senders = {}
+		self.receivers = {}
+		for channel, sender, outputLink, receiver, inputLink in channels:
+			if sender in byNumber:
+				vm = byNumber[sender].vm
+				self.senders[channel] = vm.outputLinks[outputLink] = LinkSender(channel, vm, outputLink, self.outbox)
+			if receiver in byNumber:
+				vm = byNumber[receiver].vm
+				self.receivers[channel] = vm.inputLinks[inputLink] = LinkReceiver(channel, vm, inputLink, self.outbox)
+
+	def boot(self):
+		for node in self.nodes:
+			assembled = node.interpreter.assemble(node.source)
+			if assembled == None or not node.vm.boot(assembled):
+				return node.number
+			node.vm.push(node.number)
+		return None
+
+	#Deliver what was sent last round, run a round and give back what we send, whether
+	#anything ran and the first cycle any of our timers is due on
+	def round(self, end):
+		for channel, kind, data in sorted(self.inbox, key = lambda event: event[0]):
+			if kind == 'data':
+				self.receivers[channel].arrived(data)
+			else:
+				self.senders[channel].acknowledged()
+		self.inbox.clear()
+		ran = False
+		for node in self.nodes:
+			vm = node.vm
+			if vm.scheduler.runnable() and vm.cycles() < end:
+				vm.resume(end - vm.cycles())
+				ran = True
+		self.advance(end)
+		outbox = list(self.outbox)
+		self.outbox.clear()
+		return outbox, ran, self.nextTimer()
+
+	def advance(self, time):
+		for node in self.nodes:
+			vm = node.vm
+			if vm.cycles() < time:
+				vm.idleCycles += time - vm.cycles()
+
+	def nextTimer(self):
+		cycles = [node.vm.scheduler.timers.nextCycle() for node in self.nodes]
+		cycles = [cycle for cycle in cycles if cycle != None]
+		if len(cycles) == 0:
+			return None
+		return min(cycles)
+
+#Send each neighbour what we sent its way this round and take what it sent us. peers are
+#(worker, connection) in order of worker
+def exchange(worker, peers, batches, inbox):
+	for peer, connection in peers:
+		if worker < peer:
+			connection.send(batches[peer])
+			inbox += connection.recv()
+		else:
+			inbox += connection.recv()
+			connection.send(batches[peer])
+
+#What each worker process runs, it does as the coordinator tells it over connection.
+#owners gives the workers at the sending and receiving ends of each of our channels
+def work(connection, worker, model, engine, sources, channels, owners, peers):
+	warnings.simplefilter('always')
+	partition = Partition(model, engine, sources, channels)
+	connection.send(partition.boot())
+	while True:
+		command, *arguments = connection.recv()
+		if command == 'round':
+			outbox, ran, timer = partition.round(*arguments)
+			batches = {peer: [] for peer, link in peers}
+			for event in outbox:
+				sender, receiver = owners[event[0]]
+				#Data goes to the receiving end and acknowledgements to the sending end
+				owner = receiver if event[1] == 'data' else sender
+				if owner == worker:
+					partition.inbox.append(event)
+				else:
+					batches[owner].append(event)
+			exchange(worker, peers, batches, partition.inbox)
+			connection.send((ran, len(outbox) > 0, timer))
+		elif command == 'advance':
+			partition.advance(*arguments)
+		elif command == 'finish':
+			connection.send([(node.number, str(node)) for node in partition.nodes])
+			connection.close()
+			return
+
+class DistributedNetwork:
+	def __init__(self, model = defaultModel, engine = 'interpret', quantum = defaultQuantum, workers = None):
+		self.model = model
+		self.engine = engine
+		self.quantum = quantum
+		if workers == None:
+			workers = multiprocessing.cpu_count()
+		self.workers = workers
+		self.sources = []
+		#Each direction of a link as (sender, outputLink, receiver, inputLink), numbered by
+		#where it is in the list
+		self.channels = []
+		self.time = 0
+		#How each node ended up, filled in by run
+		self.results = []
+
+	def add(self, source):
+		self.sources.append(source)
+		return len(self.sources) - 1
+
+	def connect(self, a, linkA, b, linkB):
+		for channel in self.channels:
+			if (channel[0], channel[1]) in ((a, linkA), (b, linkB)):
+				raise ValueError(f'Link {channel[1]} of node {channel[0]} is already connected')
+		self.channels.append((a, linkA, b, linkB))
+		self.channels.append((b, linkB, a, linkA))
+
+	def wire(self, connections):
+		for a, linkA, b, linkB in connections:
+			self.connect(a, linkA, b, linkB)
+
+	#The worker each node is run by, nodes are split into blocks as even as we can
+	def workerOf(self, node):
+		return node * self.workerCount // len(self.sources)
+
+	def run(self, maxRounds = None):
+		self.workerCount = max(1, min(self.workers, len(self.sources)))
+		self.time = 0
+		self.results = []
+		connections = []
+		processes = []
+		owners = [(self.workerOf(channel[0]), self.workerOf(channel[2])) for channel in self.channels]
+		#A pipe between every two workers that share a link
+		peers = [[] for worker in range(self.workerCount)]
+		for pair in sorted({tuple(sorted(pair)) for pair in owners if pair[0] != pair[1]}):
+			ends = multiprocessing.Pipe()
+			peers[pair[0]].append((pair[1], ends[0]))
+			peers[pair[1]].append((pair[0], ends[1]))
+		for worker in range(self.workerCount):
+			sources = [(node, source) for node, source in enumerate(self.sources) if self.workerOf(node) == worker]
+			numbers = [number for number, pair in enumerate(owners) if worker in pair]
+			channels = [(number, *self.channels[number]) for number in numbers]
+			ours, theirs = multiprocessing.Pipe()
+			process = multiprocessing.Process(target = work, args = (theirs, worker, self.model, self.engine, sources, channels,
+				{number: owners[number] for number in numbers}, sorted(peers[worker], key = lambda peer: peer[0])))
+			process.start()
+			connections.append(ours)
+			processes.append(process)
+		try:
+			failed = [connection.recv() for connection in connections]
+			failed = [node for node in failed if node != None]
+			if len(failed) > 0:
+				print(f'Node {failed[0]} could not be loaded')
+			else:
+				self.coordinate(connections, maxRounds)
+			for connection in connections:
+				connection.send(('finish',))
+			for connection in connections:
+				self.results += connection.recv()
+		finally:
+			for process in processes:
+				process.join()
+		self.results.sort()
+
+	def coordinate(self, connections, maxRounds):
+		rounds = 0
+		while maxRounds == None or rounds < maxRounds:
+			rounds += 1
+			end = self.time + self.quantum
+			for connection in connections:
+				connection.send(('round', end))
+			ran = False
+			timers = []
+			sent = False
+			for connection in connections:
+				workerRan, workerSent, timer = connection.recv()
+				ran = ran or workerRan
+				sent = sent or workerSent
+				if timer != None:
+					timers.append(timer)
+			self.time = end
+			if ran or sent:
+				continue
+			#Nothing happened, so either we skip to the first timer or we've finished
+			if len(timers) == 0:
+				break
+			self.time = max(self.time, min(timers))
+			for connection in connections:
+				connection.send(('advance', self.time))
+
+	def __str__(self):
+		return '\n'.join(result for node, result in self.results)
@@ -7,9 +7,18 @@ def report(lineno, coloumno, message, errorType):
 	#We want to provide an easy way of reporting errors.
 	assert issubclass(errorType, Warning), 'Incorrect use of error reporting'
 	if issubclass(errorType, RuntimeWarning):
-		warnings.warn(f'Warning at line {lineno}[{coloumno}], {message}', errorType)
+		warn(f'Warning at line {lineno}[{coloumno}], {message}', errorType, lineno, coloumno, message)
 	else:
-		warnings.warn(f'Error at line {lineno}[{coloumno}], {message}', errorType)
+		warn(f'Error at line {lineno}[{coloumno}], {message}', errorType, lineno, coloumno, message)
+
+#Whatever catches the warning can also find where it came from and what it said without
+#picking apart the text
+def warn(text, errorType, lineno, coloumno, message):
+	warning = errorType(text)
+	warning.line = lineno
+	warning.column = coloumno
+	warning.detail = message
+	warnings.warn(warning)
 
 #This takes care of reporting a terminal Node and avoiding
 #having to manually fetch the relevant lineno and columno
@@ -29,4 +38,18 @@ def reportNode(node, message, errorType):
 		for child in node.children:
 			text += f'{child.getInstruc().text} '
 			text += f'{child.getOperand().text}'
-	warnings.warn(f'Error at line {lineno}[{columno}], {message}: {text}', errorType)
+	warn(f'Error at line {lineno}[{columno}], {message}: {text}', errorType, lineno, columno, f'{message}: {text}')
+
+#The same for the instructions from first up to end of a reps.Code, reported as the terminal
+#Node or chain they would have been
+def reportRows(code, first, end, message, errorType):
+	lineno = code.lines[first]
+	columno = code.columns[first]
+	if end - first == 1:
+		text = f'{code.instructionText(first)} {code.operandText(first)}'
+	else:
+		text = ''
+		for row in range(first, end):
+			text += f'{code.instructionText(row)} '
+			text += f'{code.operandText(row)}'
+	warn(f'Error at line {lineno}[{columno}], {message}: {text}', errorType, lineno, columno, f'{message}: {text}')
@@ -1,5 +1,7 @@
 import reps
-from errors import reportNode
+from errors import reportRows
+from array import array
+from bisect import bisect_left
 import warnings
 
 #We have a class to warn us when a offset at the end of a prefix needs a prefix of
@@ -15,18 +17,99 @@ We have 3 requirements in this section
 1) Expand Double length instructions
 2) Expand Operands longer than 4 bits
 3) Change all the offsets so that they point to the same instruction
+
+We read the statements from one Code and write the expanded statements to another, with
+the offsets as they were. While we correct them an offset is just the prefix sequence it
+needs, and we only write those out once every offset is right.
+
+Correcting an offset can change its length, which moves everything after it, so we go over
+the offsets again and again until none of them change. How far along each statement is is
+kept in a Fenwick tree so it can be found and changed without adding up every statement
+before it, and we keep which offsets jump over each statement. When a statement changes
+length only the offsets that jump over it need correcting again, the rest would come out
+the same as they did before. What an offset points to is looked up by its original
+instruction number in an array of the statement each number is now in, which is changed
+as offsets are corrected or deleted.
 '''
 
+#The instructions that jump by their operand
+offsetTypes = {reps.typeNumbers[reps.TokenType[name]] for name in ('J', 'CJ', 'CALL')}
+
+#A Fenwick tree over how many instructions each statement takes up
+class Distances:
+	def __init__(self, lengths):
+		#Entry i holds the total length of the statements from i - (i & -i) up to i, counting
+		#statements from 1
+		self.tree = tree = array('q', [0]) + lengths
+		for i in range(1, len(tree)):
+			parent = i + (i & -i)
+			if parent < len(tree):
+				tree[parent] += tree[i]
+
+	#How far from the start statement is, the total length of every statement before it
+	def upTo(self, statement):
+		tree = self.tree
+		total = 0
+		while statement > 0:
+			total += tree[statement]
+			statement -= statement & -statement
+		return total
+
+	def add(self, statement, change):
+		tree = self.tree
+		statement += 1
+		while statement < len(tree):
+			tree[statement] += change
+			statement += statement & -statement
+
+#The offsets that jump over each statement. A span of statements is kept on the nodes of a
+#segment tree that between them cover it, at most two on each level, and the spans over a
+#statement are on the nodes above it
+class Spans:
+	def __init__(self, size):
+		self.size = max(size, 1)
+		#The offsets on each node, only for nodes that have any
+		self.nodes = {}
+
+	#The nodes that cover the statements from first up to end
+	def cover(self, first, end):
+		first += self.size
+		end += self.size
+		while first < end:
+			if first & 1:
+				yield first
+				first += 1
+			if end & 1:
+				end -= 1
+				yield end
+			first >>= 1
+			end >>= 1
+
+	def add(self, first, end, offset):
+		for node in self.cover(first, end):
+			self.nodes.setdefault(node, set()).add(offset)
+
+	def remove(self, first, end, offset):
+		for node in self.cover(first, end):
+			self.nodes[node].discard(offset)
+
+	#Every offset whose span has statement in it
+	def over(self, statement):
+		node = statement + self.size
+		while node > 0:
+			yield from self.nodes.get(node, ())
+			node >>= 1
+
 class Expander:
-	def __init__(self,trees):
-		#Copy over the trees
-		self.initTrees= trees
-		
-		self.initalNumInstructions = trees.numLeaves()
+	def __init__(self,code):
+		#Copy over the code
+		self.initCode = code
+
+		self.initalNumInstructions = len(code)
 		#While not neccesasry keeping track of current Instructions proccssed is useful for error checking
 		self.currentInstruc = 0
-		#Initialise the new tree
-		self.expanded = self.translateNode(trees)
+		#Initialise the new code
+		self.expanded = reps.Code(code)
 
 	def expand(self):
 		#We know that all instructions sequences rise to the top because of the structure of the parser
@@ -34,37 +117,40 @@ class Expander:
 		#Single/Prefix
 		#Double
 		#Chain
-		for child in self.initTrees.children:
-			#We build every child up first and then append them
+		code = self.initCode
+		#How many instructions each expanded statement takes up
+		self.lengths = array('q')
+		for statement in range(code.statementCount()):
+			#We build every statement up one after the other
 			#this allows to retain the instruction sequence that we were given
-			if (child.label == 'Chain'):
-				newChild = self.expandChain(child)
-			elif (child.label == 'Single'):
-				newChild = self.expandSingle(child)
-			elif (child.label == 'Offset'):
+			first, end = code.statementRows(statement)
+			self.expanded.startStatement(code.statementNumbers[statement])
+			size = len(self.expanded)
+			label = self.label(code, first, end)
+			if (label == 'Chain'):
+				self.expandChain(first, end)
+			elif (label == 'Single'):
+				self.expandSingle(first)
+			elif (label == 'Offset'):
 				#We let the jump correcter handle Offset insturctions
-				#We do have to create a speical kind of node for offset nodes though
-				newChild = self.translateNode(child, offset = True)
+				self.expanded.copyInstructions(code, first, end)
 				self.currentInstruc +=1
-			elif (child.label == 'Double'):
-				newChild = self.expandDouble(child)
+			elif (label == 'Double'):
+				self.expandDouble(first)
 			else:
-				raise AssertionError(f'{child.label} should not be present at expansion stage')
-			self.expanded.add(newChild)
+				raise AssertionError(f'{label} should not be present at expansion stage')
+			self.lengths.append(len(self.expanded) - size)
 		assert(self.currentInstruc == self.initalNumInstructions), \
 		f'Mismatch in number of instructions, Instructions now: {self.currentInstruc}, Insructions before: {self.initalNumInstructions}'
-		
-		#Set the distances of all the nodes
-		self.expanded.generateDistances()
-		
+
 		#Attempt to correct all the offsets
 		#Assume the code has changed
 		self.offsetChanged = True
 
-		#If we don't run into issues while correcting, return the tree
+		#If we don't run into issues while correcting, return the code
 		self.hadError = False
 		if self.offsetCorrect():
-			return self.expanded
+			return self.writeCorrected()
 		else:
 			return None
 
@@ -73,77 +159,50 @@ class Expander:
 	'''
 
 	#Chains are built by iterating along them
-	def expandChain(self, chainNode):
-		newChain = self.translateNode(chainNode)
-		#In Prefix Check we only allowed the top node to have an invalid value.
+	def expandChain(self, first, end):
+		#In Prefix Check we only allowed the top instruction to have an invalid value.
 		#So we end up only checking the top value here as well
-		topNode = chainNode.children[0]
-		expandedNode = self.expandSingle(topNode)
-		#If we get a terminal node we know that we have the node we put in
-		#and since expandSingle ensures it's a valid chain we know the current chain is valid
-		if (expandedNode.terminal):
-			newChain.add(expandedNode)
-		else:
-			for child in expandedNode.children:
-				newChain.add(child)
-		#Translate and append all the other children
-		for i in range(1,chainNode.numChildren()):
-			newChild = self.translateNode(chainNode.children[i])
-			newChain.add(newChild)
-			self.currentInstruc +=1
-		return newChain
-
-	#Expands nodes which represent a single length insturction/operand pair
-	def expandSingle(self, singleNode):
-		#Get the instruction and operand tokens
-		instructionToken = singleNode.getInstruc()
-		operandToken = singleNode.getOperand()
-		operandValue = operandToken.value
+		self.expandSingle(first)
+		#Copy all the other instructions
+		self.expanded.copyInstructions(self.initCode, first + 1, end)
+		self.currentInstruc += end - first - 1
+
+	#Expands a single length insturction/operand pair
+	def expandSingle(self, row):
+		code = self.initCode
+		operandValue = code.operands[row]
 		#Do we need to expand?
 		if operandValue <16 and operandValue >= 0:
-			#We just translate the node we've been given
-			result = self.translateNode(singleNode)
+			#We just copy the instruction we've been given
+			self.expanded.copyInstructions(code, row, row + 1)
 		else:
-			result = self.generatePrefixSequence(singleNode, operandValue, instructionToken, operandToken)
+			self.generatePrefixSequence(code, row, operandValue, code.numbers[row])
 		self.currentInstruc+=1
-		return result
-
-	#GeneratePrefixSequence generates a series of prefixes
-	def generatePrefixSequence(self, original, value, instructionToken, operandToken):
-		label = original.label
-		#The instruction Number we need depends on the kind of node we're given
-		#If we're giving a basic Node to expand,
-		# the insturction number is euqal to the old distance
-		#If we're given a new LabelledNode however the instructionNumber
-		#is carried across
-		if isinstance(original, reps.LabelledNode):
-			instructionNumber = original.instructionNum
-		else:
-			instructionNumber = original.distance
-		#The final instruction in this sequence must match the type of the original instruction
-		instrucName = instructionToken.typed.name
-		result = reps.LabelledNode('Chain', False, instructionNum = instructionNumber)
+
+	#GeneratePrefixSequence writes out a series of prefixes, ending with the instruction at
+	#row in code, that builds up value. Everything it writes has instructionNumber
+	def generatePrefixSequence(self, code, row, value, instructionNumber):
 		#We obtain the Prefix Sequence we need to generate
-		sequence = self.generatePrefixNumbers(value, instructionToken.typed.name)
-		#We want to create nodes linked to the Operand for all the prefixes we generate
+		sequence = self.generatePrefixNumbers(value, code.typeOf(row).name)
+		self.writeSequence(code, row, sequence, instructionNumber)
+
+	#Write out a prefix sequence for the instruction at row in code. The prefixes are linked
+	#to the original operand and the final instruction to the original instruction
+	def writeSequence(self, code, row, sequence, instructionNumber):
+		expanded = self.expanded
+		operandText = code.operandText(row)
+		operandLine = code.operandLines[row]
+		operandColumn = code.operandColumns[row]
 		for i in range(0,len(sequence)-1):
-			#For each PFIX/NFIX instruction, generate tokens that PFIX/Hold the number we're prefixing by
-			#and that are linked to the original operand
+			#For each PFIX/NFIX instruction, generate an instruction that holds the number
+			#we're prefixing by and that is linked to the original operand
 			part = sequence[i]
-			nodeInstruc = self.translateToken(operandToken, part[0])
-			nodeOperand = self.translateToken(operandToken, 'NUMBER', part[1])
-			#These nodes are prefixing though and we should mark them as such
-			node = self.createInstructionNode('Prefix', instructionNumber, nodeInstruc, nodeOperand)
-			result.add(node)
-		#Finally we create the last node, this has it's instruction linked to the orignal instruction
+			expanded.addInstruction(reps.TokenType[part[0]], part[1], instructionNumber, operandLine, operandColumn,
+				operandText, operandText, operandLine, operandColumn)
+		#Finally we create the last instruction, this is linked to the orignal instruction
 		#but the operand is linked to the original operand
-		lastOperandToken = self.translateToken(operandToken, 'NUMBER' , sequence[-1][1])
-		finalNode = self.createInstructionNode(label, instructionNumber, instructionToken, lastOperandToken)
-		result.add(finalNode)
-		#If we've not prefixed anything just return the final node
-		if result.numChildren() == 1:
-			result =  result.children[0]
-		return result
+		expanded.addInstruction(code.typeOf(row), sequence[-1][1], instructionNumber, code.lines[row], code.columns[row],
+			code.instructionText(row), operandText, operandLine, operandColumn)
 
 	#This returns a valid PFIX/NFIX chain that would result in the desiered value,
 	#an instruction must be entered to sync with the end of the list
@@ -161,120 +220,164 @@ class Expander:
 		return sequence
 
 	#This is expands the case that we have a double length instruction
-	def expandDouble(self, doubleNode):
-		instructionToken = doubleNode.getInstruc()
+	def expandDouble(self, row):
+		code = self.initCode
 		#First we find the instrctionCode
-		instrucCode = instructionToken.typed.instructionCode()
+		instrucCode = code.typeOf(row).instructionCode()
 		#We want to know how far along the instruction was
-		originalDist = doubleNode.distance
-		label = doubleNode.label
+		originalDist = code.numbers[row]
+		#Everything we generate is linked to the original instruction
+		text = code.instructionText(row)
+		line = code.lines[row]
+		column = code.columns[row]
 
 		#To expand a double length instruction we turn it into a
 		#PFIX op0 OPR op1 sequence where op0*16 + op1 is the
 		#insturction code of the original instruction
-		
+
 		#If op0 is equal to 0 we must ignore the PFIX part and just do the OP
 		#Otherwise we must do the PFIX part first and then the OP
-
-		#First check if op0 != 0, in which case we generate the prefix
 		if not int(instrucCode[0],16) == 0:
-			prefixToken= self.translateToken(instructionToken,'PFIX')
-			pOperandToken = self.translateToken(instructionToken,'NUMBER', int(instrucCode[0],16))
-			prefixTree = self.createInstructionNode('Prefix', originalDist, prefixToken, pOperandToken)
+			self.expanded.addInstruction(reps.TokenType.PFIX, int(instrucCode[0],16), originalDist, line, column, text, text, line, column)
 
 		#Then we must generate the OPR op1 regardless
-		operateToken = self.translateToken(instructionToken,'OPR')
-		operateOperandToken = self.translateToken(instructionToken,'NUMBER', int(instrucCode[1],16))
-		operateTree = self.createInstructionNode('Single', originalDist, operateToken, operateOperandToken)
-
-		#Check if op0 = 0 (in base 16)
-		if int(instrucCode[0],16) == 0:
-			#If so we just return the OPR part
-			doubleTree = operateTree
-		else:
-			#Otherwise we should link up PFIX and OPR and return them
-			doubleTree = reps.LabelledNode(label, False,instructionNum = originalDist)
-			doubleTree.add(prefixTree)
-			doubleTree.add(operateTree)
+		self.expanded.addInstruction(reps.TokenType.OPR, int(instrucCode[1],16), originalDist, line, column, text, text, line, column)
 		#We've converted exactly 1 insturction
 		self.currentInstruc +=1
-		return doubleTree
 
 	'''
 	The next section corrects offsets
 	'''
 
 	def offsetCorrect(self):
+		expanded = self.expanded
+		#The highest original instruction number in each statement, which is how we find
+		#what an offset points to
+		self.lastNumbers = [expanded.numbers[expanded.statementRows(statement)[1] - 1] for statement in range(expanded.statementCount())]
+		#The statement each original instruction number is in, or the next statement we still
+		#have if it's gone, and the first number in each statement
+		self.homes = array('q')
+		self.firstNumbers = array('q')
+		for statement, last in enumerate(self.lastNumbers):
+			self.firstNumbers.append(len(self.homes))
+			if last >= len(self.homes):
+				self.homes.extend(array('q', [statement])*(last + 1 - len(self.homes)))
+		#Statements are never moved, one we delete just takes no space
+		self.deleted = bytearray(expanded.statementCount())
+		#The prefix sequence each offset we've corrected is now
+		self.sequences = {}
+		self.distances = Distances(self.lengths)
+		self.spans = Spans(expanded.statementCount())
+		#The statement each offset points to, and the offsets that point to each statement
+		self.destinations = {}
+		self.arrivals = {}
 		#It helps to have a list of offset/reference pairs that we need to correct
 		offsets = self.findOffsets()
+		#Offsets are known by their statement, these are the ones that need correcting
+		self.stale = {offset[0] for offset in offsets}
 		#We first assume that all offset instructions have length 0
 		estimatedOffsetLengths = [0]*len(offsets)
 		#If we jump to an instruction that doesn't exist, don't try to adjust the remaining jumps
 		if self.hadError:
 			return False
-		#We do a loop until we haven't changed anything 
+		#We do a loop until we haven't changed anything
 		while (self.offsetChanged):
 			#We've not changed so far in the loop
 			self.offsetChanged = False
 			#We use a while loop since it's possible that we delete some jumps
 			i = 0
 			while i < len(offsets):
-				#Update the distances of the tree
-				self.expanded.generateDistances()
-				self.correct(offsets, estimatedOffsetLengths, i)
+				#If nothing it depends on has changed an offset would come out the same
+				if offsets[i][0] in self.stale:
+					self.correct(offsets, estimatedOffsetLengths, i)
 				#While it may appear that we can 'skip a node'
 				#That node is checked since another loop is called
 				i+=1
 		return True
 
+	#Change how long a statement is, the offsets that jump over it have to be corrected again
+	def resize(self, statement, length):
+		change = length - self.lengths[statement]
+		if change != 0:
+			self.lengths[statement] = length
+			self.distances.add(statement, change)
+			self.stale.update(self.spans.over(statement))
+
+	#What a statement holds has changed, so the offsets that point to it have to find what
+	#they point to again
+	def moved(self, statement):
+		self.stale.update(self.arrivals.get(statement, ()))
+
+	#Keep track of where an offset points. How far it moves depends on the length of every
+	#statement from the first of it and its destination up to the other
+	def pointAt(self, offset, destination):
+		previous = self.destinations.get(offset)
+		if previous == destination:
+			return
+		if previous != None:
+			self.arrivals[previous].discard(offset)
+			self.spans.remove(min(offset, previous), max(offset, previous), offset)
+		self.destinations[offset] = destination
+		if destination != None:
+			self.arrivals.setdefault(destination, set()).add(offset)
+			self.spans.add(min(offset, destination), max(offset, destination), offset)
+
 	#We find Offsets and the instruction Num that they originally point to
 	def findOffsets(self):
+		expanded = self.expanded
 		offsets = []
-		for child in self.expanded.children:
-			#If it's a chain the last node must be an offset instruction
-			#Or if it's labelled with offset, it's an offset instruction
-			if ((child.label == 'Chain' and child.children[-1].label == 'Offset') or child.label == 'Offset'):
+		for statement in range(expanded.statementCount()):
+			first, end = expanded.statementRows(statement)
+			#If it's a chain the last instruction must be an offset instruction
+			#Or if it's on its own, it must be an offset instruction
+			if expanded.types[end - 1] in offsetTypes:
 				#Iptr'=NextInst'+Oreg=CurrentInstr+1+Oreg
-				requiredInstrucNum = self.buildValue(child)+child.instructionNum+1
-				if requiredInstrucNum > self.expanded.maxInstrucNum():
-					reportNode(child,"Offset Instruction has invalid value ",OffsetPrefixError)
+				requiredInstrucNum = self.buildValue(first, end)+expanded.statementNumbers[statement]+1
+				if requiredInstrucNum > self.maxInstrucNum() or requiredInstrucNum < 0:
+					reportRows(expanded, first, end, "Offset Instruction has invalid value ",OffsetPrefixError)
 					self.hadError = True
-				offsets.append([child,requiredInstrucNum])
+				offsets.append([statement,requiredInstrucNum])
 			#If it's not an offset instruction we don't want to do anything
 		return offsets
 
 	#This corrects individual jumps/calls
 	def correct(self, listOffsets, estimatedLengths, index):
-		#offsetNode is the node that contains the jump/call Instruction
-		#If it's a chain it does refer ot the start of the chain
+		#statement is the statement that holds the jump/call Instruction
+		#If it's a chain we jump from the start of the chain
 		#though the amount we need to jump is determiend from the end of the chain
-		offsetNode = listOffsets[index][0]
-		
-		#destinationNode is the node that the jump/call should point to
-		#We call this every time we correct because if we're jumping to a jump
+		statement = listOffsets[index][0]
+		self.stale.discard(statement)
+
+		#destination is the statement the jump/call should point to and how far into it.
+		#We find it every time we correct because if we're jumping to a jump
 		#It could have moved and we want to jump to the start of its prefix chain
-		destinationNode = self.expanded.findInstrucAtNum(listOffsets[index][1])
+		destination, position = self.findInstrucAtNum(listOffsets[index][1])
+		self.pointAt(statement, destination)
 		#How far we're currently moving
-		desiredLink = destinationNode.distance
-		currentLink = offsetNode.distance
+		desiredLink = self.distances.upTo(destination) + position
+		currentLink = self.distances.upTo(statement)
 		#How much we'll have to move given the current estimated offset
-		#Movement = 
+		#Movement =
 		estimatedMovement = desiredLink - currentLink - estimatedLengths[index]
 		#Note that this == requiredMovement when estimatedLength == realLength
 
 		#This new chain will do that much movement
-		operandToken = offsetNode.rightMostEnd().getOperand()
-		instrucToken = offsetNode.rightMostEnd().getInstruc()
-		newOffset = self.generatePrefixSequence(offsetNode,estimatedMovement,instrucToken,operandToken)
+		finalRow = self.expanded.statementRows(statement)[1] - 1
+		sequence = self.generatePrefixNumbers(estimatedMovement, self.expanded.typeOf(finalRow).name)
 		#And the length of it will be the new expected length
-		newEstimatedLength = newOffset.numLeaves()
+		newEstimatedLength = len(sequence)
 
-		#If we're moving to the next instruction delete this node
+		#If we're moving to the next instruction delete this statement
 		if estimatedMovement==1-estimatedLengths[index]:
 			#If there is none then the instruction is of the form J (next)
 			#In which case we remove this chain altogether
-			#Remove from the tree
-			self.expanded.replaceChild(offsetNode,None)
+			#It no longer takes up space or can be jumped to
+			self.deleted[statement] = 1
+			self.handOn(statement, self.firstNumbers[statement])
+			self.resize(statement, 0)
+			self.moved(statement)
+			self.pointAt(statement, None)
+			self.sequences.pop(statement, None)
 			#Remove from list of pairs
 			listOffsets.pop(index)
 			#Remove from offset Lengths
@@ -287,69 +390,96 @@ class Expander:
 		elif not estimatedLengths[index] == newEstimatedLength:
 			estimatedLengths[index] = newEstimatedLength
 			self.offsetChanged = True
-		#Regardless of updating the length we need to update all references to this node
-		#With it's better version
-		#Update the neccesarry references to the node
-		listOffsets[index][0] = newOffset
-		self.expanded.replaceChild(offsetNode,newOffset)
-	
+			#How far it moves depends on its estimated length so it needs correcting again
+			self.stale.add(statement)
+		#Regardless of updating the length the statement is now this sequence, and every
+		#instruction in it has the statement's number
+		self.sequences[statement] = sequence
+		self.resize(statement, newEstimatedLength)
+		number = self.expanded.statementNumbers[statement]
+		if self.lastNumbers[statement] != number:
+			self.handOn(statement, number + 1)
+			self.lastNumbers[statement] = number
+			self.moved(statement)
+
+	#The numbers from first up to the last one in statement are no longer in it, so they're
+	#now in the statement after it. If there's none after it those numbers are gone
+	def handOn(self, statement, first):
+		homes = self.homes
+		last = self.lastNumbers[statement]
+		if last + 1 < len(homes):
+			after = homes[last + 1]
+			homes[first:last + 1] = array('q', [after])*(last + 1 - first)
+			self.firstNumbers[after] = first
+		else:
+			del homes[first:]
+
+	#The highest original instruction number we still have
+	def maxInstrucNum(self):
+		return len(self.homes) - 1
+
+	#This takes in a number and gives back the statement holding the first instruction
+	#that has the least original number >= requiredNum, and how far into the statement
+	#it is. We give back None if there's no such instruction
+	def findInstrucAtNum(self, requiredNum):
+		#If we're trying to find a non existent instruction we should report there is none
+		if requiredNum > self.maxInstrucNum() or requiredNum < 0:
+			return None
+		statement = self.homes[requiredNum]
+		#Everything in a corrected offset has the statement's number
+		if statement in self.sequences:
+			return statement, 0
+		expanded = self.expanded
+		first, end = expanded.statementRows(statement)
+		return statement, bisect_left(expanded.numbers, requiredNum, first, end) - first
+
+	#Once every offset is right we write out the final code, with each offset's prefix
+	#sequence in place of what it was. Everything between offsets is copied as it is
+	def writeCorrected(self):
+		expanded = self.expanded
+		self.expanded = corrected = reps.Code(expanded)
+		copyFrom = 0
+		for statement in sorted(self.sequences.keys() | {statement for statement, gone in enumerate(self.deleted) if gone}):
+			corrected.copyStatements(expanded, copyFrom, statement)
+			copyFrom = statement + 1
+			if self.deleted[statement]:
+				continue
+			number = expanded.statementNumbers[statement]
+			corrected.startStatement(number)
+			self.writeSequence(expanded, expanded.statementRows(statement)[1] - 1, self.sequences[statement], number)
+		corrected.copyStatements(expanded, copyFrom, expanded.statementCount())
+		return corrected
+
 	'''
 	Everything below is a helper method
 	'''
 
-	#This returns a new node ready to be annotated with the current distance of the node
-	#along with the old node's original distance stored with it
-	#we do NOT carry over the nodes children since those should be rebuilt
-	def translateNode(self, node, offset = False):
-		#For offset nodes we use a slightly different kind of node
-		if offset:
-			newNode = reps.OffsetZeroNode(node.label, node.terminal, instructionNum = node.distance)
-		else:
-			newNode = reps.LabelledNode(node.label, node.terminal, instructionNum = node.distance)
-		#We would also like to have the node have it's instructions and operands attached
-		if node.terminal:
-			newNode.setInstruc(node.getInstruc())
-			newNode.setOperand(node.getOperand())
-		return newNode
-
-	#This creates a node with the given instruction and operandTokens
-	def createInstructionNode(self, label, instrucNum, instructionToken, operandToken):
-		node = reps.LabelledNode(label, True, 0, instructionNum = instrucNum)
-		node.setInstruc(instructionToken)
-		node.setOperand(operandToken)
-		return node
-
-	#Return a new Token corresponding to an old one
-	#We can change type and value value
-	#We must not change the text or line/column number it corresponds to
-	def translateToken(self, token, typed = None, value = None):
-		#If the value isn't changed, change it to typed
-		if (value == None):
-			value = typed
-		typed = reps.TokenType[typed]
-		return reps.Token(typed, token.text, value, token.line, token.column)
-
-	#This finds the operand value of a terminal node
-	def operandValue(self,node):
-		operandToken = node.getOperand()
-		operandValue = int(operandToken.value)
-		return operandValue
+	#The kind of statement the instructions from first up to end make up
+	def label(self, code, first, end):
+		if end - first > 1:
+			return 'Chain'
+		if code.types[first] in offsetTypes:
+			return 'Offset'
+		if len(code.typeOf(first).instructionCode()) == 2:
+			return 'Double'
+		return 'Single'
 
 	#We want to calculate the stored value of a potential chain
-	def buildValue(self,node):
+	def buildValue(self, first, end):
+		expanded = self.expanded
+		#If it's on its own just return the operandValue
+		if end - first == 1:
+			return int(expanded.operands[first])
 		value = 0
-		#If it's terminal just return the operandValue
-		if node.terminal:
-			return self.operandValue(node)
 		#Otherwise eat through the chain
-		for child in node.children:
-			operandValue = self.operandValue(child)
-			instruc = child.getInstruc().typed.name
+		for row in range(first, end):
+			operandValue = int(expanded.operands[row])
+			instruc = expanded.typeOf(row).name
 			if instruc == 'PFIX':
 				value = (value+operandValue) << 4
 			elif instruc =='NFIX':
 				value = (~value) + operandValue << 4
 			else:
-				assert(child == node.children[-1]),f'{instruc} Should not be the final node in a chain'
+				assert(row == end - 1),f'{instruc} Should not be the final node in a chain'
 				value = value + operandValue
 		return value
@@ -0,0 +1,210 @@
+#The history of a run lets us go back through it once it has stopped, a step at a time or
+#straight back to the last time a line ran
+from array import array
+from bisect import bisect_right
+import warnings
+
+'''
+While a run is recorded we take a checkpoint, a snapshot of the VM (see snapshot.py), every
+so many instructions, and between checkpoints we log the instruction count and Iptr the VM
+is left with after each instruction. Checkpoints after the first only hold the pages of
+memory that changed, so the log and the checkpoints together are a compact record of
+how the registers and memory changed.
+
+To go back to any point we restore the last checkpoint before it and run forward from
+there until the instruction count matches, which is never more than a checkpoint's worth
+of instructions however far into the run we are. The VM always runs the same way from the
+same state so we end up exactly where it was.
+
+A prefix chain the VM runs in one go is logged as a single entry, so points in the history
+are found by instruction count rather than by entry. Running forward stops at the exact
+count even part way through a chain, and we can tell which instructions a chain covers
+from how far apart its entry and the next one are.
+
+The history only keeps so much. Once it holds more than its memory cap the oldest
+checkpoints and their logs are let go, and we can't go back past the oldest one left.
+'''
+
+#How many instructions apart checkpoints are taken
+defaultInterval = 10000
+#How many bytes of checkpoints and log a history keeps
+defaultMemoryCap = 64*1024*1024
+#Each instruction logged takes an instruction count and an Iptr
+logEntryBytes = 16
+
+class Checkpoint:
+	def __init__(self, snapshot, count, iptr, cost):
+		self.snapshot = snapshot
+		self.count = count
+		#The instruction count and Iptr after each instruction from here to the next
+		#checkpoint, starting with where the checkpoint itself is
+		self.counts = array('q', [count])
+		self.iptrs = array('q', [iptr])
+		#Roughly how many bytes we free by letting this checkpoint go
+		self.cost = cost + logEntryBytes
+
+#A history records a VM's run by standing in for its tracer, anything traced is passed on
+#to the tracer it stands in for
+class History:
+	def __init__(self, vm, tracer = None, interval = defaultInterval, memoryCap = defaultMemoryCap):
+		self.vm = vm
+		self.tracer = tracer
+		self.interval = interval
+		self.memoryCap = memoryCap
+		self.checkpoints = []
+		self.size = 0
+		#Where we are as (checkpoint, entry in its log)
+		self.position = None
+
+	#Start recording from the state the VM is in now, forgetting anything recorded before
+	def start(self):
+		self.checkpoints = []
+		self.size = 0
+		self.checkpoint()
+
+	def checkpoint(self):
+		vm = self.vm
+		previous = None
+		if len(self.checkpoints) > 0:
+			previous = self.checkpoints[-1].snapshot
+		snapshot = vm.snapshot()
+		self.checkpoints.append(Checkpoint(snapshot, vm.instructionCount, vm.Iptr, self.newBytes(snapshot, previous)))
+		self.size += self.checkpoints[-1].cost
+		self.position = (len(self.checkpoints) - 1, 0)
+		self.evict()
+
+	#The bytes of memory a snapshot holds that the one before it doesn't
+	def newBytes(self, snapshot, previous):
+		total = 0
+		for number, page in snapshot.pages.items():
+			if page != None and (previous == None or previous.pages.get(number) is not page):
+				total += len(page)
+		return total
+
+	#Let the oldest checkpoints go until we're under the cap, the oldest one left then has
+	#to hold every page it shares with the one we let go
+	def evict(self):
+		while self.size > self.memoryCap and len(self.checkpoints) > 1:
+			oldest = self.checkpoints.pop(0)
+			self.size -= oldest.cost
+			first = self.checkpoints[0]
+			added = self.newBytes(first.snapshot, None) - self.newBytes(first.snapshot, oldest.snapshot)
+			first.cost += added
+			self.size += added
+			self.position = (self.position[0] - 1, self.position[1])
+
+	def tracesInstructions(self):
+		return True
+
+	#Called by the VM after every instruction
+	def record(self, vm):
+		checkpointIndex, entry = self.position
+		checkpoint = self.checkpoints[checkpointIndex]
+		#If we went back and the VM was run again what we had after here no longer happened
+		if checkpointIndex != len(self.checkpoints) - 1 or entry != len(checkpoint.counts) - 1:
+			self.forgetAfter(checkpointIndex, entry)
+		if vm.instructionCount - checkpoint.count >= self.interval:
+			self.checkpoint()
+		else:
+			checkpoint.counts.append(vm.instructionCount)
+			checkpoint.iptrs.append(vm.Iptr)
+			checkpoint.cost += logEntryBytes
+			self.size += logEntryBytes
+			self.position = (checkpointIndex, entry + 1)
+			if self.size > self.memoryCap:
+				self.evict()
+		if self.tracer != None and self.tracer.tracesInstructions():
+			self.tracer.record(vm)
+
+	def finish(self, vm):
+		if self.tracer != None:
+			self.tracer.finish(vm)
+
+	def forgetAfter(self, checkpointIndex, entry):
+		for checkpoint in self.checkpoints[checkpointIndex + 1:]:
+			self.size -= checkpoint.cost
+		del self.checkpoints[checkpointIndex + 1:]
+		checkpoint = self.checkpoints[checkpointIndex]
+		dropped = len(checkpoint.counts) - entry - 1
+		del checkpoint.counts[entry + 1:]
+		del checkpoint.iptrs[entry + 1:]
+		checkpoint.cost -= dropped*logEntryBytes
+		self.size -= dropped*logEntryBytes
+
+	#Put the VM back to when it had run count instructions, which has to be in the history.
+	#Our position is the last entry logged at or before it
+	def goTo(self, count):
+		checkpointIndex = bisect_right([checkpoint.count for checkpoint in self.checkpoints], count) - 1
+		checkpoint = self.checkpoints[checkpointIndex]
+		self.vm.restore(checkpoint.snapshot)
+		self.replay(count)
+		self.position = (checkpointIndex, bisect_right(checkpoint.counts, self.vm.instructionCount) - 1)
+
+	#Run the VM on from a checkpoint until it has run count instructions. Anything it
+	#reported has already been reported once so we keep it quiet. Compiled regions can run
+	#past where we want to stop so we always interpret
+	def replay(self, count):
+		vm = self.vm
+		tracer = vm.tracer
+		engine = vm.engine
+		vm.tracer = None
+		vm.engine = 'interpret'
+		try:
+			with warnings.catch_warnings():
+				warnings.simplefilter('ignore')
+				while vm.instructionCount < count:
+					before = vm.instructionCount
+					vm.resume(count - before)
+					if vm.instructionCount == before:
+						break
+		finally:
+			vm.tracer = tracer
+			vm.engine = engine
+
+	#Go back steps instructions, or as far as we can if the history doesn't go back that
+	#far. Gives back how many we went back
+	def stepBack(self, steps = 1):
+		if self.position == None:
+			return 0
+		before = self.vm.instructionCount
+		self.goTo(max(before - steps, self.checkpoints[0].count))
+		return before - self.vm.instructionCount
+
+	#The instructions run from a log entry until the count the next entry is at, as
+	#(address, count). A whole prefix chain run in one go comes between two entries
+	def ranBetween(self, iptr, count, end):
+		vm = self.vm
+		length = end - count
+		if length > 1:
+			operation = None
+			if vm.codeStart <= iptr < vm.codeEnd:
+				operation = vm.fused[iptr - vm.codeStart]
+			#Anything else only ran the instruction at Iptr
+			if operation == None or operation[3] < length:
+				length = 1
+		return [(iptr + offset, count + offset) for offset in range(length)]
+
+	#Go back to the last time the VM was about to run an instruction from line, giving back
+	#False if it wasn't in the history we still have
+	def runBackTo(self, line):
+		if self.position == None:
+			return False
+		vm = self.vm
+		checkpointIndex, entry = self.position
+		#Where what ran after the entry we're looking at ends, we start from now
+		end = vm.instructionCount
+		while checkpointIndex >= 0:
+			checkpoint = self.checkpoints[checkpointIndex]
+			while entry >= 0:
+				count = checkpoint.counts[entry]
+				for address, at in reversed(self.ranBetween(checkpoint.iptrs[entry], count, end)):
+					index = address - vm.codeStart
+					if 0 <= index < len(vm.sourceLines) and vm.sourceLines[index] == line:
+						self.goTo(at)
+						return True
+				end = count
+				entry -= 1
+			checkpointIndex -= 1
+			if checkpointIndex >= 0:
+				entry = len(self.checkpoints[checkpointIndex].counts) - 1
+		return False
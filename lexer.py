@@ -1,4 +1,6 @@
 import reps
+import re
+import itertools
 import warnings
 from errors import report
 
@@ -7,157 +9,127 @@ class LexicalError(Warning):
 	pass
 warnings.filterwarnings('always',category = LexicalError)
 
+#Every instruction's name and its token type so a word is looked up in one go
+instructionTypes = {tokenType.name: tokenType for tokenType in reps.TokenType if tokenType.isInstruction()}
+
+'''
+One pattern matches whatever comes next in the code and the group that matched says what
+it is. Words are runs of letters and numbers are runs of digits with an optional minus in
+front. Spaces and tabs are skipped, a new line or a ; ends a statement, and anything else
+is a single character we don't recognise.
+
+Python's idea of a word character takes in a few characters that aren't letters, like
+superscript digits, so a word with one of those in it is split up again afterwards.
+
+Columns count from the start of a line, except that after the first line they count from
+the new line before it, so the first token on every line after the first is at column 1.
+'''
+tokenPattern = re.compile(r'(?P<word>[^\W\d_]+)|(?P<number>-?\d+)|(?P<blank>[ \t]+)|(?P<newline>\n)|(?P<separator>;)|(?P<other>.)', re.DOTALL)
+
+#How many characters of source we read at a time
+chunkSize = 1 << 20
+
 class Scanner:
+	#The code can be a string or a file opened for reading text, either way it's upper cased
+	#and scanned a block of whole lines at a time so we never hold a copy of all of it
 	def __init__(self,code):
 		#We initialise to the state where we have no code and no tokens
 		self.tokens = []
 		self.code = code
-		#Keeps track of the start of the current lexeme
-		self.start = 0
-		#Keeps track of how charecters through the code we are
-		self.current = 0
 		#Keeps track of the number of lines we've read
-		#And how far through the current line we are
 		self.lineno = 1
-		self.column = 0
-		#It's useful to have the list of instructions
-		self.instructList = self.instrucList()
-		self.hadError = False;
+		self.hadError = False
 
-	#This scans the text for tokens one token at a time
-	#Until we reach the end of the code
+	#This scans all the code and gives back every token, or None if there was an error
 	def scanTokens(self):
-		while not (self.finished()):
-			#Match for a token and then update the current start point and column
-			self.scanToken()
-			self.column += self.current-self.start
-			self.start = self.current
-		#Finish off by adding an EOF
-		self.addToken('EOF', None, 'EOF')
+		self.tokens.extend(self.tokenStream())
 		if (self.hadError):
 			return None
 		else:
 			return self.tokens
 
-	#Are we at the end of the code?
-	def finished(self):
-		return self.current >= len(self.code)
-
-	#Scan the next token until we're done
-	def scanToken(self):
-		char = self.advance()
-		#If the next charecter is a letter we are only interested
-		#in it if it the start of an instruction
-		if self.isAlpha(char):
-			#Check if the following word is an insturction
-			isInstruc = self.isInstruc()
-			#If we have an instruction we add it and move on to the next token
-			if (isInstruc):
-				name = self.code[self.start:self.current]
-				self.addToken(name, name)
-				return
-			#If we don't match here the error is caught at the end of the scan
-			#and the token is rejected there
-
-		#If the charecter is a "-" and the one after is a digit, we have a number
-		if (char == "-" and self.isDigit(self.peek())):
-			self.number()
-			return
-
-		#If the next charecter is a digit we make an integer token
-		if self.isDigit(char):
-			self.number()
-			return
-
-		#If we've hit a space or a 	tab then we move onto the next token
-		if char == ' ' or char == '\t':
-			return
-
-		#If we're at a new line we increment the line counter
-		if char == '\n':
-			self.addToken('NEXT','NEWLINE',text = 'NEWLINE')
-			self.lineno += 1
-			self.column = 0
-			return
-
-		if char == ';':
-			self.addToken('NEXT',';')
+	#This gives back tokens one at a time as they're scanned, ending with an EOF
+	def tokenStream(self):
+		Token = reps.Token
+		number = reps.TokenType.NUMBER
+		next = reps.TokenType.NEXT
+		lineno = 1
+		#Where the block we're scanning starts in the code and where columns on this line
+		#are counted from
+		offset = 0
+		lineStart = 0
+		for block in self.blocks():
+			for found in tokenPattern.finditer(block):
+				kind = found.lastgroup
+				if kind == 'blank':
+					continue
+				text = found.group()
+				column = offset + found.start() - lineStart
+				if kind == 'word':
+					typed = instructionTypes.get(text)
+					if typed != None:
+						yield Token(typed, text, text, lineno, column)
+					elif text.isalpha():
+						#If the word isn't an instruction it's rejected
+						self.unrecognised(text, lineno, column)
+					else:
+						yield from self.mixedWord(text, lineno, column)
+				elif kind == 'number':
+					yield Token(number, text, int(text), lineno, column)
+				elif kind == 'newline':
+					yield Token(next, 'NEWLINE', 'NEWLINE', lineno, column)
+					lineno += 1
+					lineStart = offset + found.start()
+				elif kind == 'separator':
+					yield Token(next, text, text, lineno, column)
+				else:
+					self.unrecognised(text, lineno, column)
+			offset += len(block)
+			self.lineno = lineno
+		#Finish off by adding an EOF
+		yield Token(reps.TokenType.EOF, 'EOF', None, lineno, offset - lineStart)
+
+	#The code upper cased a block at a time. Blocks end at a new line, no token goes over
+	#one, so a token is never split between blocks
+	def blocks(self):
+		code = self.code
+		if isinstance(code, str):
+			start = 0
+			while start < len(code):
+				end = code.find('\n', start + chunkSize)
+				end = len(code) if end == -1 else end + 1
+				yield code[start:end].upper()
+				start = end
 			return
-
-		#If nothing matches then we have a lexical error
-		#We create the unmatched string and then print it
-		unmatched = self.code[self.start:self.current]
-		report(self.lineno, self.column, "Unrecognised token: " + unmatched, LexicalError)
-		self.hadError = True
-
-	#Text is overrideable but in most cases is left as it is
-	def addToken(self, typed, value, text = None):
-		#Since python doesn't allowing using self in function defintions we hack around it
-		#by initalising text to None
-		if (text == None):
-			text = self.code[self.start:self.current]
-		#We want to turn the type of tokens into proper Token Types
-		typed = reps.TokenType[typed]
-		self.tokens.append(reps.Token(typed, text, value, self.lineno, self.column))
-
-	'''
-	Everything below is a helper method
-	'''
-
-	#Move forward by 1 and return the next charecter
-	def advance(self):
-		#We add the current charecter to the token we're considering
-		self.current +=1
-		return self.code[self.current - 1]
-
-	#Just return the next charecter
-	def peek(self):
-		#First we check if we're at the end
-		if (self.finished()):
-			return None
-		#If not we'll return the current charecter
-		else:
-			return self.code[self.current]
-
-	#This allows us to proccess what Tokens are instructions
-	def instrucList(self):
-		instrucs = []
-		#We only want to include instructions 
-		for i in reps.TokenType:
-			if i.isInstruction():
-				instrucs.append(i.name)
-		instrucs = sorted(instrucs, key = len, reverse = True)
-		return instrucs
-
-	#We want to check if the following word is an insturction
-	def isInstruc(self):
-		#Keep going till we have the whole word processed
-		while(self.isAlpha(self.peek())):
-			self.advance()
-		#If it matches an instruction we have a match
-		for posIdent in self.instructList:
-			if (self.code[self.start:self.current] == posIdent):
-				return True
-		return False
-
-	#We need this since char can be None and the inbuilt method
-	#Only works for strings
-	def isAlpha(self,char):
-		try:
-			return (char.isalpha())
-		except:
-			return False
-
-	#Checks if a certain charecter can be an integer
-	def isDigit(self,char):
-		try:
-			int(char)
-			return True
-		except:
-			return False
-
-	#We proccess this number until it ends
-	def number(self):
-		while (self.isDigit(self.peek())):
-			self.advance()
-		self.addToken('NUMBER',int(self.code[self.start:self.current]))
\ No newline at end of file
+		left = ''
+		while True:
+			chunk = code.read(chunkSize)
+			if chunk == '':
+				break
+			left += chunk
+			end = left.rfind('\n') + 1
+			if end > 0:
+				yield left[:end].upper()
+				left = left[end:]
+		if left != '':
+			yield left.upper()
+
+	#A word with characters in it that aren't letters is split into runs of letters, which
+	#are words, and each character between them, which we don't recognise
+	def mixedWord(self, text, lineno, column):
+		for isLetters, run in itertools.groupby(text, str.isalpha):
+			run = ''.join(run)
+			if isLetters:
+				typed = instructionTypes.get(run)
+				if typed != None:
+					yield reps.Token(typed, run, run, lineno, column)
+				else:
+					self.unrecognised(run, lineno, column)
+			else:
+				for offset, char in enumerate(run):
+					self.unrecognised(char, lineno, column + offset)
+			column += len(run)
+
+	def unrecognised(self, text, lineno, column):
+		report(lineno, column, "Unrecognised token: " + text, LexicalError)
+		self.hadError = True
\ No newline at end of file
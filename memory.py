@@ -0,0 +1,210 @@
+import struct
+
+'''
+The VM's memory can be held in one of two ways which provide the same methods:
+
+FlatMemory holds the whole address space as one block of bytes, this is fastest
+but is only practical when the address space is small, like on a 16 bit transputer
+
+PagedMemory splits the address space into fixed size pages which are only allocated
+when they are first written to. Pages that haven't been touched read as zero.
+This lets a 32 bit transputer with 4GB of address space be simulated when a program
+only touches a small part of it
+
+Both are indexed by (unsigned) byte address and read and write whole words through
+a little endian codec sized by the number of bytes in a word
+
+Both also keep the set of pages written to since it was last cleared, so that a snapshot
+only has to save the pages that have changed since the one before it (see snapshot.py)
+'''
+
+#We choose flat memory for anything up to this size
+flatMemoryLimit = 2**16
+#Pages hold 4KB
+defaultPageBits = 12
+
+#The codec that reads and writes a word of the given size
+def wordCodec(bytesPerWord):
+	return struct.Struct('<' + {1:'B', 2:'H', 4:'I', 8:'Q'}[bytesPerWord])
+
+#Choose the kind of memory that suits the size of the address space
+def createMemory(size, bytesPerWord):
+	if size <= flatMemoryLimit:
+		return FlatMemory(size, bytesPerWord)
+	else:
+		return PagedMemory(size, bytesPerWord)
+
+class FlatMemory:
+	def __init__(self, size, bytesPerWord, pageBits = defaultPageBits):
+		self.size = size
+		self.pageBits = pageBits
+		self.pageSize = 1 << pageBits
+		self.data = bytearray(size)
+		#We look at our memory through a memoryview so that slicing doesn't copy
+		self.view = memoryview(self.data)
+		self.word = wordCodec(bytesPerWord)
+		#The numbers of the pages written to since this was last cleared
+		self.dirty = set()
+
+	def __len__(self):
+		return self.size
+
+	def __getitem__(self, address):
+		return self.view[address]
+
+	def __setitem__(self, address, value):
+		self.view[address] = value
+		self.dirty.add(address >> self.pageBits)
+
+	#What the fetch loop should index to read instructions, a memoryview is
+	#fastest for us
+	def fetchView(self):
+		return self.view
+
+	def readWord(self, address):
+		return self.word.unpack_from(self.view, address)[0]
+
+	def writeWord(self, address, value):
+		self.word.pack_into(self.view, address, value)
+		self.dirty.add(address >> self.pageBits)
+
+	#Write a block of bytes starting at address
+	def writeBytes(self, address, data):
+		self.view[address:address+len(data)] = data
+		self.touch(address, len(data))
+
+	#Mark the pages a block of bytes covers as written to
+	def touch(self, address, length):
+		if length > 0:
+			self.dirty.update(range(address >> self.pageBits, ((address + length - 1) >> self.pageBits) + 1))
+
+	def readBytes(self, address, length):
+		return bytes(self.view[address:address+length])
+
+	#Copy a block of bytes from one place to another as a single slice
+	def copy(self, destination, source, length):
+		self.view[destination:destination+length] = self.view[source:source+length]
+		self.touch(destination, length)
+
+	#All of flat memory is always resident
+	def residentPages(self):
+		return (self.size + self.pageSize - 1) // self.pageSize
+
+	#The numbers of every page there is
+	def pageNumbers(self):
+		return range(self.residentPages())
+
+	#A copy of a page's contents
+	def readPage(self, number):
+		start = number << self.pageBits
+		return bytes(self.view[start:start+self.pageSize])
+
+	#Put back a page's contents as readPage gave them, without marking it as written
+	def writePage(self, number, data):
+		start = number << self.pageBits
+		self.view[start:start+len(data)] = data
+
+class PagedMemory:
+	def __init__(self, size, bytesPerWord, pageBits = defaultPageBits):
+		self.size = size
+		self.pageBits = pageBits
+		self.pageSize = 1 << pageBits
+		self.offsetMask = self.pageSize - 1
+		#Pages are only created when first written to
+		self.pages = {}
+		self.word = wordCodec(bytesPerWord)
+		#The numbers of the pages written to since this was last cleared
+		self.dirty = set()
+
+	def __len__(self):
+		return self.size
+
+	def __getitem__(self, address):
+		page = self.pages.get(address >> self.pageBits)
+		if page == None:
+			return 0
+		return page[address & self.offsetMask]
+
+	def __setitem__(self, address, value):
+		self.page(address)[address & self.offsetMask] = value
+
+	#Paged memory has no single view so the fetch loop indexes us directly
+	def fetchView(self):
+		return self
+
+	#Find the page an address is in, making it if it doesn't exist yet
+	#Everything that writes finds its page here, so this is where pages are marked as written
+	def page(self, address):
+		pageNumber = address >> self.pageBits
+		self.dirty.add(pageNumber)
+		page = self.pages.get(pageNumber)
+		if page == None:
+			page = bytearray(self.pageSize)
+			self.pages[pageNumber] = page
+		return page
+
+	#Words are aligned and pages are a whole number of words so a word never
+	#crosses a page boundary
+	def readWord(self, address):
+		page = self.pages.get(address >> self.pageBits)
+		if page == None:
+			return 0
+		return self.word.unpack_from(page, address & self.offsetMask)[0]
+
+	def writeWord(self, address, value):
+		self.word.pack_into(self.page(address), address & self.offsetMask, value)
+
+	#Write a block of bytes starting at address, a page at a time
+	def writeBytes(self, address, data):
+		data = memoryview(data)
+		while len(data) > 0:
+			offset = address & self.offsetMask
+			length = min(len(data), self.pageSize - offset)
+			self.page(address)[offset:offset+length] = data[:length]
+			data = data[length:]
+			address += length
+
+	#Read a block of bytes starting at address, a page at a time
+	def readBytes(self, address, length):
+		chunks = []
+		while length > 0:
+			offset = address & self.offsetMask
+			size = min(length, self.pageSize - offset)
+			page = self.pages.get(address >> self.pageBits)
+			if page == None:
+				chunks.append(bytes(size))
+			else:
+				chunks.append(page[offset:offset+size])
+			length -= size
+			address += size
+		return b''.join(chunks)
+
+	#Copy a block of bytes from one place to another, a page at a time rather than a byte
+	#at a time
+	def copy(self, destination, source, length):
+		self.writeBytes(destination, self.readBytes(source, length))
+
+	def residentPages(self):
+		return len(self.pages)
+
+	#The numbers of the pages that have been made
+	def pageNumbers(self):
+		return list(self.pages)
+
+	#A copy of a page's contents, None if it hasn't been made
+	def readPage(self, number):
+		page = self.pages.get(number)
+		if page == None:
+			return None
+		return bytes(page)
+
+	#Put back a page's contents as readPage gave them, without marking it as written
+	def writePage(self, number, data):
+		if data == None:
+			self.pages.pop(number, None)
+		else:
+			page = self.pages.get(number)
+			if page == None:
+				self.pages[number] = bytearray(data)
+			else:
+				page[:] = data
@@ -0,0 +1,121 @@
+#Real parts have a little fast RAM on chip and slower memory outside it, this counts how a
+#timed run uses each
+'''
+The on-chip RAM starts at MostNeg, so the reserved words, the start of the program and
+whatever workspace is placed just above it are fast. Anything past the end of it is
+external memory, where every access costs the wait states of the memory system on top of
+the instruction's own cycles.
+
+While a timed run goes on the VM's readMem, writeMem, readByte and writeByte are wrapped so
+every access is counted against the region it falls in. Instructions are fetched a word at
+a time, a fetch being counted whenever execution moves on to a word it didn't just fetch.
+Messages copied between processes count a read and a write for each word.
+
+The wait states an instruction runs into are held until the VM adds them to that
+instruction's cycles, so they also show up in the totals for each process and line.
+'''
+
+#The kinds of access we count and the regions we count them in
+accessKinds = ('readMem', 'writeMem', 'readByte', 'writeByte', 'fetch')
+onChip = 'on-chip'
+external = 'external'
+regions = (onChip, external)
+
+class MemoryTiming:
+	def __init__(self, vm, onChipBytes, waitStates):
+		self.vm = vm
+		self.onChipStart = vm.signBit
+		self.onChipBytes = onChipBytes
+		#The extra cycles each access to external memory takes
+		self.waitStates = waitStates
+		self.wordMask = vm.wordMask
+		self.bytesPerWord = vm.bytesPerWord
+		self.installed = False
+		self.reset()
+
+	#Forget everything counted so far
+	def reset(self):
+		self.counts = {region: dict.fromkeys(accessKinds, 0) for region in regions}
+		#Wait states that haven't been added to an instruction's cycles yet
+		self.stall = 0
+		#All the cycles spent waiting on external memory
+		self.lost = 0
+		#The word instructions were last fetched from
+		self.lastFetch = None
+
+	#Everything counted so far, for a snapshot
+	def save(self):
+		return {region: dict(counts) for region, counts in self.counts.items()}, self.stall, self.lost, self.lastFetch
+
+	#Go back to counting from what save gave back
+	def load(self, saved):
+		counts, self.stall, self.lost, self.lastFetch = saved
+		self.counts = {region: dict(kinds) for region, kinds in counts.items()}
+
+	def region(self, address):
+		if (address - self.onChipStart) & self.wordMask < self.onChipBytes:
+			return onChip
+		return external
+
+	#Count words accessed of a kind starting at address
+	def access(self, kind, address, words = 1):
+		region = self.region(address & self.wordMask)
+		self.counts[region][kind] += words
+		if region == external:
+			self.stall += words*self.waitStates
+
+	#Count fetching the instructions from start up to end
+	def fetch(self, start, end):
+		first = start // self.bytesPerWord
+		last = (end - 1) // self.bytesPerWord
+		if first == self.lastFetch:
+			first += 1
+		if first <= last:
+			self.access('fetch', first*self.bytesPerWord, last - first + 1)
+		self.lastFetch = last
+
+	#Count a message copied from source to destination
+	def copy(self, destination, source, count):
+		words = -(-count // self.bytesPerWord)
+		self.access('readMem', source, words)
+		self.access('writeMem', destination, words)
+
+	#Take the wait states run into since we were last asked
+	def take(self):
+		stall = self.stall
+		self.lost += stall
+		self.stall = 0
+		return stall
+
+	#Wrap the VM's memory methods so every access through them is counted
+	def install(self):
+		if self.installed:
+			return
+		self.installed = True
+		vm = self.vm
+		for kind in ('readMem', 'writeMem', 'readByte', 'writeByte'):
+			setattr(vm, kind, self.counted(kind, getattr(vm, kind)))
+
+	def counted(self, kind, method):
+		def countedMethod(address, *value):
+			self.access(kind, address)
+			return method(address, *value)
+		return countedMethod
+
+	#Put the VM's own memory methods back
+	def uninstall(self):
+		if not self.installed:
+			return
+		self.installed = False
+		for kind in ('readMem', 'writeMem', 'readByte', 'writeByte'):
+			delattr(self.vm, kind)
+
+	#How the run used each region and what external memory cost it
+	def report(self, cycles):
+		text = [f'Memory accesses, {self.onChipBytes} bytes on chip and {self.waitStates} wait states outside:']
+		text.append(f'  {"":10}{onChip:>10}{external:>10}')
+		for kind in accessKinds:
+			text.append(f'  {kind:10}{self.counts[onChip][kind]:>10}{self.counts[external][kind]:>10}')
+		share = 100*self.lost / cycles if cycles > 0 else 0
+		text.append(f'{self.lost} cycles lost to external memory, {share:.1f}% of the run')
+		return '\n'.join(text)
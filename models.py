@@ -0,0 +1,38 @@
+import math
+
+'''
+A Model describes the transputer part being simulated. Everything that depends on
+the word size is worked out once here so the VM can use masks instead of
+recalculating powers of 2 as it runs
+'''
+class Model:
+	def __init__(self, name, bit, onChipBytes):
+		self.name = name
+		self.bit = bit
+		#How much fast RAM the part has on chip, starting at MostNeg
+		self.onChipBytes = onChipBytes
+		self.bytesPerWord = bit // 8
+		#The bottom bits of an address select a byte within a word
+		self.byteSelectLength = math.ceil(math.log(self.bytesPerWord,2))
+		self.byteSelectMask = (1 << self.byteSelectLength) - 1
+		#Masks that wrap numbers to a word
+		self.wordMask = (1 << bit) - 1
+		self.signBit = 1 << (bit - 1)
+		#The range of signed numbers a word can hold
+		self.mostNeg = -(1 << (bit - 1))
+		self.mostPos = (1 << (bit - 1)) - 1
+		#How many bytes can be addressed
+		self.addressSpace = 1 << bit
+
+	def __str__(self):
+		return f'{self.name} ({self.bit} bit)'
+
+#The parts we can simulate, chosen by name
+models = {
+	't212': Model('T212', 16, 2048),
+	't414': Model('T414', 32, 2048),
+	't800': Model('T800', 32, 4096),
+}
+
+#We simulate a 16 bit transputer unless told otherwise
+defaultModel = 't212'
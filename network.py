@@ -0,0 +1,290 @@
+#A network is a number of transputers, each a VM running its own program, joined by links
+from Interpreter import Interpreter
+from models import models, defaultModel
+import warnings
+import argparse
+import math
+
+'''
+Each transputer has 4 links and each link carries messages both ways. On the VM a link is
+a pair of channel words at MostNeg, an output channel and an input channel, and a process
+uses them with IN and OUT just like internal channels.
+
+One direction of a link is a LinkChannel. It holds the process outputting on one VM and
+the process inputting on the other until both are there, then copies as many bytes as it
+can between them. Links carry bytes, so a message doesn't have to be read with a single
+IN of the same length. Once a process has sent or received everything it asked for it is
+put back on its VM's queue.
+
+The VMs are co-scheduled in rounds. Every round each VM with work to do runs for a quantum
+of cycles, always in the same order, and every VM's clock is brought up to the end of the
+round whether it ran or not. If nothing can run but processes are waiting on timers every
+clock jumps to the first one that's due. Since only one VM runs at a time and the order
+never changes, a network always runs the same way.
+'''
+
+#How many cycles each VM runs for in a round
+defaultQuantum = 1000
+
+class LinkChannel:
+	def __init__(self, sender, outputLink, receiver, inputLink):
+		self.sender = sender
+		self.receiver = receiver
+		#The channel words the link uses on each VM
+		self.outputAddress = sender.linkStart + outputLink*sender.bytesPerWord
+		self.inputAddress = receiver.linkStart + (4 + inputLink)*receiver.bytesPerWord
+		#[Wdesc, pointer, bytes left] for the processes waiting on each end
+		self.outputting = None
+		self.inputting = None
+
+	#Is there a message waiting to be input?
+	def ready(self):
+		return self.outputting != None
+
+	def output(self, wdesc, pointer, count):
+		self.outputting = [wdesc, pointer, count]
+		if self.inputting == None:
+			#If there's an ALT waiting on the other end it's woken
+			receiver = self.receiver
+			word = receiver.memory.readWord(self.inputAddress)
+			if word != receiver.scheduler.notProcess:
+				receiver.scheduler.altReady(word)
+		self.transfer()
+
+	def input(self, wdesc, pointer, count):
+		self.inputting = [wdesc, pointer, count]
+		self.transfer()
+
+	#Copy what we can from the outputting process to the inputting one
+	def transfer(self):
+		if self.outputting == None or self.inputting == None:
+			return
+		outputting = self.outputting
+		inputting = self.inputting
+		count = min(outputting[2], inputting[2])
+		data = self.sender.memory.readBytes(outputting[1], count)
+		self.receiver.memory.writeBytes(inputting[1], data)
+		outputting[1] += count
+		outputting[2] -= count
+		inputting[1] += count
+		inputting[2] -= count
+		if inputting[2] == 0:
+			self.inputting = None
+			self.finish(self.receiver, self.inputAddress, inputting[0])
+		if outputting[2] == 0:
+			self.outputting = None
+			self.finish(self.sender, self.outputAddress, outputting[0])
+
+	def finish(self, vm, address, wdesc):
+		vm.memory.writeWord(address, vm.scheduler.notProcess)
+		vm.scheduler.enqueue(wdesc)
+
+	def reset(self):
+		self.outputting = None
+		self.inputting = None
+
+#A node is a VM with the program it runs
+class Node:
+	def __init__(self, number, source, model = defaultModel, engine = 'interpret'):
+		self.number = number
+		self.source = source
+		self.interpreter = Interpreter(model = model, engine = engine)
+		self.vm = self.interpreter.vm
+		#The network keeps time for us
+		self.vm.skipIdle = False
+
+	def __str__(self):
+		return f'Node {self.number}: {self.vm}'
+
+class Network:
+	def __init__(self, model = defaultModel, engine = 'interpret', quantum = defaultQuantum):
+		self.model = model
+		self.engine = engine
+		self.quantum = quantum
+		self.nodes = []
+		self.channels = []
+		#Cycles since the network started
+		self.time = 0
+
+	#Add a node running source, giving back its number
+	def add(self, source):
+		node = Node(len(self.nodes), source, self.model, self.engine)
+		self.nodes.append(node)
+		return node.number
+
+	#Join link linkA of node a to link linkB of node b, in both directions
+	def connect(self, a, linkA, b, linkB):
+		vmA = self.nodes[a].vm
+		vmB = self.nodes[b].vm
+		for node, link in ((a, linkA), (b, linkB)):
+			if self.nodes[node].vm.outputLinks[link] != None:
+				raise ValueError(f'Link {link} of node {node} is already connected')
+		forward = LinkChannel(vmA, linkA, vmB, linkB)
+		backward = LinkChannel(vmB, linkB, vmA, linkA)
+		vmA.outputLinks[linkA] = forward
+		vmB.inputLinks[linkB] = forward
+		vmB.outputLinks[linkB] = backward
+		vmA.inputLinks[linkA] = backward
+		self.channels += [forward, backward]
+
+	#Make every connection in a list of (a, linkA, b, linkB)
+	def wire(self, connections):
+		for a, linkA, b, linkB in connections:
+			self.connect(a, linkA, b, linkB)
+
+	#Assemble and load every node's program, each starts with its node number in Areg.
+	#Gives back False if any of them couldn't be loaded
+	def boot(self):
+		self.time = 0
+		for channel in self.channels:
+			channel.reset()
+		for node in self.nodes:
+			assembled = node.interpreter.assemble(node.source)
+			if assembled == None or not node.vm.boot(assembled):
+				print(f'Node {node.number} could not be loaded')
+				return False
+			node.vm.push(node.number)
+		return True
+
+	#Run one round, giving back False if nothing could run
+	def round(self):
+		end = self.time + self.quantum
+		ran = False
+		for node in self.nodes:
+			vm = node.vm
+			if vm.scheduler.runnable() and vm.cycles() < end:
+				vm.resume(end - vm.cycles())
+				ran = True
+		self.advance(end)
+		return ran
+
+	#Bring every clock up to time
+	def advance(self, time):
+		self.time = time
+		for node in self.nodes:
+			vm = node.vm
+			if vm.cycles() < time:
+				vm.idleCycles += time - vm.cycles()
+
+	#When nothing can run we skip to the first timer that's due, giving back False if
+	#there are none
+	def skipToTimer(self):
+		cycles = [node.vm.scheduler.timers.nextCycle() for node in self.nodes]
+		cycles = [cycle for cycle in cycles if cycle != None]
+		if len(cycles) == 0:
+			return False
+		self.advance(max(self.time, min(cycles)))
+		return True
+
+	#Run until every node has finished or is waiting on something that will never happen,
+	#or for at most maxRounds rounds
+	def run(self, maxRounds = None):
+		if not self.boot():
+			return
+		rounds = 0
+		while maxRounds == None or rounds < maxRounds:
+			rounds += 1
+			if not self.round() and not self.skipToTimer():
+				break
+
+	def __str__(self):
+		return '\n'.join(str(node) for node in self.nodes)
+
+'''
+Topologies give back the connections for a number of nodes as (a, linkA, b, linkB)
+'''
+#Each node's link 1 goes to the next node's link 0
+def pipeline(nodes):
+	return [(i, 1, i + 1, 0) for i in range(nodes - 1)]
+
+#A pipeline where the last node goes back to the first
+def ring(nodes):
+	connections = pipeline(nodes)
+	if nodes > 2:
+		connections.append((nodes - 1, 1, 0, 0))
+	return connections
+
+#Nodes numbered across rows, link 0 is north, 1 east, 2 south and 3 west
+def grid(width, height):
+	connections = []
+	for y in range(height):
+		for x in range(width):
+			node = y*width + x
+			if x + 1 < width:
+				connections.append((node, 1, node + 1, 3))
+			if y + 1 < height:
+				connections.append((node, 2, node + width, 0))
+	return connections
+
+#Link k of each node goes to the node whose number differs from it in bit k
+def hypercube(dimensions):
+	assert dimensions <= 4, 'A transputer only has 4 links'
+	connections = []
+	for node in range(1 << dimensions):
+		for link in range(dimensions):
+			other = node ^ (1 << link)
+			if node < other:
+				connections.append((node, link, other, link))
+	return connections
+
+#The connections for a topology given by name
+def topology(name, nodes, width = None):
+	if name == 'pipeline':
+		return pipeline(nodes)
+	if name == 'ring':
+		return ring(nodes)
+	if name == 'grid':
+		if width == None:
+			width = int(math.sqrt(nodes))
+		if nodes % width != 0:
+			raise ValueError(f'{nodes} nodes can\'t make a grid {width} wide')
+		return grid(width, nodes // width)
+	if name == 'hypercube':
+		dimensions = nodes.bit_length() - 1
+		if 1 << dimensions != nodes:
+			raise ValueError(f'A hypercube needs a power of 2 nodes, not {nodes}')
+		return hypercube(dimensions)
+	raise ValueError(f'{name} is not a topology')
+
+topologies = ['pipeline', 'ring', 'grid', 'hypercube']
+
+def start():
+	parser = argparse.ArgumentParser(description = 'Run a network of transputers')
+	parser.add_argument('files', nargs = '+', help = 'the .tn program for each node, or one for all of them')
+	parser.add_argument('--topology', choices = topologies, default = 'pipeline')
+	parser.add_argument('--nodes', type = int, help = 'how many nodes there are, by default one per file')
+	parser.add_argument('--width', type = int, help = 'how wide a grid is')
+	parser.add_argument('--model', choices = sorted(models), default = defaultModel)
+	parser.add_argument('--engine', choices = ['interpret', 'compile'], default = 'interpret')
+	parser.add_argument('--quantum', type = int, default = defaultQuantum, help = 'how many cycles each node runs for in a round')
+	parser.add_argument('--workers', type = int, help = 'share the network between this many worker processes')
+	arguments = parser.parse_args()
+	nodes = arguments.nodes
+	if nodes == None:
+		nodes = len(arguments.files)
+	if len(arguments.files) != 1 and len(arguments.files) != nodes:
+		parser.error('give one file for every node or a single file for all of them')
+	sources = []
+	for filePath in arguments.files:
+		with open(filePath, 'r') as f:
+			sources.append(f.read())
+	if len(sources) == 1:
+		sources = sources*nodes
+	if arguments.workers == None:
+		network = Network(arguments.model, arguments.engine, arguments.quantum)
+	else:
+		#Imported here since it imports us
+		from distributed import DistributedNetwork
+		network = DistributedNetwork(arguments.model, arguments.engine, arguments.quantum, arguments.workers)
+	for source in sources:
+		network.add(source)
+	try:
+		network.wire(topology(arguments.topology, nodes, arguments.width))
+	except ValueError as error:
+		parser.error(str(error))
+	warnings.simplefilter('always')
+	network.run()
+	print(network)
+
+if __name__ == '__main__':
+	start()
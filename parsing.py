@@ -37,10 +37,12 @@ We leave the issue that Double Instructions might have nothing to run on to the
 time error checking since that's more appropriate.
 '''
 class Parser:
+	#The tokens can be a list or anything else we can iterate over, like a scanner's token
+	#stream. We only ever look one token ahead so they're taken as they're needed
 	def __init__(self,tokens):
-		self.tokens = tokens
-		#Keep track of how many tokens through we are
-		self.current = 0
+		self.tokens = iter(tokens)
+		#The next token, the one we look at before we eat it
+		self.lookahead = next(self.tokens)
 		#How many instructions we've consumed
 		self.distance = 0
 		#Intialise the tree that we're retruning
@@ -51,15 +53,8 @@ class Parser:
 		self.currentStmtError=False
 
 	def parse(self):
-		#Keep going till we hit the EOF
-		while not (self.atEnd()):
-			#Match a stmt
-			newStmt = self.buildStmt()
-			if newStmt == None:
-				#If we have an invalid stmt, don't return it
-				break
-			else:
-				self.stmts.add(newStmt)
+		for newStmt in self.statements():
+			self.stmts.add(newStmt)
 		#If we have an error return none
 		if (self.hadError):
 			return None
@@ -67,6 +62,17 @@ class Parser:
 		else:
 			return self.stmts
 
+	#This gives back each stmt as soon as it's matched, stopping at the first invalid one
+	def statements(self):
+		#Keep going till we hit the EOF
+		while not (self.atEnd()):
+			#Match a stmt
+			newStmt = self.buildStmt()
+			if newStmt == None:
+				#If we have an invalid stmt, don't return it
+				return
+			yield newStmt
+
 	#This corresponds to matching the stmt in the CFG
 	def buildStmt(self):
 		#We have no errors at the start of the stmt
@@ -199,12 +205,15 @@ class Parser:
 
 	#Move to the next token
 	def advance(self):
-		self.current+=1
-		return self.tokens[self.current - 1]
+		token = self.lookahead
+		#There's nothing after the EOF so we stay on it
+		if token.typed != reps.TokenType.EOF:
+			self.lookahead = next(self.tokens)
+		return token
 
 	#Check the next token
 	def peek(self):
-		return self.tokens[self.current]
+		return self.lookahead
 
 	#Check if a token represents an integer
 	def isInteger(self,typeToken):
@@ -12,21 +12,31 @@ While doing this we also removes leading PFIX 0 instructions
 '''
 
 class PrefixPreparer:
-	def __init__(self, trees):
+	#We only need trees to prepare all of them at once, statements can be prepared one at a
+	#time without them
+	def __init__(self, trees = None):
 			self.trees = trees
 			self.hadError = False
 
 	def prepare(self):
-		for sequence in self.trees.children:
-			#We're only interested in Chain Nodes
-			if sequence.label == 'Chain':
-				self.checkChain(sequence, self.trees)
+		children = self.trees.children
+		for index, sequence in enumerate(children):
+			children[index] = self.prepareStatement(sequence)
 		if self.hadError:
 			return None
 		else: 
 			return self.trees
 
-	def checkChain(self, chain, parent):
+	#Check a single statement, giving back what should take its place in the trees. This
+	#lets statements be checked one at a time as they're parsed
+	def prepareStatement(self, sequence):
+		#We're only interested in Chain Nodes
+		if sequence.label == 'Chain':
+			return self.checkChain(sequence)
+		return sequence
+
+	#Gives back the chain, or the one node left in it if that's all there is
+	def checkChain(self, chain):
 		index = 0
 		#We iterate through the chain and update it's length as we go
 		while (index < chain.numChildren()):
@@ -40,7 +50,8 @@ class PrefixPreparer:
 				self.checkTerminal(currentNode)
 				index +=1
 		if chain.numChildren()==1:
-			parent.replaceChild(chain,currentNode)
+			return currentNode
+		return chain
 
 	def uselessPrefix(self,prefixNode):
 		#Find the opernad so we can check if it's 0
@@ -0,0 +1,145 @@
+#What a program is once it's assembled and what we know about a run of it, for driving the
+#simulator from Python without anything being printed
+import warnings
+import reps
+import lexer
+import parsing
+import prefixChecking
+import expanding
+
+'''
+assemble(source) gives back a Program and VM.run(program, maxSteps) gives back a RunResult.
+The source can be the code or a file opened for reading it. Neither prints anything: everything that would have been reported is kept as a Diagnostic
+instead, with the line and column it came from.
+
+	from program import assemble
+	from vm import VM
+
+	with open('program.tn') as f:
+		program = assemble(f)
+	result = VM().run(program, maxSteps = 1000)
+	print(result.status, result.Areg, result.diagnostics)
+
+A Program can be run any number of times, on as many VMs as we like.
+'''
+
+#Something reported while assembling or running a program
+class Diagnostic:
+	def __init__(self, warning):
+		#The kind of warning, such as ParsingError or RunTimeError
+		self.kind = type(warning).__name__
+		#Python's RuntimeWarnings are for things that shouldn't happen but can be carried
+		#on from, everything else we report is an error
+		self.severity = 'warning' if isinstance(warning, RuntimeWarning) else 'error'
+		self.line = getattr(warning, 'line', None)
+		self.column = getattr(warning, 'column', None)
+		self.message = getattr(warning, 'detail', str(warning))
+		#The whole text as it would have been shown
+		self.text = str(warning)
+
+	def __repr__(self):
+		return f'Diagnostic({self.kind}, line {self.line}, column {self.column}, {self.message!r})'
+
+#Turn warnings caught with warnings.catch_warnings(record = True) into diagnostics
+def diagnosticsFrom(caught):
+	return [Diagnostic(warning.message) for warning in caught]
+
+#Pass on warnings we caught, as if they had never been caught
+def reportAgain(caught):
+	for warning in caught:
+		warnings.warn_explicit(warning.message, warning.category, warning.filename, warning.lineno)
+
+#Turn code into the expanded reps.Code the VM loads, giving back the Code and None, or None
+#and what went wrong if there was an error. The code can be a string or a file opened for
+#reading text.
+#
+#Tokens are scanned as the parser asks for them and each statement is checked for prefix
+#errors as soon as it's parsed and then packed into the Code, so the source, its tokens and
+#the Nodes the parser builds are never held all at once.
+#We still only report errors from the first stage that had any, as if each stage had run
+#over the whole program before the next, so what's reported is held back until the end
+def buildCode(code):
+	scanner = lexer.Scanner(code)
+	checked = reps.Code()
+	prefixChanger = prefixChecking.PrefixPreparer()
+	with warnings.catch_warnings(record = True) as caught:
+		warnings.simplefilter('always')
+		parser = parsing.Parser(scanner.tokenStream())
+		for stmt in parser.statements():
+			#Once there's a lexical error the parser is missing tokens so we stop
+			if scanner.hadError:
+				break
+			checked.addStatement(prefixChanger.prepareStatement(stmt))
+		#Scan whatever the parser didn't get to for any lexical errors in it
+		for token in parser.tokens:
+			pass
+	#We use None as a way to return Errors
+	for stage, errorType, failure in ((scanner, lexer.LexicalError, 'Lexical error encountered. Not executing'),
+			(parser, parsing.ParsingError, 'Parsing error encountered. Not executing'),
+			(prefixChanger, prefixChecking.PrefixError, 'Illegal prefix sequence encountered. Not executing')):
+		if stage.hadError:
+			reportAgain(warning for warning in caught if warning.category == errorType)
+			return None, failure
+	reportAgain(caught)
+
+	#The prefix checking above and the expanding below form a middle end, that changes the
+	#not so assembly code so far into proper assembly code that the actual transputer
+	#would be able to handle
+
+	#Then we use an expander to expand out double length instructions
+	#And operands longer than 4 bits
+	#We also check if there is any overflow when expanding out jumps
+	expander = expanding.Expander(checked)
+	expanded = expander.expand()
+	if expanded == None:
+		return None, 'Ran into a problem while correcting Jumps. Not executing'
+	return expanded, None
+
+class Program:
+	def __init__(self, source, assembled, failure, diagnostics):
+		#What it was assembled from, the code or the file it was read from
+		self.source = source
+		#The expanded reps.Code the VM loads, None if the program couldn't be assembled
+		self.assembled = assembled
+		#Why it couldn't be assembled, None if it could
+		self.failure = failure
+		self.diagnostics = diagnostics
+
+	@property
+	def ok(self):
+		return self.assembled != None
+
+def assemble(source):
+	with warnings.catch_warnings(record = True) as caught:
+		warnings.simplefilter('always')
+		assembled, failure = buildCode(source)
+	return Program(source, assembled, failure, diagnosticsFrom(caught))
+
+#How a run ended and the state it left the VM in
+class RunResult:
+	#The registers we keep from the VM
+	registerNames = ('Areg', 'Breg', 'Creg', 'Oreg', 'Wptr', 'Iptr')
+
+	def __init__(self, vm, status, instructions, diagnostics):
+		#finished, halted, error, step-limit, not-assembled or not-loaded
+		self.status = status
+		for name in self.registerNames:
+			setattr(self, name, getattr(vm, name))
+		self.haltFlag = vm.haltFlag
+		self.error = vm.error
+		#Instructions run by this run, and by the VM over its life
+		self.instructions = instructions
+		self.instructionCount = vm.instructionCount
+		self.cycles = vm.cycles()
+		self.diagnostics = diagnostics
+
+	@property
+	def registers(self):
+		return {name: getattr(self, name) for name in self.registerNames}
+
+	@property
+	def ok(self):
+		return self.status == 'finished'
+
+	def __repr__(self):
+		return f'RunResult({self.status}, {self.registers}, {self.instructions} instructions, {len(self.diagnostics)} diagnostics)'
@@ -1,4 +1,5 @@
 from enum import Enum
+from array import array
 import warnings
 #We store tokenTypes here since they are used thoughout the program
 class TokenType(Enum):
@@ -160,6 +161,9 @@ class TokenType(Enum):
 
 #A token to represent a Instruction/Operand
 class Token:
+	#There can be millions of these so they don't each get a __dict__
+	__slots__ = ('typed', 'text', 'value', 'line', 'column')
+
 	#Typed represents the type of token which of one of the TokenType above
 	#text represents the original text that this token corresponds to
 	#value repesents the value that this token currrently corresponds to
@@ -179,6 +183,8 @@ class Token:
 #A terminal Node is a leaf
 #A non-terminal Node is a branch
 class Node:
+	__slots__ = ('label', 'instructionToken', 'distance', 'operandToken', 'children', 'terminal')
+
 	def __init__(self,label,terminal = False,distance = 0):
 		self.label = label
 		self.instructionToken = None
@@ -265,154 +271,163 @@ class Node:
 		rep += tabs + ']'
 		return rep
 
-#We use LablledNodes in the expander
-#They have a "instructionNum" and a "distance"
-#Which track how many instructions away from the start we were in the original
-#and far away we are now respectively
-class LabelledNode(Node):
-	def __init__(self, label, terminal, distance = 0, instructionNum = 0):
-		super().__init__(label, terminal, distance)
-		self.instructionNum = instructionNum
-
-	#We should only call this on the root, we assume that the tree has been expanded
-	def generateDistances(self):
-		assert (self.label == 'Statements'), f'Cannot call generateDistances on non root node'
-		#Set the root's distance to the distance reached, which is 0
-		self.distance = 0
-		distance = 0
-		for child in self.children:
-			distance = child.__generateDistances(distance)
-		#Distance in this case == size 
-
-	#This is the actual call on the other nodes
-	#It returns the new distance reached
-	def __generateDistances(self,distance):
-		#Set the distance of this node to the current distance reached
-		self.distance = distance
-		if self.terminal:
-			#If it's terminal increment number of instructions generated by 1
-			return distance + 1
-		for child in self.children:
-			distance = child.__generateDistances(distance)
-			#Othewise iterate through the nodes children and generate their distances
-		return distance
-
-	def maxInstrucNum(self):
-		assert self.label == 'Statements', f'Cannot find max Instruction if not on root'
-		return self.__rightMostEndNum(self)
-
-	#This takes in a number and return a link to a terminal node
-	#with the lowest distance that has the least instructionNum >= requiredNum 
-	def findInstrucAtNum(self, requiredNum):
-		assert self.label == 'Statements', f'Cannot find instruction if not on root'
-		#The highest numb instruction in the tree is the instruction num of the right most node
-		highestInstruction = self.__rightMostEndNum(self)
-		#If we're trying to find a non existent Node we should report there is no such node
-		if requiredNum > highestInstruction or requiredNum < 0:
-			return None
-		#Otherwise start the recursive binary search
-		#Do a check to ensure that we aren't jumping to an invalid instruction
-		return self.__binarySearchNode(requiredNum, self)
-
-	def __binarySearchNode(self,requiredNum,node):
-		left = 0
-		right = node.numChildren()-1
-		#We terminate when the left node and right node are adjacent
-		while left < right-1:
-			m = (left+right)//2
-			#If m has less than the requiredNum
-			#We can safely move L to M's position
-			if node.children[m].instructionNum < requiredNum:
-				left = m
-			else:
-				right = m
-		assert(left == right-1 or left == right)
-		leftNode = node.children[left]
-		rightNode = node.children[right]
-		leftINum = leftNode.instructionNum
-		rightINum = rightNode.instructionNum
-		#If the requiredNumber is less than or equal to leftmost Node's instructionNum
-		#We give back the first instruction we have
-		if requiredNum <= leftINum:
-			assert(left == 0)
-			return self.__leftMostEnd(leftNode)
-		#We check if it could be elsewhere in the left branch. In which case we binary
-		#search the left branch
-		#This implicity checks if leftNode is terminal since otherwise we have an excluded
-		#middle. Hence we don't need to check for terminality
-		elif requiredNum > leftINum and requiredNum <= self.__rightMostEndNum(leftNode) :
-			return self.__binarySearchNode(requiredNum,leftNode)
-		#If it's between the highest value of the left branch and the lowest value of the 
-		#Right branch the next highest instruction num is the first in the right branch
-		elif requiredNum <= rightINum:
-			return self.__leftMostEnd(rightNode)
-		#The remaining condition is requiredNum > rightINum
-		#We should binary search the right branch in this case
-		#We can assume that rightNode is not terminal in this case either since we know that
-		#This is the rightmost branch in the entire tree and since we limited our check
-		#To the highest instruction num in the tree, it must be in this branch somewhere
+#Every token type, Code keeps a type as its position in here
+tokenTypes = list(TokenType)
+typeNumbers = {typed: number for number, typed in enumerate(tokenTypes)}
+
+#The columns Code keeps for every instruction and the type of array each one is
+columnTypes = (('types', 'B'), ('operands', 'q'), ('numbers', 'q'), ('lines', 'I'), ('columns', 'I'),
+	('operandLines', 'I'), ('operandColumns', 'I'), ('instructionTexts', 'I'), ('operandTexts', 'I'))
+
+'''
+Once a statement has been parsed and checked it's added to a Code, which keeps the program
+as columns with an entry in each for every instruction rather than as a tree of Nodes and
+Tokens. The columns are arrays so an instruction takes a few dozen bytes, however many
+there are. For every instruction we keep
+
+types                          its TokenType, as its position in tokenTypes
+operands                       the value of its operand, 0 for a double length instruction
+numbers                        the number it had in the original program, which is what
+                               offsets count in
+lines, columns                 where its instruction came from
+operandLines, operandColumns   where its operand came from
+instructionTexts, operandTexts the text of its instruction and operand as they were
+                               written, as positions in texts
+
+Instructions are grouped into the statements the parser found: a chain of prefixes and the
+instruction they end with, or an instruction on its own. For every statement we keep the
+position of its first instruction in starts and the number the statement had in the
+original program in statementNumbers.
+'''
+class Code:
+	#Code made from other code can share its texts
+	def __init__(self, sharing = None):
+		for name, typecode in columnTypes:
+			setattr(self, name, array(typecode))
+		self.starts = array('q')
+		self.statementNumbers = array('q')
+		#The text of tokens, each different text is only kept once
+		if sharing == None:
+			self.texts = []
+			self.textNumbers = {}
 		else:
-			return self.__binarySearchNode(requiredNum,rightNode)
-
-	#This finds the highest initial instruction number in this tree
-	def __rightMostEndNum(self,node):
-		#The node latest in our children must have the highest value
-		result = node
-		#We keep going down until we find a terminal node
-		while not result.terminal:
-			result = result.children[-1]
-		return result.instructionNum
-
-	#This finds the right most node in this tree
-	def rightMostEnd(self):
-		result = self
-		#We keep going down until we find a terminal node
-		while not result.terminal:
-			result = result.children[-1]
-		return result
-
-	def __leftMostEnd(self,node):
-		result = node
-		#Keep going down the first child until you reach a terminal node
-		while not result.terminal:
-			result = result.children[0]
-		return result
-
-	def __str__(self, level = 0):
-		tabs = '    '*level
-		#Initalise to type
-		rep = f'{tabs} label: {self.label} [ \n'
-		rep += f'{tabs} CurrentInstrc#: {self.distance} \n'
-		rep += f'{tabs} OriginalInstrc#: {self.instructionNum} \n'
-		if (not (self.instructionToken==None)):
-			rep += f'{tabs} Instruction: {self.instructionToken.value} \n'
-			rep += f'{tabs} Original Instruction: {self.instructionToken.text} \n'
-			if (not (self.operandToken==None)):
-				rep += f'{tabs} Operand: {self.operandToken.value} \n'
-		#Now we add the children
-		for child in self.children:
-			rep += child.__str__(level+1) + '\n'
-
-		rep += tabs + ']'
+			self.texts = sharing.texts
+			self.textNumbers = sharing.textNumbers
+
+	#How many instructions we have
+	def __len__(self):
+		return len(self.types)
+
+	def statementCount(self):
+		return len(self.starts)
+
+	#The instructions in a statement, from its first up to but not including end
+	def statementRows(self, statement):
+		if statement + 1 < len(self.starts):
+			return self.starts[statement], self.starts[statement + 1]
+		return self.starts[statement], len(self.types)
+
+	def typeOf(self, row):
+		return tokenTypes[self.types[row]]
+
+	def instructionText(self, row):
+		return self.texts[self.instructionTexts[row]]
+
+	def operandText(self, row):
+		return self.texts[self.operandTexts[row]]
+
+	#The position of a text in texts, adding it if we haven't seen it before
+	def textNumber(self, text):
+		number = self.textNumbers.get(text)
+		if number == None:
+			number = len(self.texts)
+			self.texts.append(text)
+			self.textNumbers[text] = number
+		return number
+
+	#The instructions added after this are part of a new statement
+	def startStatement(self, number):
+		self.starts.append(len(self.types))
+		self.statementNumbers.append(number)
+
+	def addInstruction(self, typed, operand, number, line, column, instructionText, operandText, operandLine, operandColumn):
+		self.types.append(typeNumbers[typed])
+		self.addOperands([operand])
+		self.numbers.append(number)
+		self.lines.append(line)
+		self.columns.append(column)
+		self.operandLines.append(operandLine)
+		self.operandColumns.append(operandColumn)
+		self.instructionTexts.append(self.textNumber(instructionText))
+		self.operandTexts.append(self.textNumber(operandText))
+
+	#Operands are kept in an array unless one is too big for it, then they're kept in a list
+	def addOperands(self, operands):
+		if isinstance(self.operands, array):
+			try:
+				operands = array('q', operands)
+			except OverflowError:
+				self.operands = list(self.operands)
+		self.operands.extend(operands)
+
+	#Add a statement the parser built, its Tokens are only kept as columns
+	def addStatement(self, node):
+		self.startStatement(node.distance)
+		self.addNode(node)
+
+	def addNode(self, node):
+		if not node.terminal:
+			for child in node.children:
+				self.addNode(child)
+			return
+		instructionToken = node.getInstruc()
+		operandToken = node.operandToken
+		#Double length instructions don't have an operand
+		if operandToken == None:
+			self.addInstruction(instructionToken.typed, 0, node.distance, instructionToken.line, instructionToken.column,
+				instructionToken.text, '', instructionToken.line, instructionToken.column)
+		else:
+			self.addInstruction(instructionToken.typed, operandToken.value, node.distance, instructionToken.line, instructionToken.column,
+				instructionToken.text, operandToken.text, operandToken.line, operandToken.column)
+
+	#Copy the instructions from first up to end of other code that shares our texts
+	def copyInstructions(self, other, first, end):
+		#Most of the time it's just the one
+		if end - first == 1 and isinstance(self.operands, array):
+			self.types.append(other.types[first])
+			self.addOperands((other.operands[first],))
+			self.numbers.append(other.numbers[first])
+			self.lines.append(other.lines[first])
+			self.columns.append(other.columns[first])
+			self.operandLines.append(other.operandLines[first])
+			self.operandColumns.append(other.operandColumns[first])
+			self.instructionTexts.append(other.instructionTexts[first])
+			self.operandTexts.append(other.operandTexts[first])
+			return
+		for name, typecode in columnTypes:
+			if name == 'operands':
+				self.addOperands(other.operands[first:end])
+			else:
+				getattr(self, name).extend(getattr(other, name)[first:end])
+
+	#Copy the statements from first up to end of other code that shares our texts
+	def copyStatements(self, other, first, end):
+		if first == end:
+			return
+		firstRow = other.starts[first]
+		endRow = other.statementRows(end - 1)[1]
+		shift = len(self.types) - firstRow
+		self.starts.extend(start + shift for start in other.starts[first:end])
+		self.statementNumbers.extend(other.statementNumbers[first:end])
+		self.copyInstructions(other, firstRow, endRow)
+
+	#We build up the representation of the code a statement at a time
+	def __str__(self):
+		rep = ''
+		for statement in range(self.statementCount()):
+			first, end = self.statementRows(statement)
+			rep += f'Statement {self.statementNumbers[statement]} [ \n'
+			for row in range(first, end):
+				rep += f'    {self.lines[row]}[{self.columns[row]}]: {self.typeOf(row).name} {self.operands[row]} Instrc#: {self.numbers[row]} \n'
+			rep += ']\n'
 		return rep
-
-#We use this class when we initailly translate the Offset Nodes. Since we orginally
-#estimate they need length 0, it makes sense that we actually set their size to be zero
-#when initialised. We do this through changing the distance and size functions that
-#They inherit
-class OffsetZeroNode(LabelledNode):
-	def __init__(self, label, terminal, distance = 0, instructionNum = 0):
-		super().__init__(label, terminal, distance, instructionNum)
-
-	#We adjust the generate distances node since this is 
-	#How their distances are set
-	def __generateDistances(self,distance):
-	#Set the distance of this node to the current distance reached
-		self.distance = distance
-		if self.terminal:
-			#Since we don't want to adjust the distance we return the same one in this case
-			return distance
-		for child in self.children:
-			distance = child.__generateDistances(distance)
-			#Othewise iterate through the nodes children and generate their distances
-		return distance
\ No newline at end of file
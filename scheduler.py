@@ -0,0 +1,356 @@
+'''
+The scheduler shares the VM between processes the way the transputer's microcoded
+scheduler does.
+
+A process is known by its workspace pointer. Its workspace descriptor (Wdesc) is the
+workspace pointer with its priority in the bottom bit, 0 for high priority and 1 for low.
+This works because workspaces are word aligned so the bottom bit is always free.
+
+Each priority has a queue of processes that are ready to run. As on the chip the queues
+live in simulated memory, not in Python: a front and back pointer for each priority are
+kept in reserved words below MemStart and each waiting process links to the next through
+a word of its own workspace. Adding to the back and taking from the front only ever
+touches those words, so queueing costs the same however many processes there are.
+
+When a process stops running its Iptr is saved in its workspace, just below Wptr, and
+the next process is taken from the front of a queue. High priority processes always run
+before low priority ones, and a low priority process is interrupted as soon as a high
+priority one becomes ready. Low priority processes are also timesliced: once one has run
+for a timeslice it gives way to the next low priority process at the next J or LEND.
+
+A process that is ALTing keeps where it's up to in its state slot and waits on every
+channel it's enabled. Whatever makes one of its guards ready, a process outputting on one
+of its channels or a timer, wakes it directly if it's waiting.
+
+Processes waiting on a timer are woken at descheduling points and whenever the scheduler
+looks for a process to run. If every process is waiting on a timer the clocks are moved
+straight on to when the first of them wakes.
+'''
+from timers import TimerQueue, cyclesPerTick
+
+#Priorities as they appear in the bottom bit of a Wdesc
+highPriority = 0
+lowPriority = 1
+
+#The words below Wptr the scheduler uses, counted in words from Wptr
+iptrSlot = -1
+linkSlot = -2
+stateSlot = -3
+tlinkSlot = -4
+timeSlot = -5
+
+#The values the state slot takes while a process is ALTing, from MostNeg
+enablingState = 1
+waitingState = 2
+readyState = 3
+#The values the TLink slot takes during a timer ALT, from MostNeg
+timeSetState = 1
+timeNotSetState = 2
+#W[0] of an ALT before any guard is chosen
+noneSelected = -1
+
+#Words from MostNeg that are reserved. The chip reserves the first 18, the last of which
+#are where an interrupted low priority process is saved. We add 4 more after them to hold
+#the queue front and back pointers, which the chip keeps in registers
+linkChannelWords = 8
+saveAreaWord = 11
+frontPointerWords = (18, 20)
+backPointerWords = (19, 21)
+reservedWords = 22
+
+#How many cycles a low priority process runs for before it can be timesliced, about a
+#millisecond on a 20MHz part
+timeslicePeriod = 20480
+
+class Scheduler:
+	def __init__(self, vm):
+		self.vm = vm
+		self.memory = vm.memory
+		self.bytesPerWord = vm.bytesPerWord
+		self.wordMask = vm.wordMask
+		#NotProcess.p is MostNeg, which as an unsigned address is the sign bit
+		self.notProcess = vm.signBit
+		self.frontPointers = [self.reservedAddress(word) for word in frontPointerWords]
+		self.backPointers = [self.reservedAddress(word) for word in backPointerWords]
+		self.saveArea = self.reservedAddress(saveAreaWord)
+		self.enabling = self.notProcess + enablingState
+		self.waiting = self.notProcess + waitingState
+		self.ready = self.notProcess + readyState
+		self.timeSet = self.notProcess + timeSetState
+		self.timeNotSet = self.notProcess + timeNotSetState
+		self.timeslicePeriod = timeslicePeriod
+		self.timers = TimerQueue()
+		#What has to be added to the ticks since the VM started to give each clock, STTIMER
+		#sets these
+		self.clockOffsets = [0, 0]
+		self.reset()
+
+	#Empty both queues and forget any interrupted process
+	def reset(self):
+		for priority in (highPriority, lowPriority):
+			self.memory.writeWord(self.frontPointers[priority], self.notProcess)
+			self.memory.writeWord(self.backPointers[priority], self.notProcess)
+		#As on the chip the link channels start empty
+		for word in range(linkChannelWords):
+			self.memory.writeWord(self.reservedAddress(word), self.notProcess)
+		#Is there a low priority process waiting in the save area?
+		self.interrupted = False
+		self.interruptedRegisters = None
+		self.interruptedProcess = None
+		#Set when a high priority process becomes ready while a low priority one runs
+		self.preemptPending = False
+		self.timers.clear()
+		self.updateEvent()
+
+	def reservedAddress(self, word):
+		return self.notProcess + word*self.bytesPerWord
+
+	#The address of one of the words below a workspace pointer
+	def slot(self, wptr, slot):
+		return (wptr + slot*self.bytesPerWord) & self.wordMask
+
+	def isEmpty(self, priority):
+		return self.memory.readWord(self.frontPointers[priority]) == self.notProcess
+
+	#Put the process with this Wdesc on the back of its queue, its Iptr must already be saved
+	def enqueue(self, wdesc):
+		priority = wdesc & 1
+		wptr = (wdesc & ~1) & self.wordMask
+		memory = self.memory
+		front = self.frontPointers[priority]
+		back = self.backPointers[priority]
+		if memory.readWord(front) == self.notProcess:
+			memory.writeWord(front, wptr)
+		else:
+			memory.writeWord(self.slot(memory.readWord(back), linkSlot), wptr)
+		memory.writeWord(back, wptr)
+		if priority == highPriority and self.vm.priority == lowPriority and not self.vm.idle:
+			self.preemptPending = True
+
+	#Take the workspace pointer of the process at the front of a queue
+	def dequeue(self, priority):
+		memory = self.memory
+		front = self.frontPointers[priority]
+		wptr = memory.readWord(front)
+		if wptr == memory.readWord(self.backPointers[priority]):
+			memory.writeWord(front, self.notProcess)
+		else:
+			memory.writeWord(front, memory.readWord(self.slot(wptr, linkSlot)))
+		return wptr
+
+	#Start running a process from the Iptr saved in its workspace
+	def start(self, wptr, priority):
+		vm = self.vm
+		vm.Wptr = wptr
+		vm.priority = priority
+		vm.Iptr = self.memory.readWord(self.slot(wptr, iptrSlot))
+		vm.Oreg = 0
+		vm.idle = False
+		vm.process = (wptr & self.wordMask) | priority
+		if priority == lowPriority:
+			vm.sliceStart = vm.cycles()
+		self.updateEvent()
+
+	#Run the next process that's ready, giving back False if there isn't one
+	def next(self):
+		self.wake()
+		#Whatever we choose, nothing that has become ready needs to preempt it
+		self.preemptPending = False
+		if not self.isEmpty(highPriority):
+			self.start(self.dequeue(highPriority), highPriority)
+		elif self.interrupted:
+			self.restore()
+		elif not self.isEmpty(lowPriority):
+			self.start(self.dequeue(lowPriority), lowPriority)
+		else:
+			self.vm.idle = True
+			return False
+		return True
+
+	#The current process can't go on, if nothing else can run we leave Iptr outside the
+	#program so the VM stops
+	def deschedule(self):
+		if not self.next():
+			self.vm.Iptr = self.notProcess
+
+	#Save the current process's Iptr and stop running it
+	def stop(self):
+		vm = self.vm
+		self.memory.writeWord(self.slot(vm.Wptr, iptrSlot), vm.Iptr & self.wordMask)
+		self.deschedule()
+
+	#Called when the VM has left the program, either because the process that was running
+	#ran off the end of it or because nothing could run. Gives back False if no process
+	#will ever be ready to run again
+	def carryOn(self):
+		vm = self.vm
+		if self.next():
+			return True
+		if not vm.skipIdle:
+			return False
+		#Everything is waiting so we skip ahead to when the next timer wakes a process
+		while True:
+			cycle = self.timers.nextCycle()
+			if cycle == None:
+				return False
+			vm.idleCycles += max(0, cycle - vm.cycles())
+			if self.next():
+				return True
+
+	'''
+	At a descheduling point the VM checks whether it has reached vm.eventCount, the
+	instruction count at which either a timer may be due or the process's timeslice may
+	end. Keeping it as one number means J only has to make one comparison. Timers and
+	timeslices go by cycles, which untimed are one for every instruction, so whatever is
+	next is due once as many instructions have run as there are cycles to go. A timed
+	instruction can take many cycles and get there sooner, so we also keep vm.eventCycle,
+	the cycle it's due on, and a timed run brings eventCount forward once it reaches it.
+	If it isn't due yet when we get there we just work out a new eventCount
+	'''
+	def updateEvent(self):
+		vm = self.vm
+		event = float('inf')
+		if vm.priority == lowPriority:
+			event = vm.sliceStart + self.timeslicePeriod
+		cycle = self.timers.nextCycle()
+		if cycle != None:
+			event = min(event, cycle)
+		vm.eventCycle = event
+		vm.eventCount = vm.instructionCount + max(0, event - vm.cycles())
+
+	def event(self):
+		vm = self.vm
+		self.wake()
+		self.preempt()
+		if vm.priority == lowPriority and vm.cycles() - vm.sliceStart >= self.timeslicePeriod:
+			self.timeslice()
+		self.updateEvent()
+
+	#Once a low priority process has used its timeslice it gives way to the next, if
+	#nothing else is waiting it carries on with a new timeslice
+	def timeslice(self):
+		vm = self.vm
+		if self.isEmpty(lowPriority):
+			vm.sliceStart = vm.cycles()
+			return
+		self.memory.writeWord(self.slot(vm.Wptr, iptrSlot), vm.Iptr & self.wordMask)
+		self.enqueue((vm.Wptr & self.wordMask) | lowPriority)
+		self.next()
+
+	#How many more instructions can run before the next descheduling point has to check in
+	#with us
+	def eventRemaining(self):
+		vm = self.vm
+		return max(0, vm.eventCount - vm.instructionCount)
+
+	#The value of a priority's clock
+	def clock(self, priority):
+		return (self.vm.cycles() // cyclesPerTick[priority] + self.clockOffsets[priority]) & self.wordMask
+
+	#Set both clocks to the same value
+	def setClocks(self, value):
+		cycles = self.vm.cycles()
+		for priority in (highPriority, lowPriority):
+			self.clockOffsets[priority] = value - cycles // cyclesPerTick[priority]
+
+	#The cycle the current priority's clock reaches time on, None if it already has
+	def cycleAt(self, time):
+		vm = self.vm
+		priority = vm.priority
+		ticks = vm.fromSigned(time - self.clock(priority))
+		if ticks <= 0:
+			return None
+		return (vm.cycles() // cyclesPerTick[priority] + ticks) * cyclesPerTick[priority]
+
+	#Have the current process wait until its priority's clock reaches time, giving back
+	#False if it already has
+	def waitUntil(self, time):
+		vm = self.vm
+		cycle = self.cycleAt(time)
+		if cycle == None:
+			return False
+		self.memory.writeWord(self.slot(vm.Wptr, timeSlot), time & self.wordMask)
+		self.timers.add((vm.Wptr & self.wordMask) | vm.priority, cycle)
+		self.stop()
+		return True
+
+	#Could a process run if the VM were resumed? We only look, a timer that's due is woken
+	#once the VM is resumed, so stopping to ask doesn't change how a run goes
+	def runnable(self):
+		vm = self.vm
+		if vm.haltFlag or vm.error:
+			return False
+		if not vm.idle or self.interrupted or not self.isEmpty(highPriority) or not self.isEmpty(lowPriority):
+			return True
+		#With everything waiting a timer will still wake a process, straight away if it's
+		#due or once we skip ahead to it
+		cycle = self.timers.nextCycle()
+		return cycle != None and (vm.skipIdle or cycle <= vm.cycles())
+
+	#Is this value from a state slot one an ALTing process leaves there?
+	def isAltState(self, state):
+		return state == self.enabling or state == self.waiting or state == self.ready
+
+	#One of the guards of the ALTing process with this Wdesc has become ready, if it's
+	#waiting it's run again
+	def altReady(self, wdesc):
+		address = self.slot(wdesc & ~1, stateSlot)
+		state = self.memory.readWord(address)
+		if state == self.ready:
+			return
+		self.memory.writeWord(address, self.ready)
+		if state == self.waiting:
+			self.enqueue(wdesc)
+
+	#Put every process whose timer is due back on its queue
+	def wake(self):
+		timers = self.timers
+		if len(timers) == 0:
+			return
+		cycles = self.vm.cycles()
+		while True:
+			cycle = timers.nextCycle()
+			if cycle == None or cycle > cycles:
+				break
+			wdesc, alting = timers.pop()
+			if alting:
+				self.altReady(wdesc)
+			else:
+				self.enqueue(wdesc)
+		self.updateEvent()
+
+	#Instructions that can make a high priority process ready call this once they're done,
+	#the low priority process that ran them is saved and the high priority one runs
+	def preempt(self):
+		if not self.preemptPending:
+			return
+		self.preemptPending = False
+		vm = self.vm
+		memory = self.memory
+		bytesPerWord = self.bytesPerWord
+		#The save area holds Wdesc, Iptr and then the registers
+		memory.writeWord(self.saveArea, (vm.Wptr & self.wordMask) | lowPriority)
+		memory.writeWord(self.saveArea + bytesPerWord, vm.Iptr & self.wordMask)
+		for i, register in enumerate((vm.Areg, vm.Breg, vm.Creg)):
+			if register == None:
+				register = 0
+			memory.writeWord(self.saveArea + (2 + i)*bytesPerWord, register & self.wordMask)
+		#The registers are also kept as they were, since they may not have held words
+		self.interruptedRegisters = (vm.Areg, vm.Breg, vm.Creg, vm.stackdepth)
+		self.interruptedProcess = vm.process
+		self.interrupted = True
+		self.start(self.dequeue(highPriority), highPriority)
+
+	#Carry on with the low priority process a high priority one interrupted
+	def restore(self):
+		vm = self.vm
+		memory = self.memory
+		self.interrupted = False
+		vm.Wptr = memory.readWord(self.saveArea) & ~1
+		vm.priority = lowPriority
+		vm.Iptr = memory.readWord(self.saveArea + self.bytesPerWord)
+		vm.Oreg = 0
+		vm.idle = False
+		vm.Areg, vm.Breg, vm.Creg, vm.stackdepth = self.interruptedRegisters
+		vm.process = self.interruptedProcess
+		self.updateEvent()
@@ -0,0 +1,125 @@
+#Snapshots let a VM be saved and put back to how it was, so a long warm up only has to be
+#run once and everything after it can start again from there
+from memoryTiming import MemoryTiming
+from array import array
+'''
+A snapshot holds the registers and flags of the VM, the state the scheduler keeps in
+Python and the contents of every page of memory. The first snapshot copies every page.
+After that the memory knows which pages have been written since the last snapshot or
+restore, and only those are copied, every other page is shared with the snapshot before.
+Page contents are kept as bytes so sharing them is safe.
+
+Restoring only has to put back the pages that differ from the snapshot: the pages written
+since the last snapshot or restore, and the pages the last snapshot holds differently. We
+can tell those apart without comparing any bytes since a page that hasn't changed is the
+same object in both. Rewinding to the same snapshot over and over only ever copies the
+pages each run wrote.
+
+Memory is put back in place so anything holding on to it, like compiled code or the
+scheduler, carries on working. Links to other VMs aren't part of a snapshot.
+
+The cycles counted by a timed run are part of a snapshot too, the totals for each line and
+process and the memory accesses as well as cycleCount, so after a restore they all still
+add up. Until a timed instruction has run they're all nothing, and that's all we keep.
+'''
+
+#Everything on the VM itself a snapshot keeps
+vmState = ('Areg', 'Breg', 'Creg', 'Oreg', 'Wptr', 'Iptr', 'stackdepth', 'haltFlag', 'error',
+	'instrucAddress', 'instructionCount', 'cycleCount', 'idleCycles', 'priority', 'sliceStart',
+	'idle', 'eventCount', 'eventCycle', 'process')
+#And on the scheduler, the queues themselves are in memory
+schedulerState = ('interrupted', 'interruptedRegisters', 'interruptedProcess', 'preemptPending')
+
+class Snapshot:
+	def __init__(self, state, schedulerState, clockOffsets, timers, timing, pages):
+		self.state = state
+		self.schedulerState = schedulerState
+		self.clockOffsets = clockOffsets
+		self.timers = timers
+		#(lineCycles, processCycles, what the memory timing counted), None if nothing has
+		#been timed
+		self.timing = timing
+		#The contents of each page by number, None for a page that hadn't been made
+		self.pages = pages
+
+class Snapshots:
+	def __init__(self, vm):
+		self.vm = vm
+		#The snapshot memory was last made the same as, apart from its dirty pages
+		self.current = None
+
+	def take(self):
+		vm = self.vm
+		memory = vm.memory
+		if self.current == None:
+			pages = {number: memory.readPage(number) for number in memory.pageNumbers()}
+		else:
+			pages = dict(self.current.pages)
+			for number in memory.dirty:
+				pages[number] = memory.readPage(number)
+		memory.dirty.clear()
+		scheduler = vm.scheduler
+		snapshot = Snapshot(
+			tuple(getattr(vm, name) for name in vmState),
+			tuple(getattr(scheduler, name) for name in schedulerState),
+			list(scheduler.clockOffsets),
+			scheduler.timers.save(),
+			self.saveTiming(),
+			pages)
+		self.current = snapshot
+		return snapshot
+
+	def restore(self, snapshot):
+		vm = self.vm
+		memory = vm.memory
+		changed = set(memory.dirty)
+		current = self.current
+		if current != None and current is not snapshot:
+			for number in current.pages.keys() | snapshot.pages.keys():
+				if current.pages.get(number) is not snapshot.pages.get(number):
+					changed.add(number)
+		elif current == None:
+			#We've never taken a snapshot from this memory so anything could differ
+			changed.update(memory.pageNumbers())
+			changed.update(snapshot.pages)
+		for number in changed:
+			memory.writePage(number, snapshot.pages.get(number))
+		memory.dirty.clear()
+		self.current = snapshot
+		for name, value in zip(vmState, snapshot.state):
+			setattr(vm, name, value)
+		scheduler = vm.scheduler
+		for name, value in zip(schedulerState, snapshot.schedulerState):
+			setattr(scheduler, name, value)
+		scheduler.clockOffsets = list(snapshot.clockOffsets)
+		scheduler.timers.load(snapshot.timers)
+		self.loadTiming(snapshot.timing)
+
+	def saveTiming(self):
+		vm = self.vm
+		#Every timed instruction counts against a process
+		if len(vm.processCycles) == 0:
+			return None
+		memoryTiming = None
+		if vm.memoryTiming != None:
+			memoryTiming = vm.memoryTiming.save()
+		return array('q', vm.lineCycles), dict(vm.processCycles), memoryTiming
+
+	#The totals are put back in place like memory is
+	def loadTiming(self, timing):
+		vm = self.vm
+		if timing == None:
+			lineCycles, processCycles, memoryTiming = [0]*len(vm.lineCycles), {}, None
+		else:
+			lineCycles, processCycles, memoryTiming = timing
+		vm.lineCycles[:] = lineCycles
+		vm.processCycles.clear()
+		vm.processCycles.update(processCycles)
+		if vm.memoryTiming != None:
+			if memoryTiming == None:
+				vm.memoryTiming.reset()
+			else:
+				vm.memoryTiming.load(memoryTiming)
+		elif memoryTiming != None:
+			vm.memoryTiming = MemoryTiming(vm, vm.onChipBytes, vm.waitStates)
+			vm.memoryTiming.load(memoryTiming)
@@ -0,0 +1,204 @@
+#An ALT should pick whichever of its guards is ready, whether it was ready before the ALT
+#got to it or became ready while the ALT waited, and a TALT should time out if nothing else
+#is ready in time. W[0] of the ALTing process ends up holding the offset of the guard chosen
+import unittest
+import warnings
+from program import assemble
+from vm import VM
+
+#Waits on channels 200 and 202, a second process with its workspace at 64 then outputs 42
+#on 202. The guard for 202 jumps over LDC 111 to input the 42
+waitThenReady = '''MINT
+STL 100
+MINT
+STL 101
+LDC 40
+LDC 64
+STARTP
+ALT
+LDLP 100
+LDC 1
+ENBC
+LDLP 101
+LDC 1
+ENBC
+ALTWT
+LDLP 100
+LDC 1
+LDC 0
+DISC
+LDLP 101
+LDC 1
+LDC 4
+DISC
+ALTEND
+LDC 111
+STOPP
+LDLP 5
+LDLP 101
+LDC 2
+IN
+LDL 5
+STOPP
+LDC 202
+LDC 42
+OUTWORD
+STOPP
+'''
+
+#The first process outputs 42 on 202 before the second process, with its workspace at 64,
+#ALTs on 200 and 202
+readyBeforeAlt = '''MINT
+STL 100
+MINT
+STL 101
+LDC 7
+LDC 64
+STARTP
+LDC 202
+LDC 42
+OUTWORD
+STOPP
+ALT
+LDC 200
+LDC 1
+ENBC
+LDC 202
+LDC 1
+ENBC
+ALTWT
+LDC 200
+LDC 1
+LDC 0
+DISC
+LDC 202
+LDC 1
+LDC 4
+DISC
+ALTEND
+LDC 111
+STOPP
+LDLP 5
+LDC 202
+LDC 2
+IN
+LDL 5
+STOPP
+'''
+
+#Nothing is ever output on 200 so the TALT times out 10 ticks on, and the timer guard loads
+#222 and the time
+timeout = '''MINT
+STL 100
+LDTIMER
+ADC 10
+STL 2
+TALT
+LDLP 100
+LDC 1
+ENBC
+LDL 2
+LDC 1
+ENBT
+TALTWT
+LDLP 100
+LDC 1
+LDC 0
+DISC
+LDL 2
+LDC 1
+LDC 4
+DIST
+ALTEND
+LDC 111
+STOPP
+LDC 222
+LDTIMER
+STOPP
+'''
+
+#As above but a second process with its workspace at 64 outputs 42 on 200 before the time
+#is up. The timer guard's code comes first this time so the channel guard's offset is 6
+readyBeforeTimeout = '''MINT
+STL 100
+LDC 44
+LDC 64
+STARTP
+LDTIMER
+ADC 10
+STL 2
+TALT
+LDLP 100
+LDC 1
+ENBC
+LDL 2
+LDC 1
+ENBT
+TALTWT
+LDLP 100
+LDC 1
+LDC 6
+DISC
+LDL 2
+LDC 1
+LDC 0
+DIST
+ALTEND
+LDC 222
+LDTIMER
+STOPP
+LDLP 5
+LDLP 100
+LDC 2
+IN
+LDL 5
+STOPP
+LDC 200
+LDC 42
+OUTWORD
+STOPP
+'''
+
+def run(source, engine):
+	vm = VM()
+	vm.engine = engine
+	result = vm.run(assemble(source))
+	return vm, result
+
+class AltTest(unittest.TestCase):
+	def setUp(self):
+		warnings.simplefilter('ignore')
+
+	def check(self, source, workspace, guard, message):
+		for engine in ('interpret', 'compile'):
+			with self.subTest(engine = engine):
+				vm, result = run(source, engine)
+				self.assertEqual(result.status, 'finished')
+				self.assertEqual(result.diagnostics, [])
+				self.assertEqual(vm.readMem(workspace), guard)
+				self.assertEqual(vm.readMem(workspace + 5*vm.bytesPerWord), message)
+				self.assertEqual(vm.Areg, message)
+
+	def testAltWaitsForGuard(self):
+		self.check(waitThenReady, 0, 4, 42)
+
+	def testAltFindsReadyGuard(self):
+		self.check(readyBeforeAlt, 64, 4, 42)
+
+	def testTaltTimesOut(self):
+		for engine in ('interpret', 'compile'):
+			with self.subTest(engine = engine):
+				vm, result = run(timeout, engine)
+				self.assertEqual(result.status, 'finished')
+				self.assertEqual(vm.readMem(0), 4)
+				#The time it woke at is the time it waited for
+				self.assertEqual((vm.Areg, vm.Breg), (vm.readMem(4), 222))
+				self.assertGreater(vm.idleCycles, 0)
+
+	def testTaltChannelBeatsTimeout(self):
+		self.check(readyBeforeTimeout, 0, 6, 42)
+		vm, result = run(readyBeforeTimeout, 'interpret')
+		self.assertEqual(vm.idleCycles, 0)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,91 @@
+#A message over an internal channel should arrive whichever of the two processes gets to
+#the channel first. Each program starts a second process with its workspace at 64 and
+#the two talk over the channel word at 200
+import unittest
+import warnings
+from program import assemble
+from vm import VM
+
+#The first process waits in IN before the second has output anything
+inputFirst = '''MINT
+STL 100
+LDC 8
+LDC 64
+STARTP
+LDLP 1
+LDC 200
+LDC 2
+IN
+LDL 1
+STOPP
+LDC 200
+LDC 42
+OUTWORD
+STOPP
+'''
+
+#The first process waits in OUT before the second has input anything, the message is two
+#words long
+outputFirst = '''MINT
+STL 100
+LDC 77
+STL 10
+LDC 88
+STL 11
+LDC 7
+LDC 64
+STARTP
+LDLP 10
+LDC 200
+LDC 4
+OUT
+STOPP
+LDLP 1
+LDC 200
+LDC 4
+IN
+STOPP
+'''
+
+#The channel word and the Wdesc of the first process, which runs at low priority
+channel = 200
+firstWdesc = 1
+
+def run(source, engine, maxSteps = None):
+	vm = VM()
+	vm.engine = engine
+	result = vm.run(assemble(source), maxSteps)
+	return vm, result
+
+class ChannelTest(unittest.TestCase):
+	def setUp(self):
+		warnings.simplefilter('ignore')
+
+	def testInputFirst(self):
+		for engine in ('interpret', 'compile'):
+			with self.subTest(engine = engine):
+				#After its IN the first process is waiting in the channel
+				vm, result = run(inputFirst, engine, 13)
+				self.assertEqual(vm.readMem(channel), firstWdesc)
+				self.assertEqual(vm.Wptr, 64)
+				vm, result = run(inputFirst, engine)
+				self.assertEqual(result.status, 'finished')
+				self.assertEqual(result.diagnostics, [])
+				self.assertEqual(vm.readMem(2), 42)
+				self.assertEqual(vm.Areg, 42)
+				self.assertEqual(vm.readMem(channel), vm.signBit)
+
+	def testOutputFirst(self):
+		for engine in ('interpret', 'compile'):
+			with self.subTest(engine = engine):
+				vm, result = run(outputFirst, engine, 19)
+				self.assertEqual(vm.readMem(channel), firstWdesc)
+				self.assertEqual(vm.Wptr, 64)
+				vm, result = run(outputFirst, engine)
+				self.assertEqual(result.status, 'finished')
+				self.assertEqual(result.diagnostics, [])
+				self.assertEqual((vm.readMem(66), vm.readMem(68)), (77, 88))
+				self.assertEqual(vm.readMem(channel), vm.signBit)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,119 @@
+#Going back through a recorded run should leave the VM just as a fresh run stopped at the
+#same instruction count would be
+import unittest
+import warnings
+from Interpreter import Interpreter
+from program import assemble
+from vm import VM
+
+#A countdown loop with a prefixed constant, PFIX 1 and LDC 2 run as one chain
+countdown = '''LDC 20
+STL 1
+PFIX 1
+LDC 2
+STL 2
+LDL 1
+CJ 4
+LDL 1
+ADC -1
+STL 1
+J -6
+LDL 2
+'''
+
+#The countdown again at low priority, while a high priority process with its workspace at
+#64 waits 5 ticks and then takes over
+preempting = '''LDC 19
+LDPI
+STL 31
+LDC 64
+RUNP
+LDC 100
+STL 1
+LDL 1
+CJ 4
+LDL 1
+ADC -1
+STL 1
+J -6
+STOPP
+LDTIMER
+ADC 5
+TIN
+LDTIMER
+STL 0
+LDC 0
+LDNL 1
+STL 1
+STOPP
+'''
+
+def state(vm):
+	return (vm.instructionCount, vm.Areg, vm.Breg, vm.Creg, vm.Oreg, vm.Wptr, vm.Iptr,
+		vm.readMem(vm.Wptr + vm.bytesPerWord), vm.readMem(vm.Wptr + 2*vm.bytesPerWord))
+
+def freshRun(count):
+	vm = VM()
+	vm.run(assemble(countdown), maxSteps = count)
+	return state(vm)
+
+class StepBackTest(unittest.TestCase):
+	def setUp(self):
+		warnings.simplefilter('ignore')
+		#Checkpoints close together so going back restores one and replays from it
+		self.interp = Interpreter(recorded = True)
+		self.interp.history.interval = 7
+		self.interp.run(countdown)
+		self.history = self.interp.history
+		self.vm = self.interp.vm
+		self.end = self.vm.instructionCount
+
+	def testStepsBackByInstructions(self):
+		for steps in (1, 2, 3, 5, 30, 100, self.end):
+			self.history.goTo(self.end)
+			went = self.history.stepBack(steps)
+			self.assertEqual(went, steps)
+			self.assertEqual(state(self.vm), freshRun(self.end - steps))
+
+	def testStepsBackOverPrefixedInstruction(self):
+		#LDC 20 needs a prefix too so PFIX 1 and LDC 2 are the 4th and 5th instructions.
+		#Stop just after them, then step back into the middle of the chain
+		self.history.goTo(5)
+		self.assertEqual(self.history.stepBack(1), 1)
+		self.assertEqual(self.vm.Oreg, 1 << 4)
+		self.assertEqual(state(self.vm), freshRun(4))
+
+	def testStepsBackOneAtATime(self):
+		count = self.end
+		while self.history.stepBack(1) == 1:
+			count -= 1
+			self.assertEqual(state(self.vm), freshRun(count))
+		self.assertEqual(count, 0)
+
+	def testRunsBackToLineInsideChain(self):
+		self.assertTrue(self.history.runBackTo(4))
+		self.assertEqual(self.vm.lineAt(self.vm.Iptr), 4)
+		self.assertEqual(state(self.vm), freshRun(self.vm.instructionCount))
+
+	def testStepsBackOverPreemption(self):
+		#A high priority process wakes on a timer and preempts the countdown, timed runs
+		#should come back the same way too
+		for timed in (False, True):
+			interp = Interpreter(timed = timed, recorded = True)
+			interp.history.interval = 7
+			interp.run(preempting)
+			vm = interp.vm
+			end = vm.instructionCount
+			for count in range(30, 120):
+				with self.subTest(timed = timed, count = count):
+					interp.history.goTo(end)
+					self.assertEqual(interp.history.stepBack(end - count), end - count)
+					fresh = VM()
+					fresh.timing = timed
+					fresh.run(assemble(preempting), maxSteps = count)
+					self.assertEqual(state(vm), state(fresh))
+					self.assertEqual(vm.cycles(), fresh.cycles())
+					self.assertEqual(vm.scheduler.timers.nextCycle(), fresh.scheduler.timers.nextCycle())
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,127 @@
+#A network should end up the same whether every node runs in this process or the nodes are
+#shared between worker processes
+import unittest
+import warnings
+from network import Network, pipeline
+from distributed import DistributedNetwork
+
+#The first node outputs 100 on link 1, the middle nodes each add 1 to what they input on
+#link 0 and pass it on, and the last node inputs it
+first = '''MINT
+LDNLP 1
+LDC 100
+OUTWORD
+'''
+
+middle = '''LDLP 1
+MINT
+LDNLP 4
+LDC 2
+IN
+MINT
+LDNLP 1
+LDL 1
+ADC 1
+OUTWORD
+'''
+
+last = '''LDLP 1
+MINT
+LDNLP 4
+LDC 2
+IN
+LDL 1
+'''
+
+#Node 0 waits 3 ticks and outputs 55 on link 1, node 1 ALTs on link 0 and inputs it
+delayed = '''LDTIMER
+ADC 3
+TIN
+MINT
+LDNLP 1
+LDC 55
+OUTWORD
+'''
+
+alting = '''ALT
+MINT
+LDNLP 4
+LDC 1
+ENBC
+ALTWT
+MINT
+LDNLP 4
+LDC 1
+LDC 0
+DISC
+ALTEND
+LDLP 1
+MINT
+LDNLP 4
+LDC 2
+IN
+LDL 1
+'''
+
+#Output or input 100 bytes from 8 bytes before the end of memory
+outputPastEnd = '''LDC -8
+MINT
+LDNLP 1
+LDC 100
+OUT
+'''
+
+inputPastEnd = '''LDC -8
+MINT
+LDNLP 4
+LDC 100
+IN
+'''
+
+def build(network, sources):
+	for source in sources:
+		network.add(source)
+	network.wire(pipeline(len(sources)))
+	network.run()
+	return network
+
+class NetworkTest(unittest.TestCase):
+	def setUp(self):
+		warnings.simplefilter('ignore')
+
+	#Every node should end in the same state. Link messages in a distributed network only
+	#arrive between rounds so it can take longer, but it takes as long for any number of
+	#workers
+	def compare(self, sources, finalAreg):
+		for quantum in (5, 1000):
+			network = build(Network(quantum = quantum), sources)
+			self.assertEqual(network.nodes[-1].vm.Areg, finalAreg)
+			times = set()
+			for workers in (1, 2, 3):
+				with self.subTest(quantum = quantum, workers = workers):
+					distributed = build(DistributedNetwork(quantum = quantum, workers = workers), sources)
+					self.assertEqual(str(distributed), str(network))
+					times.add(distributed.time)
+			self.assertEqual(len(times), 1)
+
+	def testPipeline(self):
+		self.compare([first] + [middle]*4 + [last], 104)
+
+	def testTimerAndAlt(self):
+		self.compare([delayed, alting], 55)
+
+	def testMessagePastEndOfMemory(self):
+		#Only the node whose message it is should report it and halt
+		for sources, bad in (([outputPastEnd, last], 0), ([first, inputPastEnd], 1)):
+			with self.subTest(bad = bad):
+				with warnings.catch_warnings(record = True) as caught:
+					warnings.simplefilter('always')
+					network = build(Network(), sources)
+				self.assertEqual([warning.category.__name__ for warning in caught], ['RunTimeError'])
+				self.assertIn('runs past the end of memory', str(caught[0].message))
+				self.assertEqual([node.vm.haltFlag for node in network.nodes], [node == bad for node in range(2)])
+				distributed = build(DistributedNetwork(workers = 2), sources)
+				self.assertEqual(str(distributed), str(network))
+
+if __name__ == '__main__':
+	unittest.main()
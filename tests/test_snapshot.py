@@ -0,0 +1,107 @@
+#Restoring a snapshot and running on should end exactly as running on from where the
+#snapshot was taken did, memory, scheduler, clocks and timing totals included
+import unittest
+import warnings
+from program import assemble
+from snapshot import vmState
+from vm import VM
+
+#A high priority process waits on a timer while the low priority process counts down, so
+#a snapshot part way through has a process in the timer queue and one that gets preempted
+preempted = '''LDC 19
+LDPI
+STL 31
+LDC 64
+RUNP
+LDC 100
+STL 1
+LDL 1
+CJ 4
+LDL 1
+ADC -1
+STL 1
+J -6
+STOPP
+LDTIMER
+ADC 5
+TIN
+LDTIMER
+STL 0
+LDC 0
+LDNL 1
+STL 1
+STOPP
+'''
+
+#Everything about the VM that should come back after a restore
+def state(vm):
+	memory = vm.memory
+	timing = None
+	if vm.memoryTiming != None:
+		timing = vm.memoryTiming.save()
+	return (tuple(getattr(vm, name) for name in vmState),
+		{number: memory.readPage(number) for number in memory.pageNumbers()},
+		list(vm.scheduler.clockOffsets), vm.scheduler.timers.nextCycle(),
+		list(vm.lineCycles), dict(vm.processCycles), timing)
+
+#eventCount is only the earliest the scheduler will next look for something due, and a run
+#stopped and resumed along the way can look sooner than one that wasn't
+def settled(vm):
+	registers, *rest = state(vm)
+	return (registers[:vmState.index('eventCount')] + registers[vmState.index('eventCount') + 1:], *rest)
+
+def start(timed, maxSteps):
+	vm = VM()
+	vm.timing = timed
+	vm.waitStates = 2
+	vm.run(assemble(preempted), maxSteps)
+	return vm
+
+class SnapshotTest(unittest.TestCase):
+	def setUp(self):
+		warnings.simplefilter('ignore')
+
+	def testRestoreAndRunOn(self):
+		for timed in (False, True):
+			for count in (3, 7, 50, 300):
+				with self.subTest(timed = timed, count = count):
+					vm = start(timed, count)
+					snapshot = vm.snapshot()
+					taken = state(vm)
+					vm.resume()
+					finished = state(vm)
+					#Twice over to be sure restoring doesn't spoil the snapshot
+					for attempt in range(2):
+						vm.restore(snapshot)
+						self.assertEqual(state(vm), taken)
+						vm.resume()
+						self.assertEqual(state(vm), finished)
+
+	def testRestoreIntoAnotherVM(self):
+		for timed in (False, True):
+			with self.subTest(timed = timed):
+				vm = start(timed, 50)
+				snapshot = vm.snapshot()
+				taken = state(vm)
+				other = start(timed, None)
+				other.restore(snapshot)
+				self.assertEqual(state(other), taken)
+				other.resume()
+				vm.resume()
+				self.assertEqual(state(other), state(vm))
+
+	def testRestoreMatchesFreshRun(self):
+		#Snapshots taken along the way put the VM back just as a run stopped there leaves it
+		vm = start(True, 0)
+		snapshots = []
+		for count in (10, 40, 90):
+			vm.resume(count - vm.instructionCount)
+			snapshots.append((count, vm.snapshot()))
+		vm.resume()
+		for count, snapshot in reversed(snapshots):
+			with self.subTest(count = count):
+				vm.restore(snapshot)
+				self.assertEqual(settled(vm), settled(start(True, count)))
+
+if __name__ == '__main__':
+	unittest.main()
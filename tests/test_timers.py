@@ -0,0 +1,109 @@
+#When every process is waiting on a timer the clocks should skip straight to the first one
+#that's due, but never while anything else can run
+import unittest
+import warnings
+from program import assemble
+from timers import cyclesPerTick
+from scheduler import lowPriority
+from vm import VM
+
+#A single low priority process waits 100 ticks, then sets the clocks to 7
+waitAlone = '''LDTIMER
+STL 1
+LDL 1
+ADC 100
+TIN
+LDTIMER
+STL 2
+LDC 7
+STTIMER
+LDTIMER
+LDL 2
+LDL 1
+'''
+
+#A high priority process with its workspace at 64 waits 5 ticks while the low priority
+#process counts W[1] down from 100. It wakes part way through the count, keeps the time
+#it woke at in its W[0] and what the count was up to in its W[1]
+waitBesideLoop = '''LDC 19
+LDPI
+STL 31
+LDC 64
+RUNP
+LDC 100
+STL 1
+LDL 1
+CJ 4
+LDL 1
+ADC -1
+STL 1
+J -6
+STOPP
+LDTIMER
+ADC 5
+TIN
+LDTIMER
+STL 0
+LDC 0
+LDNL 1
+STL 1
+STOPP
+'''
+
+def run(source, engine, timed = False):
+	vm = VM()
+	vm.engine = engine
+	vm.timing = timed
+	result = vm.run(assemble(source))
+	return vm, result
+
+class TimerTest(unittest.TestCase):
+	def setUp(self):
+		warnings.simplefilter('ignore')
+
+	def testSkipsToTimerWhenIdle(self):
+		for engine in ('interpret', 'compile'):
+			with self.subTest(engine = engine):
+				vm, result = run(waitAlone, engine)
+				self.assertEqual(result.status, 'finished')
+				#Only the program's own instructions ran, the wait was skipped
+				self.assertEqual(vm.instructionCount, 18)
+				self.assertGreater(vm.idleCycles, 0)
+				self.assertGreaterEqual(vm.cycles(), 100*cyclesPerTick[lowPriority])
+				#The clock read after waking is the time waited for
+				self.assertEqual((vm.readMem(2), vm.readMem(4)), (0, 100))
+				#And setting the clocks moves them to the value given
+				self.assertEqual((vm.Areg, vm.Breg, vm.Creg), (0, 100, 7))
+
+	def testNoSkipWhileRunnable(self):
+		for engine in ('interpret', 'compile'):
+			with self.subTest(engine = engine):
+				vm, result = run(waitBesideLoop, engine)
+				self.assertEqual(result.status, 'finished')
+				self.assertEqual(vm.idleCycles, 0)
+				self.assertEqual(vm.readMem(64), 5)
+				self.assertTrue(0 < vm.readMem(66) < 100)
+
+	def testTimedWakesOnTime(self):
+		#Timed instructions take more than a cycle, the process should still wake at the
+		#first descheduling point after its time
+		vm, result = run(waitBesideLoop, 'interpret', True)
+		self.assertEqual(result.status, 'finished')
+		self.assertEqual(vm.readMem(64), 5)
+
+	def testStoppingDoesNotChangeRun(self):
+		#Asking how a run stopped mustn't wake anything, so a run stopped and resumed
+		#anywhere ends just like one that wasn't
+		for timed in (False, True):
+			whole, result = run(waitBesideLoop, 'interpret', timed)
+			ended = (whole.cycles(), whole.readMem(64), whole.readMem(66))
+			for split in range(0, whole.instructionCount, 5):
+				with self.subTest(timed = timed, split = split):
+					vm = VM()
+					vm.timing = timed
+					vm.run(assemble(waitBesideLoop), split)
+					vm.resume()
+					self.assertEqual((vm.cycles(), vm.readMem(64), vm.readMem(66)), ended)
+
+if __name__ == '__main__':
+	unittest.main()
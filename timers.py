@@ -0,0 +1,78 @@
+import heapq
+
+'''
+The transputer has a clock for each priority. The high priority clock ticks every
+microsecond and the low priority clock every 64 microseconds. Time in the VM is counted
+in processor cycles and each clock is worked out from it, so the clocks never need to be
+ticked.
+
+Processes waiting on a timer are kept in a heap ordered by the cycle they wake at, so
+finding the next process to wake is cheap however many are waiting. A process can be
+taken out of the queue before it wakes, we just mark its entry as removed and skip it when
+it reaches the top of the heap.
+'''
+
+#We simulate a 20MHz part
+cyclesPerMicrosecond = 20
+#How many cycles each priority's clock takes to tick, by priority
+cyclesPerTick = (cyclesPerMicrosecond, 64*cyclesPerMicrosecond)
+
+class TimerQueue:
+	def __init__(self):
+		self.heap = []
+		#The entry for each waiting process by Wdesc, entries are
+		#[cycle, order, wdesc, removed, alting]
+		self.entries = {}
+		#Processes that wake on the same cycle wake in the order they started waiting
+		self.order = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	#Wake the process with this Wdesc once the cycle count reaches cycle, alting is True
+	#when the process is waiting in a timer ALT rather than in TIN
+	def add(self, wdesc, cycle, alting = False):
+		self.remove(wdesc)
+		entry = [cycle, self.order, wdesc, False, alting]
+		self.order += 1
+		heapq.heappush(self.heap, entry)
+		self.entries[wdesc] = entry
+
+	#Stop waiting for the process with this Wdesc, if it is waiting
+	def remove(self, wdesc):
+		entry = self.entries.pop(wdesc, None)
+		if entry != None:
+			entry[3] = True
+
+	#The cycle the next process wakes at, None if no process is waiting
+	def nextCycle(self):
+		heap = self.heap
+		while len(heap) > 0 and heap[0][3]:
+			heapq.heappop(heap)
+		if len(heap) == 0:
+			return None
+		return heap[0][0]
+
+	#Take the Wdesc of the next process to wake and whether it's in a timer ALT
+	def pop(self):
+		self.nextCycle()
+		cycle, order, wdesc, removed, alting = heapq.heappop(self.heap)
+		del self.entries[wdesc]
+		return wdesc, alting
+
+	def clear(self):
+		self.heap = []
+		self.entries = {}
+
+	#The waiting processes as (cycle, order, wdesc, alting) in the order they wake, along
+	#with the next order to give out
+	def save(self):
+		entries = sorted(entry for entry in self.heap if not entry[3])
+		return [(cycle, order, wdesc, alting) for cycle, order, wdesc, removed, alting in entries], self.order
+
+	#Wait on what save gave back, forgetting anything waiting now
+	def load(self, saved):
+		entries, self.order = saved
+		#A sorted list is already a heap
+		self.heap = [[cycle, order, wdesc, False, alting] for cycle, order, wdesc, alting in entries]
+		self.entries = {entry[2]: entry for entry in self.heap}
@@ -0,0 +1,199 @@
+#How long each instruction takes on the real chip, so a run can say how long it would take
+from timers import cyclesPerMicrosecond
+from scheduler import stateSlot
+
+'''
+The cycle counts are the ones the Inmos datasheets give for each instruction, taking all
+memory to be on-chip. The datasheet gives a secondary instruction's time including the
+prefix its code needs and the OPR that runs it, so we take that prefix back off here and
+count every prefix as a cycle when it runs. A fused prefix chain then costs a cycle for
+each prefix plus the instruction it ends in, whatever its operand and wherever it came from.
+
+Some instructions take longer depending on what they're given, such as a shift by its
+count or a message by its length. Those are worked out from the registers before the
+instruction runs.
+
+The wait states of any external memory an instruction uses are counted separately, see
+memoryTiming.py.
+'''
+
+#Cycles for each instruction with on-chip memory, as the datasheet gives them
+datasheetCycles = {
+	'PFIX': 1, 'NFIX': 1, 'LDC': 1, 'LDL': 2, 'STL': 1, 'LDLP': 1, 'ADC': 1, 'EQC': 2,
+	'J': 3, 'CJ': 2, 'LDNL': 2, 'STNL': 2, 'LDNLP': 1, 'CALL': 7, 'AJW': 1,
+	'REV': 1, 'ADD': 1, 'SUB': 1, 'SUM': 1, 'DIFF': 1, 'AND': 1, 'OR': 1, 'XOR': 1,
+	'NOT': 1, 'GT': 2, 'LEND': 10, 'BCNT': 2, 'WCNT': 5, 'LDPI': 2, 'MINT': 1, 'BSUB': 1,
+	'WSUB': 2, 'LB': 5, 'SB': 4, 'OUTBYTE': 25, 'OUTWORD': 25, 'GCALL': 4, 'GAJW': 2,
+	'RET': 5, 'STARTP': 12, 'ENDP': 13, 'RUNP': 10, 'STOPP': 11, 'LDPRI': 1,
+	'LDTIMER': 2, 'TIN': 30, 'ALT': 2, 'ALTWT': 5, 'ALTEND': 4, 'TALT': 4, 'TALTWT': 15,
+	'ENBS': 3, 'DISS': 4, 'ENBC': 7, 'DISC': 8, 'ENBT': 8, 'DIST': 23, 'CSUB0': 2,
+	'CCNT1': 3, 'TESTERR': 2, 'STOPERR': 2, 'SETERR': 1, 'XWORD': 4, 'CWORD': 5,
+	'XDBLE': 2, 'CSNGL': 3, 'LADD': 2, 'LSUB': 2, 'LSUM': 3, 'LDIFF': 3, 'RESETCH': 3,
+	'TESTPRANAL': 2, 'STHF': 1, 'STLF': 1, 'STTIMER': 1, 'STHB': 1, 'STLB': 1,
+	'SAVEH': 4, 'SAVEL': 4, 'CLRHALTERR': 1, 'SETHALTERR': 1, 'TESTHALTERR': 2,
+}
+
+#The position of the highest set bit of a register, 0 if it's empty or zero
+def highestBit(value, vm):
+	if value == None:
+		return 0
+	return (value & vm.wordMask).bit_length()
+
+#A register as a count, empty registers count as nothing
+def registerCount(value, vm):
+	if value == None:
+		return 0
+	return max(0, vm.fromSigned(value))
+
+#The words a message of Areg bytes takes up
+def messageWords(vm):
+	return -(-registerCount(vm.Areg, vm) // vm.bytesPerWord)
+
+#Instructions whose time depends on what they're given, worked out from the VM before the
+#instruction runs
+def jumpCycles(vm):
+	#Taking the jump takes longer than falling through
+	return 4 if vm.Areg == 0 else 2
+
+def endLoopCycles(vm):
+	#Leaving a loop is quicker than going round it again
+	control = vm.Breg
+	if control == None or control & vm.byteSelectMask != 0:
+		return datasheetCycles['LEND']
+	count = vm.memory.readWord((control + vm.bytesPerWord) & vm.wordMask)
+	if vm.fromSigned(count) > 1:
+		return 10
+	return 5
+
+def communicateCycles(vm):
+	words = messageWords(vm)
+	return 2*words + 19
+
+def moveCycles(vm):
+	words = messageWords(vm)
+	return 2*words + 8
+
+def timerInputCycles(vm):
+	#Only a process that has to wait takes the full time
+	if vm.Areg == None or vm.fromSigned(vm.Areg - vm.scheduler.clock(vm.priority)) <= 0:
+		return 4
+	return 30
+
+def altWaitCycles(vm):
+	#A process with a guard already ready doesn't wait
+	state = vm.memory.readWord(vm.scheduler.slot(vm.Wptr, stateSlot))
+	if state == vm.scheduler.ready:
+		return 5
+	return 17
+
+def timerAltWaitCycles(vm):
+	state = vm.memory.readWord(vm.scheduler.slot(vm.Wptr, stateSlot))
+	if state == vm.scheduler.ready:
+		return 15
+	return 18
+
+def shiftCycles(extra):
+	def cycles(vm):
+		return registerCount(vm.Areg, vm) + extra
+	return cycles
+
+def wordCycles(extra):
+	def cycles(vm):
+		return vm.bit + extra
+	return cycles
+
+def productCycles(vm):
+	return highestBit(vm.Areg, vm) + 4
+
+def normaliseCycles(vm):
+	#Shifting up to put the top bit of the double word Breg:Areg at the top
+	if vm.Breg == None or vm.Areg == None:
+		return 5
+	double = ((vm.Breg & vm.wordMask) << vm.bit) | (vm.Areg & vm.wordMask)
+	if double == 0:
+		return 2*vm.bit + 3
+	return 2*vm.bit - double.bit_length() + 5
+
+operandCycles = {
+	'CJ': jumpCycles,
+	'LEND': endLoopCycles,
+	'IN': communicateCycles,
+	'OUT': communicateCycles,
+	'MOVE': moveCycles,
+	'TIN': timerInputCycles,
+	'ALTWT': altWaitCycles,
+	'TALTWT': timerAltWaitCycles,
+	'SHL': shiftCycles(2),
+	'SHR': shiftCycles(2),
+	'LSHL': shiftCycles(3),
+	'LSHR': shiftCycles(3),
+	'MUL': wordCycles(6),
+	'DIV': wordCycles(7),
+	'REM': wordCycles(5),
+	'LMUL': wordCycles(1),
+	'LDIV': wordCycles(3),
+	'PROD': productCycles,
+	'NORM': normaliseCycles,
+}
+
+#How many prefixes the code of a secondary instruction needs, which the datasheet counts in
+#its time. Direct instructions don't need any
+def codePrefixes(code):
+	prefixes = 0
+	while code > 15:
+		code >>= 4
+		prefixes += 1
+	return prefixes
+
+class CycleModel:
+	def __init__(self, vm):
+		self.vm = vm
+		#How many prefixes each secondary instruction's code needs
+		self.prefixes = {name: codePrefixes(code) for code, name in enumerate(vm.secondaryNames) if name != None}
+
+	#The cost of one instruction not counting any prefixes before it, either a number of
+	#cycles or a function that works it out from the VM before the instruction runs
+	def cost(self, name):
+		prefixes = self.prefixes.get(name, 0)
+		if name in operandCycles:
+			cycles = operandCycles[name]
+			return lambda vm: max(1, cycles(vm) - prefixes)
+		return max(1, datasheetCycles.get(name, 1) - prefixes)
+
+	#The cost of a whole prefix chain of length bytes ending in the instruction name
+	def chainCost(self, name, length):
+		cost = self.cost(name)
+		if length == 1:
+			return cost
+		if callable(cost):
+			return lambda vm: length - 1 + cost(vm)
+		return length - 1 + cost
+
+	#The cost of running a single byte, Oreg already holds its operand
+	def byteCost(self, name):
+		if name == 'OPR':
+			vm = self.vm
+			if 0 <= vm.Oreg < len(vm.secondaryNames) and vm.secondaryNames[vm.Oreg] != None:
+				name = vm.secondaryNames[vm.Oreg]
+		cost = self.cost(name)
+		if callable(cost):
+			return cost(self.vm)
+		return cost
+
+#What a timed run spent its cycles on, the lines and processes that took longest first
+def report(vm, lines = 10):
+	cycles = vm.cycleCount
+	microseconds = cycles / cyclesPerMicrosecond
+	text = [f'{cycles} cycles, {microseconds:.2f}us at {cyclesPerMicrosecond}MHz, for {vm.instructionCount} instructions']
+	if vm.idleCycles > 0:
+		text.append(f'{vm.idleCycles} cycles idle')
+	text.append('Cycles by process (Wdesc):')
+	for process, taken in sorted(vm.processCycles.items(), key = lambda item: -item[1]):
+		text.append(f'  {process:#x}: {taken}')
+	text.append('Cycles by source line:')
+	used = [(taken, line) for line, taken in enumerate(vm.lineCycles) if taken > 0]
+	for taken, line in sorted(used, key = lambda item: (-item[0], item[1]))[:lines]:
+		text.append(f'  line {line}: {taken}')
+	if vm.memoryTiming != None:
+		text.append(vm.memoryTiming.report(cycles))
+	return '\n'.join(text)
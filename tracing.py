@@ -0,0 +1,161 @@
+#Tracing lets us look at the state of the VM as it runs without the VM itself having
+#to know where that state ends up. The VM hands its state to a Tracer which passes it
+#on to any number of sinks
+from collections import deque
+from enum import Enum
+import struct
+import sys
+
+#How much of a run we trace
+class TraceLevel(Enum):
+	#Nothing at all, the VM does no formatting or I/O
+	OFF = 'off'
+	#Only the state the VM is in at the end of a run
+	SUMMARY = 'summary'
+	#The state after every instruction
+	INSTRUCTION = 'instruction'
+
+#A state is the number of instructions run followed by the registers
+def captureState(vm):
+	return (vm.instructionCount, vm.Wptr, vm.Iptr, vm.Areg, vm.Breg, vm.Creg, vm.Oreg)
+
+#We format states the same way the VM prints itself
+def formatState(state):
+	count, wptr, iptr, areg, breg, creg, oreg = state
+	return (f'{count}: WPTR:{wptr}, IPTR:{iptr}, Areg:{areg}, Breg:{breg}, Creg:{creg}, Oreg:{oreg}')
+
+class Tracer:
+	def __init__(self, level = TraceLevel.INSTRUCTION, sinks = None):
+		self.level = level
+		#If we aren't given anywhere to send states we print them
+		if sinks == None:
+			sinks = [PrintSink()]
+		self.sinks = sinks
+
+	#Is the VM meant to hand us its state after every instruction?
+	def tracesInstructions(self):
+		return self.level == TraceLevel.INSTRUCTION
+
+	#Called after each instruction when tracing instructions
+	def record(self, vm):
+		state = captureState(vm)
+		for sink in self.sinks:
+			sink.record(state)
+
+	#Called when the VM stops running
+	def finish(self, vm):
+		if self.level == TraceLevel.SUMMARY:
+			self.record(vm)
+		for sink in self.sinks:
+			sink.flush()
+
+	def close(self):
+		for sink in self.sinks:
+			sink.close()
+
+'''
+Sinks take states and do something with them, they all provide record, flush and close
+'''
+
+#This prints every state it's given
+class PrintSink:
+	def __init__(self, stream = None):
+		if stream == None:
+			stream = sys.stdout
+		self.stream = stream
+
+	def record(self, state):
+		self.stream.write(formatState(state) + '\n')
+
+	def flush(self):
+		self.stream.flush()
+
+	def close(self):
+		self.flush()
+
+#This keeps the last size states in memory, older states are dropped
+class RingBufferSink:
+	def __init__(self, size):
+		self.states = deque(maxlen = size)
+
+	def record(self, state):
+		self.states.append(state)
+
+	def flush(self):
+		pass
+
+	def close(self):
+		pass
+
+	#Give back the states we're holding, oldest first
+	def __iter__(self):
+		return iter(self.states)
+
+	def __len__(self):
+		return len(self.states)
+
+'''
+Trace files are a header followed by fixed size records, one per state.
+Each record holds the instruction count, a byte of flags marking which registers
+were undefined and then each register as a signed 64 bit number
+'''
+traceMagic = b'TNTRACE1'
+traceRecord = struct.Struct('<QB6q')
+wordMask = 2**64 - 1
+
+#Registers can be None or larger than 64 bits so we make them fit in a record
+def packRegister(value):
+	if value == None:
+		return 0
+	value = value & wordMask
+	if value >= 2**63:
+		value -= 2**64
+	return value
+
+class BinaryTraceWriter:
+	def __init__(self, filePath):
+		self.file = open(filePath, 'wb')
+		self.file.write(traceMagic)
+
+	def record(self, state):
+		count = state[0]
+		registers = state[1:]
+		flags = 0
+		for i, value in enumerate(registers):
+			if value == None:
+				flags |= 1 << i
+		self.file.write(traceRecord.pack(count, flags, *[packRegister(value) for value in registers]))
+
+	def flush(self):
+		self.file.flush()
+
+	def close(self):
+		self.file.close()
+
+#Read the states back out of a trace file one at a time
+def readTrace(filePath):
+	with open(filePath, 'rb') as f:
+		if f.read(len(traceMagic)) != traceMagic:
+			raise ValueError(f'{filePath} is not a trace file')
+		while True:
+			record = f.read(traceRecord.size)
+			if len(record) < traceRecord.size:
+				return
+			count, flags, *registers = traceRecord.unpack(record)
+			for i in range(len(registers)):
+				if flags & (1 << i):
+					registers[i] = None
+			yield (count, *registers)
+
+#Pretty print a trace file
+def printTrace(filePath, stream = None):
+	if stream == None:
+		stream = sys.stdout
+	for state in readTrace(filePath):
+		stream.write(formatState(state) + '\n')
+
+if __name__ == '__main__':
+	if len(sys.argv) == 2:
+		printTrace(sys.argv[1])
+	else:
+		print("Usage: tracing.py [trace file]")
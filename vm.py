@@ -1,7 +1,15 @@
 #We want to be to raise runtime warnings.
 import warnings
 from errors import report
-import math
+from array import array
+from memory import createMemory
+from models import models, defaultModel
+from compiler import BlockCompiler, decodeInstruction
+from timing import CycleModel
+from memoryTiming import MemoryTiming
+from snapshot import Snapshots
+from program import Program, RunResult, diagnosticsFrom
+from scheduler import Scheduler, reservedWords, highPriority, lowPriority, stateSlot, tlinkSlot, timeSlot, noneSelected
 
 #Should warn users if they do something that isn't supported
 class InstructionNotImplemented(Warning):
@@ -15,8 +23,15 @@ class RunTimeError(Warning):
 
 import reps
 
+#The function code of each direct instruction, by its position in reps.tokenTypes
+functionCodes = [int(typed.instructionCode(),16) if typed.isInstruction() and len(typed.instructionCode()) == 1 else None
+	for typed in reps.tokenTypes]
+
+#The most instructions a compiled region runs before handing back to the VM
+regionBudget = 1 << 16
+
 class VM:
-	def __init__(self):
+	def __init__(self, model = None):
 		#These represent the internal registers of the transputer as defined in the handbook
 		#Where the registers are initally undefined they will defined as such in the VM
 		self.Wptr=0
@@ -32,43 +47,434 @@ class VM:
 		self.FC = None
 		#This allows us to keep track of how much of the stack is used.
 		self.stackdepth=0
+		#Set when the VM halts or runs into an error it can't carry on from
+		self.haltFlag = False
+		self.error = False
 		#And finally we have a representation of the memory of the transputer
-		#We simulate a 16 bit transputer
-		self.bit = 16
-		self.bytesPerWord = int(self.bit/8)
-		self.byteSelectLength = math.ceil(math.log(self.bytesPerWord,2))
-		self.byteSelectMask = (2**self.byteSelectLength)-1
-		#Our memory is arranged into words
-		self.memory = [0]*(2**(self.bit))
+		#The model fixes the word size and everything that depends on it
+		if model == None:
+			model = models[defaultModel]
+		self.model = model
+		self.bit = model.bit
+		self.bytesPerWord = model.bytesPerWord
+		self.byteSelectLength = model.byteSelectLength
+		self.byteSelectMask = model.byteSelectMask
+		self.wordMask = model.wordMask
+		self.signBit = model.signBit
+		self.mostNeg = model.mostNeg
+		self.mostPos = model.mostPos
+		#Small address spaces are held as one block of bytes, larger ones are paged
+		#so that only the parts a program touches are allocated
+		self.memory = createMemory(model.addressSpace, self.bytesPerWord)
+		#As on the real chip the first words of memory are reserved and user memory starts
+		#after them at MemStart, which is where we load programs.
+		#Addresses are unsigned here so MostNeg is the middle of memory
+		self.memStart = self.signBit + reservedWords*self.bytesPerWord
+		self.codeStart = self.memStart
+		self.codeEnd = self.memStart
+		#We keep where each instruction in memory came from so we can report errors
+		self.sourceLines = array('I')
+		self.sourceColumns = array('I')
+		#The address of the instruction currently being run
+		self.instrucAddress = 0
+		#We count how many instructions have been executed over the life of the VM
+		self.instructionCount = 0
+		#Anything we trace is handed to the tracer, with no tracer we don't trace at all
+		self.tracer = None
+		#Programs are either interpreted an instruction at a time or compiled into
+		#Python functions a region at a time
+		self.engine = 'interpret'
+		self.blockCompiler = None
+		#The program's prefix chains fused into single operations when it's loaded
+		self.fused = []
+		#With timing on we count the cycles the real chip would take, see timing.py, and
+		#the clocks follow them rather than the instruction count
+		self.timing = False
+		self.cycleCount = 0
+		#How much of memory from MostNeg is fast on-chip RAM, and the extra cycles each
+		#access to the slower external memory takes
+		self.onChipBytes = model.onChipBytes
+		self.waitStates = 0
+		#Counts a timed run's memory accesses, see memoryTiming.py
+		self.memoryTiming = None
+		#The cost of each fused operation, built when a timed run needs it
+		self.fusedCosts = None
+		self.cycleModel = None
+		#The Wdesc the running process started with, which we total its cycles under
+		self.process = 0
+		#Cycles taken by each process by Wdesc and by each line of the program
+		self.processCycles = {}
+		self.lineCycles = []
+		#The priority of the process that's running, and when it started its timeslice
+		self.priority = lowPriority
+		self.sliceStart = 0
+		#Set when no process is ready to run
+		self.idle = False
+		#Cycles that passed with every process waiting, which we skipped over
+		self.idleCycles = 0
+		#The instruction count at which the next descheduling point has to call the scheduler
+		self.eventCount = 0
+		#And the cycle it's due on, see Scheduler.updateEvent
+		self.eventCycle = 0
+		#When every process is waiting on a timer we skip ahead to it, unless something else
+		#such as a network is keeping time for us
+		self.skipIdle = True
+		#The first 8 words at MostNeg are the channels of the 4 links, outputs then inputs.
+		#A network connects them to other VMs
+		self.linkStart = self.signBit
+		self.linkEnd = self.signBit + 8*self.bytesPerWord
+		self.outputLinks = [None]*4
+		self.inputLinks = [None]*4
+		#The scheduler shares the VM between processes
+		self.scheduler = Scheduler(self)
+		#Saves the VM so it can be put back later, see snapshot.py
+		self.snapshots = Snapshots(self)
+		#Finally we build the tables we use to find the function for each instruction
+		self.buildDispatchTables()
 
 
 	#This is how commands are processed by the VM and is the only way to interact with it,
-	#We do this to ensure that this interpreter is as faithful as possible to the spec
-	def run(self,trees):
+	#We do this to ensure that this interpreter is as faithful as possible to the spec.
+	#We take a Program from program.assemble, or the Code it holds, and run it until it
+	#ends or has run maxSteps instructions. Nothing is printed, what would have been
+	#reported is in the RunResult we give back
+	def run(self, program, maxSteps = None):
+		diagnostics = []
+		assembled = program
+		if isinstance(program, Program):
+			assembled = program.assembled
+			diagnostics += program.diagnostics
+		startCount = self.instructionCount
+		with warnings.catch_warnings(record = True) as caught:
+			warnings.simplefilter('always')
+			if assembled == None:
+				status = 'not-assembled'
+			elif not self.boot(assembled):
+				status = 'not-loaded'
+			else:
+				startCount = self.instructionCount
+				self.resume(maxSteps)
+				status = self.status()
+		diagnostics += diagnosticsFrom(caught)
+		return RunResult(self, status, self.instructionCount - startCount, diagnostics)
+
+	#How the last run stopped
+	def status(self):
+		if self.haltFlag:
+			return 'halted'
+		if self.error:
+			return 'error'
+		if self.scheduler.runnable():
+			return 'step-limit'
+		return 'finished'
+
+	#Load the program and get it ready to run as a single low priority process
+	def boot(self, assembled):
 		#We also want to be able to raise errors and Halt just as the transputer would
 		#We reset our errors and Iptr whenever we receieve a new set of commands
 		self.haltFlag = False
 		self.error = False
-		self.Iptr = 0
-		#We take in the trees we've generated and convert them to byte codes
-		instructions = self.getInstructionOperand(trees)
-		while self.Iptr < len(instructions) and not self.haltFlag and not self.error:
-			currentInstrucPair = instructions[self.Iptr]
-			#We use instruction names for clarity
-			#We also store globally since methods can call errors
-			self.currentInstruc = currentInstrucPair[0]
-			self.currentOperand = int(currentInstrucPair[1].value)
-			self.line = self.currentInstruc.line
-			self.column = self.currentInstruc.column
-			#We first load the operand into the Oreg
-			self.Oreg += self.currentOperand
-			#And then we run whatever is the current Instruction
-			self.execute(self.currentInstruc.typed.name)
-			print(self.__str__())
-			#Finally move forward by 1 instruction
-			self.Iptr +=1
-			#While each instruction should do this, we do this in the loop
-			#Because it's common to every instruction	
+		#We take in the code we've generated and load it into memory as byte codes
+		if not self.load(assembled):
+			return False
+		self.priority = lowPriority
+		self.process = (self.Wptr & self.wordMask) | lowPriority
+		self.sliceStart = self.cycles()
+		self.idle = False
+		self.scheduler.reset()
+		self.Iptr = self.codeStart
+		return True
+
+	#Save everything about the VM so restore can put it back, after the first snapshot
+	#only the pages of memory written since the last one are copied
+	def snapshot(self):
+		return self.snapshots.take()
+
+	def restore(self, snapshot):
+		self.snapshots.restore(snapshot)
+
+	#This runs the instructions in memory from Iptr until we halt, error or no process is left
+	#to run. A process that leaves the program has finished and the next one is run.
+	#With maxSteps we also stop once that many more instructions have run, never more, so
+	#prefix chains and compiled blocks that would go past it are run an instruction at a time
+	def resume(self, maxSteps = None):
+		tracer = self.tracer
+		traceInstructions = tracer != None and tracer.tracesInstructions()
+		if maxSteps == None:
+			stepLimit = float('inf')
+		else:
+			stepLimit = self.instructionCount + maxSteps
+		#Something may have become ready while we weren't running
+		self.scheduler.preempt()
+		#Compiled code can't be traced or timed an instruction at a time so we interpret when
+		#we have to
+		if self.timing:
+			self.resumeTimed(stepLimit)
+		elif self.engine == 'compile' and not traceInstructions:
+			self.resumeCompiled(stepLimit)
+		else:
+			self.resumeInterpreted(stepLimit)
+		if tracer != None:
+			tracer.finish(self)
+
+	def resumeInterpreted(self, stepLimit):
+		memory = self.memory.fetchView()
+		directFunctions = self.directFunctions
+		fused = self.fused
+		codeStart = self.codeStart
+		codeEnd = self.codeEnd
+		tracer = self.tracer
+		traceInstructions = tracer != None and tracer.tracesInstructions()
+		while not self.haltFlag and not self.error and self.instructionCount < stepLimit:
+			address = self.Iptr
+			if address < codeStart or address >= codeEnd:
+				if not self.scheduler.carryOn():
+					break
+				continue
+			operation = fused[address - codeStart]
+			#At the start of a prefix chain we run the whole chain as one operation,
+			#leaving Iptr and Oreg just as they would be after its last instruction. If the
+			#whole chain would take us past the step limit we run it a byte at a time
+			if operation != None and self.Oreg == 0 and self.instructionCount + operation[3] <= stepLimit:
+				function, operand, nextAddress, length, finalAddress = operation
+				self.instrucAddress = finalAddress
+				self.Iptr = nextAddress
+				self.Oreg = operand
+				self.execute(function)
+				self.instructionCount += length
+			else:
+				#Fetch the next instruction, as on the transputer Iptr points to the next
+				#instruction while the current one is run
+				instruction = memory[address]
+				self.instrucAddress = address
+				self.Iptr = address + 1
+				#We first load the data part of the instruction into the Oreg
+				self.Oreg += instruction & 0xF
+				#And then we run the function the instruction codes for
+				self.execute(directFunctions[instruction >> 4])
+				self.instructionCount += 1
+			if traceInstructions:
+				tracer.record(self)
+
+	#The interpreter loop again, adding up the cycles each instruction takes as it goes.
+	#An instruction's cost is worked out before it runs since it can depend on the registers
+	def resumeTimed(self, stepLimit):
+		memory = self.memory.fetchView()
+		directFunctions = self.directFunctions
+		directNames = self.directNames
+		fused = self.fused
+		if self.fusedCosts == None:
+			self.buildCosts()
+		costs = self.fusedCosts
+		cycleModel = self.cycleModel
+		if self.memoryTiming == None:
+			self.memoryTiming = MemoryTiming(self, self.onChipBytes, self.waitStates)
+		memoryTiming = self.memoryTiming
+		memoryTiming.onChipBytes = self.onChipBytes
+		memoryTiming.waitStates = self.waitStates
+		sourceLines = self.sourceLines
+		lineCycles = self.lineCycles
+		processCycles = self.processCycles
+		codeStart = self.codeStart
+		codeEnd = self.codeEnd
+		tracer = self.tracer
+		traceInstructions = tracer != None and tracer.tracesInstructions()
+		memoryTiming.install()
+		#Anything that goes wrong mustn't leave memory accesses being timed
+		try:
+			while not self.haltFlag and not self.error and self.instructionCount < stepLimit:
+				address = self.Iptr
+				if address < codeStart or address >= codeEnd:
+					if not self.scheduler.carryOn():
+						break
+					continue
+				process = self.process
+				operation = fused[address - codeStart]
+				if operation != None and self.Oreg == 0 and self.instructionCount + operation[3] <= stepLimit:
+					function, operand, nextAddress, length, finalAddress = operation
+					cost, line = costs[address - codeStart]
+					self.instrucAddress = finalAddress
+					self.Iptr = nextAddress
+					self.Oreg = operand
+					if cost.__class__ is not int:
+						cost = cost(self)
+					memoryTiming.fetch(address, nextAddress)
+					self.execute(function)
+					self.instructionCount += length
+				else:
+					instruction = memory[address]
+					self.instrucAddress = address
+					self.Iptr = address + 1
+					self.Oreg += instruction & 0xF
+					cost = cycleModel.byteCost(directNames[instruction >> 4])
+					line = sourceLines[address - codeStart]
+					memoryTiming.fetch(address, address + 1)
+					self.execute(directFunctions[instruction >> 4])
+					self.instructionCount += 1
+				#Along with any wait states it ran into
+				cost += memoryTiming.take()
+				self.cycleCount += cost
+				#Make sure the next descheduling point looks for anything that's now due
+				if self.cycleCount + self.idleCycles >= self.eventCycle:
+					self.eventCount = self.instructionCount
+				lineCycles[line] += cost
+				processCycles[process] = processCycles.get(process, 0) + cost
+				if traceInstructions:
+					tracer.record(self)
+		finally:
+			memoryTiming.uninstall()
+
+	#The cost of every fused operation and the line it's counted against
+	def buildCosts(self):
+		self.cycleModel = CycleModel(self)
+		self.fusedCosts = [None]*len(self.fused)
+		for index, operation in enumerate(self.fused):
+			if operation == None:
+				continue
+			function, operand, nextAddress, length, finalAddress = operation
+			name = self.directNames[self.memory[finalAddress] >> 4]
+			if name == 'OPR' and 0 <= operand < len(self.secondaryNames) and self.secondaryNames[operand] != None:
+				name = self.secondaryNames[operand]
+			self.fusedCosts[index] = (self.cycleModel.chainCost(name, length), self.sourceLines[finalAddress - self.codeStart])
+
+	#We run compiled regions where we can and step the interpreter over anything else. Once
+	#the block a region starts with would take us past the step limit we interpret the rest
+	def resumeCompiled(self, stepLimit):
+		if self.blockCompiler == None:
+			self.blockCompiler = BlockCompiler(self)
+		blockCompiler = self.blockCompiler
+		codeStart = self.codeStart
+		codeEnd = self.codeEnd
+		while not self.haltFlag and not self.error and self.instructionCount < stepLimit:
+			address = self.Iptr
+			if address < codeStart or address >= codeEnd:
+				if not self.scheduler.carryOn():
+					break
+				continue
+			#Regions start at instruction boundaries so we can't enter one part way through a prefix chain
+			region = None
+			if self.Oreg == 0:
+				region = blockCompiler.regionAt(address)
+			if region != None and self.instructionCount + region.entryLength > stepLimit:
+				self.resumeInterpreted(stepLimit)
+				break
+			if region != None:
+				count = self.instructionCount
+				#Regions hand back before a J that should call the scheduler
+				budget = min(regionBudget, stepLimit - count)
+				region(self, budget, min(self.scheduler.eventRemaining(), budget))
+				#If the region left the first instruction to us we run it here
+				if self.instructionCount == count:
+					self.step(stepLimit)
+			else:
+				self.step(stepLimit)
+
+	#Run exactly one instruction, a whole prefix chain when we're at the start of one and it
+	#doesn't take us past stepLimit
+	def step(self, stepLimit = float('inf')):
+		address = self.Iptr
+		operation = self.fused[address - self.codeStart]
+		if operation != None and self.Oreg == 0 and self.instructionCount + operation[3] <= stepLimit:
+			function, operand, nextAddress, length, finalAddress = operation
+			self.instrucAddress = finalAddress
+			self.Iptr = nextAddress
+			self.Oreg = operand
+			self.execute(function)
+			self.instructionCount += length
+		else:
+			instruction = self.memory[address]
+			self.instrucAddress = address
+			self.Iptr = address + 1
+			self.Oreg += instruction & 0xF
+			self.execute(self.directFunctions[instruction >> 4])
+			self.instructionCount += 1
+
+	#We encode the expanded code as real one byte instructions, the function code in the
+	#top 4 bits and the data in the bottom 4, and write them into memory at MemStart
+	def load(self, assembled):
+		if self.memStart + len(assembled) > len(self.memory):
+			report(0, 0, f'Program of {len(assembled)} bytes does not fit in memory', RunTimeError)
+			self.error = True
+			return False
+		code = bytearray()
+		for typeNumber, data in zip(assembled.types, assembled.operands):
+			#The expander makes sure every operand fits in 4 bits
+			assert(data >= 0 and data < 16), f'{reps.tokenTypes[typeNumber].name} has operand {data} after expansion'
+			code.append((functionCodes[typeNumber] << 4) | data)
+		self.sourceLines = array('I', assembled.lines)
+		self.sourceColumns = array('I', assembled.columns)
+		#We write the program in one go
+		self.memory.writeBytes(self.memStart, code)
+		#Anything compiled from the last program no longer applies
+		self.blockCompiler = None
+		self.codeStart = self.memStart
+		self.codeEnd = self.memStart + len(code)
+		self.fuse()
+		#Timing totals are for the program that's loaded
+		self.fusedCosts = None
+		if self.memoryTiming != None:
+			self.memoryTiming.reset()
+		self.processCycles = {}
+		self.lineCycles = [0]*(max(self.sourceLines, default = 0) + 1)
+		return True
+
+	#Every prefix chain in the program, with the instruction it ends in, is fused into one
+	#operation that carries the whole operand. For OPR the secondary function is found now
+	#rather than every time it runs. Operations are kept by the address the chain starts at,
+	#addresses part way through a chain are left as None and are run a byte at a time.
+	#Like the compiler we assume the program doesn't overwrite its own code
+	def fuse(self):
+		self.fused = [None]*(self.codeEnd - self.codeStart)
+		address = self.codeStart
+		while address < self.codeEnd:
+			instruction = decodeInstruction(self.memory, address, self.codeEnd)
+			if instruction == None:
+				break
+			function = self.directFunctions[instruction.function]
+			if function == self.OPR:
+				if 0 <= instruction.operand < len(self.secondaryRunners) and self.secondaryRunners[instruction.operand] != None:
+					function = self.secondaryRunners[instruction.operand]
+			#The last byte of the chain is the instruction we report errors against
+			self.fused[address - self.codeStart] = (function, instruction.operand, instruction.nextAddress, instruction.length, instruction.nextAddress - 1)
+			address = instruction.nextAddress
+
+	#How many cycles the VM has been running for, which the clocks are worked out from.
+	#Unless we're timing an instruction is taken to be a cycle
+	def cycles(self):
+		if self.timing:
+			return self.cycleCount + self.idleCycles
+		return self.instructionCount + self.idleCycles
+
+	#Where the current instruction came from, we only look this up when reporting
+	@property
+	def line(self):
+		index = self.instrucAddress - self.codeStart
+		if index < 0 or index >= len(self.sourceLines):
+			return 0
+		return self.sourceLines[index]
+
+	#The line the instruction at an address came from, 0 if it isn't in the program
+	def lineAt(self, address):
+		index = address - self.codeStart
+		if index < 0 or index >= len(self.sourceLines):
+			return 0
+		return self.sourceLines[index]
+
+	@property
+	def column(self):
+		index = self.instrucAddress - self.codeStart
+		if index < 0 or index >= len(self.sourceColumns):
+			return 0
+		return self.sourceColumns[index]
+
+	#The name of the current instruction, for a secondary instruction this is the
+	#name of the function selected by Oreg
+	@property
+	def currentInstrucName(self):
+		name = self.directNames[self.memory[self.instrucAddress] >> 4]
+		if name == 'OPR' and 0 <= self.Oreg < len(self.secondaryNames) and self.secondaryNames[self.Oreg] != None:
+			name = self.secondaryNames[self.Oreg]
+		return name
 
 	def __str__(self):
 		#We want to be able to see what is currently stored inside the Virtual machine.
@@ -96,7 +502,7 @@ class VM:
 			self.stackdepth +=1
 
 	def isValidReg(self,reg,error):
-		registerValue = eval('self.'+reg)
+		registerValue = getattr(self, reg)
 		if registerValue == None:
 			if error:
 				report(self.line, self.column,f'At: {self.currentInstrucName} {self.Oreg}, {reg} is Empty', RunTimeError)
@@ -107,26 +513,28 @@ class VM:
 		else:
 			return True
 
+	#Signed arithmetic halts if the result in Areg doesn't fit in a word
+	def checkOverflow(self):
+		if self.Areg > self.mostPos:
+			report(self.line, self.column,f'At: {self.currentInstrucName} {self.Oreg}, Integer Overflow', RunTimeError)
+			self.haltFlag = True
+		elif self.Areg < self.mostNeg:
+			report(self.line, self.column,f'At: {self.currentInstrucName} {self.Oreg}, Integer Underflow', RunTimeError)
+			self.haltFlag = True
+
 	#Just so we that we can change to signed easily
+	#This wraps a number to a word and gives back its unsigned value
 	def toSigned(self, num, bits = None):
 		if bits == None:
-			bits = self.bit
-		if num >= 0 and num < 2**(bits-1):
-			return num
-		elif num < 0 and num >= -2**(bits-1):
-			return 2**(bits)+num
-		elif num <0:
-			return self.toSigned(num + 2**(bits))
-		else:
-			return self.toSigned(num - 2**(bits))
+			return num & self.wordMask
+		return num & ((1 << bits) - 1)
 
+	#This wraps a number to a word and gives back its signed value
 	def fromSigned(self, num, bits = None):
 		if bits == None:
-			bits = self.bit
-		if num >= 2**(bits-1):
-			return num - 2**(bits)
-		else:
-			return num
+			return ((num & self.wordMask) ^ self.signBit) - self.signBit
+		signBit = 1 << (bits - 1)
+		return ((num & ((1 << bits) - 1)) ^ signBit) - signBit
 
 	def readByte(self, address):
 		address = self.toSigned(address)
@@ -137,17 +545,13 @@ class VM:
 			report(self.line, self.column,f'{num}, Wrote Nothing ', RuntimeWarning)
 			return
 		address = self.toSigned(address)
-		memory[address] = num
+		self.memory[address] = num & 0xFF
 
 	#Reading a Word's value
 	def readMem(self, address):
 		address = self.toSigned(address)
-		if address % self.bytesPerWord == 0:
-			i = 0
-			result = 0
-			while i < self.bytesPerWord:
-				result += (self.memory[address+i])*(2**(8*i))
-				i+=1
+		if address & self.byteSelectMask == 0:
+			result = self.memory.readWord(address)
 		else:
 			report(self.line, self.column,f'At: {self.currentInstrucName}, {address} is not a wordLength Address', RuntimeWarning)
 			result = None
@@ -159,44 +563,67 @@ class VM:
 		if num == None:
 			report(self.line, self.column,f'{num}, Wrote Nothing ', RuntimeWarning)
 			return
-		#Normalise it to n bits
-		num = self.toSigned(num)
-		num = self.fromSigned(num)
-		if address % self.bytesPerWord == 0:
-			i = 0
-			while i < self.bytesPerWord - 1:
-				#Set it to be the lowest bye
-				self.memory[address+i] = num & 0xFF
-				num = num >> 8
-				i += 1
-			self.memory[address+i] = num
+		if address & self.byteSelectMask == 0:
+			#Normalise it to n bits, as an unsigned number
+			self.memory.writeWord(address, self.toSigned(num))
 		else:
 			report(self.line, self.column,f'At: {self.currentInstrucName}, {address} is not a wordLength Address', RuntimeWarning)
 
-	#Run an instruction by name
-	def execute(self,name):
-		self.currentInstrucName = name
-		try:
-			eval('self.'+ name +'()')
-		#If we can't match that means we've not implemented it yet
-		except Warning:
-			pass
-		except AttributeError:
+	#We build the tables of functions once so that running an instruction is just an index.
+	#Direct functions are indexed by their 4 bit function code and secondary functions
+	#by the value of Oreg that selects them when OPR is run
+	def buildDispatchTables(self):
+		self.directFunctions = [None]*16
+		self.directNames = [None]*16
+		self.secondaryFunctions = []
+		self.secondaryNames = []
+		#These run a secondary function exactly as OPR would once Oreg selects it
+		self.secondaryRunners = []
+		for instruction in reps.TokenType:
+			if not instruction.isInstruction():
+				continue
+			name = instruction.name
+			code = int(instruction.instructionCode(),16)
+			#If we can't find a method that means we've not implemented it yet
+			function = getattr(self, name, None)
+			if function == None:
+				function = self.notImplemented(name)
+			if len(instruction.instructionCode()) == 1:
+				self.directFunctions[code] = function
+				self.directNames[code] = name
+			else:
+				#Codes that don't match any instruction are left as None
+				while len(self.secondaryFunctions) <= code:
+					self.secondaryFunctions.append(None)
+					self.secondaryNames.append(None)
+					self.secondaryRunners.append(None)
+				self.secondaryFunctions[code] = function
+				self.secondaryNames[code] = name
+				self.secondaryRunners[code] = self.secondaryRunner(function)
+
+	def secondaryRunner(self, function):
+		def runner():
+			self.execute(function)
+			self.Oreg = 0
+		return runner
+
+	#This gives a function that reports the instruction hasn't been implemented when run
+	def notImplemented(self, name):
+		def function():
 			message = f'{name} is not yet implemented in the simulator'
 			report(self.line, self.column, message, InstructionNotImplemented)
 			self.error = True
-		except Exception as inst:
-			print (inst)
+		return function
 
-	#We eat the tree in and turn it into instruction/operand pairs
-	def getInstructionOperand(self, node):
-		code = []
-		if node.terminal:
-			code.append((node.getInstruc(),node.getOperand()))
-		else:
-			for child in node.children:
-				code += self.getInstructionOperand(child)
-		return code
+	#Run an instruction's function from one of the tables
+	def execute(self,function):
+		try:
+			function()
+		#Warnings have already been reported so we can move on
+		except Warning:
+			pass
+		except Exception as inst:
+			report(self.line, self.column, f'At: {self.currentInstrucName}, {inst}', RunTimeError)
 
 	#Everything below here represents a function in the code
 	
@@ -213,27 +640,19 @@ class VM:
 			self.Oreg = 0
 			self.haltFlag = True
 			return
-		instructionCodeToRun = hex(self.Oreg)[2:].upper()
-		#If we've only got a single length we add a zero so we can match it correctly
-		if len(instructionCodeToRun) == 1:
-			instructionCodeToRun ='0'+instructionCodeToRun
-		instructionCodeToRun = '#' + instructionCodeToRun
-		try:
-			instruction = reps.TokenType(instructionCodeToRun).name
-			self.execute(instruction)
-		except ValueError:
+		if self.Oreg < len(self.secondaryFunctions) and self.secondaryFunctions[self.Oreg] != None:
+			self.execute(self.secondaryFunctions[self.Oreg])
+		else:
 			report(self.line, self.column, f'OPR {self.Oreg} is not valid', RunTimeError)
 			self.haltFlag = True
-		finally:
-			self.Oreg = 0
-			return
+		self.Oreg = 0
 
 	def LDC(self):
 		self.push(self.Oreg)
 		self.Oreg = 0
 
 	def LDL(self):
-		value = self.readMem(self.workspace(self.Oreg))
+		value = self.readMem(self.Wptr+self.Oreg*self.bytesPerWord)
 		if value == None:
 			report(self.line, self.column,f'At: {self.currentInstrucName} {self.Oreg}, Loaded Nothing', RuntimeWarning)
 		self.push(value)
@@ -250,25 +669,26 @@ class VM:
 		self.Oreg = 0
 
 	def ADC(self):
-		self.Areg += self.Oreg
-		if self.Areg > 2**(self.bit-1) -1:
-			report(self.line, self.column,f'At: {self.currentInstrucName} {self.Oreg+self}, Integer Overflow', RunTimeError)
-			self.haltFlag = True
-		elif self.Areg < -2**(self.bit-1):
-			report(self.line, self.column,f'At: {self.currentInstrucName} {self.Oreg+self}, Integer Underflow', RunTimeError)
-			self.haltFlag = True
+		self.Areg = self.fromSigned(self.Areg) + self.fromSigned(self.Oreg)
+		self.checkOverflow()
 		self.Oreg = 0
 
+	#Words are kept in memory unsigned but constants can be negative, so both are wrapped to
+	#a word before they're compared
 	def EQC(self):
-		if self.Areg == self.Oreg:
+		if self.Areg != None and self.toSigned(self.Areg) == self.toSigned(self.Oreg):
 			self.Areg = 1
 		else:
 			self.Areg = 0
 		self.Oreg = 0
 
+	#J is a descheduling point, where timers that are due wake their processes and a low
+	#priority process that has used its timeslice gives way to the next
 	def J(self):
 		self.Iptr += self.Oreg
 		self.Oreg = 0
+		if self.instructionCount >= self.eventCount:
+			self.scheduler.event()
 
 	def CJ(self):
 		if self.Areg == 0:
@@ -301,20 +721,21 @@ class VM:
 	def LDNLP(self):
 		if not self.isValidReg('Areg',True):
 			return
-		self.areg = self.areg + self.bytesPerWord*self.Oreg
+		self.Areg = self.Areg + self.bytesPerWord*self.Oreg
 		self.Oreg = 0
 
+	#Iptr already points to the instruction after the CALL so that is where we return to
 	def CALL(self):
 		self.Wptr = self.Wptr-4*self.bytesPerWord
 		self.writeMem(self.Wptr,self.Iptr)
 		self.writeMem(self.Wptr+1*self.bytesPerWord,self.Areg)
 		self.writeMem(self.Wptr+2*self.bytesPerWord,self.Breg)
 		self.writeMem(self.Wptr+3*self.bytesPerWord,self.Creg)
-		self.Areg = self.Iptr + 1
+		self.Areg = self.Iptr
 		self.Iptr = self.Iptr + self.Oreg
 		self.Oreg = 0
 
-	def ADW(self):
+	def AJW(self):
 		self.Wptr = self.Wptr + self.bytesPerWord*self.Oreg
 		self.Oreg = 0
 
@@ -326,16 +747,426 @@ class VM:
 
 		self.Areg, self.Breg = self.Breg, self.Areg
 
+	#Return to where the matching CALL left off and drop the space it made
+	def RET(self):
+		address = self.readMem(self.Wptr)
+		if address == None:
+			report(self.line, self.column,f'At: {self.currentInstrucName}, there is no return address at {self.Wptr}', RunTimeError)
+			self.haltFlag = True
+			return
+		self.Iptr = address
+		self.Wptr = self.Wptr+4*self.bytesPerWord
+
 	def ADD(self):
 		if not self.isValidReg('Areg',True):
 			return
 		if not self.isValidReg('Breg',True):
 			return
 		value = self.pop()
-		self.Areg += value
-		if self.Areg > 2**(self.bit-1) -1:
-			report(self.line, self.column,f'At: {self.currentInstrucName} {self.Oreg+self}, Integer Overflow', RunTimeError)
+		self.Areg = self.fromSigned(self.Areg) + self.fromSigned(value)
+		self.checkOverflow()
+
+	#Load a pointer to an instruction, Areg is an offset from the next instruction
+	def LDPI(self):
+		if not self.isValidReg('Areg',True):
+			return
+		self.Areg = self.Iptr + self.Areg
+
+	#Loop end, Breg points to the loop's index and count and Areg is how far back the loop
+	#starts. Like J it's a descheduling point
+	def LEND(self):
+		if not self.isValidReg('Areg',True):
+			return
+		if not self.isValidReg('Breg',True):
+			return
+		offset = self.pop()
+		control = self.pop()
+		count = self.fromSigned(self.readMem(control + self.bytesPerWord)) - 1
+		self.writeMem(control + self.bytesPerWord, count)
+		if count > 0:
+			self.writeMem(control, self.readMem(control) + 1)
+			self.Iptr = self.Iptr - offset
+		if self.instructionCount >= self.eventCount:
+			self.scheduler.event()
+
+	'''
+	The process instructions hand processes to the scheduler, see scheduler.py
+	'''
+	#Start a process at the current priority, Areg is its workspace and Breg is the offset
+	#from the next instruction to its code
+	def STARTP(self):
+		if not self.isValidReg('Areg',True):
+			return
+		if not self.isValidReg('Breg',True):
+			return
+		workspace = self.pop()
+		offset = self.pop()
+		self.writeMem(workspace - self.bytesPerWord, self.Iptr + offset)
+		self.scheduler.enqueue((workspace & self.wordMask) | self.priority)
+
+	#End a process, Areg points to the workspace of the process that started it, which holds
+	#the Iptr it carries on from and the count of processes yet to end. The last process to
+	#end carries on as that process
+	def ENDP(self):
+		if not self.isValidReg('Areg',True):
+			return
+		workspace = self.pop()
+		count = self.fromSigned(self.readMem(workspace + self.bytesPerWord)) - 1
+		self.writeMem(workspace + self.bytesPerWord, count)
+		if count == 0:
+			self.Wptr = workspace
+			self.Iptr = self.readMem(workspace)
+			self.process = (workspace & self.wordMask) | self.priority
+		else:
+			self.Oreg = 0
+			self.scheduler.deschedule()
+
+	#Add the process whose Wdesc is in Areg to the back of its queue
+	def RUNP(self):
+		if not self.isValidReg('Areg',True):
+			return
+		self.scheduler.enqueue(self.pop())
+		self.Oreg = 0
+		self.scheduler.preempt()
+
+	#Stop the current process, it can be run again with RUNP
+	def STOPP(self):
+		self.Oreg = 0
+		self.scheduler.stop()
+
+	def LDPRI(self):
+		self.push(self.priority)
+
+	#Set the front and back pointers of the queues
+	def STHF(self):
+		self.storeQueuePointer(self.scheduler.frontPointers[highPriority])
+
+	def STHB(self):
+		self.storeQueuePointer(self.scheduler.backPointers[highPriority])
+
+	def STLF(self):
+		self.storeQueuePointer(self.scheduler.frontPointers[lowPriority])
+
+	def STLB(self):
+		self.storeQueuePointer(self.scheduler.backPointers[lowPriority])
+
+	def storeQueuePointer(self, address):
+		if not self.isValidReg('Areg',True):
+			return
+		self.writeMem(address, self.pop())
+
+	#Save the front and back pointers of a queue to the two words Areg points to
+	def SAVEH(self):
+		self.saveQueue(highPriority)
+
+	def SAVEL(self):
+		self.saveQueue(lowPriority)
+
+	def saveQueue(self, priority):
+		if not self.isValidReg('Areg',True):
+			return
+		address = self.pop()
+		self.writeMem(address, self.readMem(self.scheduler.frontPointers[priority]))
+		self.writeMem(address + self.bytesPerWord, self.readMem(self.scheduler.backPointers[priority]))
+
+	#MostNeg, which is also NotProcess.p and so is used to set up channels
+	def MINT(self):
+		self.push(self.mostNeg)
+
+	'''
+	A channel between processes on the same transputer is a word of memory. It holds
+	NotProcess.p until a process is waiting on it and then holds that process's Wdesc.
+	The first process to get to a channel saves a pointer to its message in its workspace
+	and waits, the second copies the message and lets the first carry on
+	'''
+	#Areg is the number of bytes, Breg the channel and Creg where the message goes
+	def IN(self):
+		if not self.isValidReg('Areg',True) or not self.isValidReg('Breg',True) or not self.isValidReg('Creg',True):
+			return
+		count = self.pop()
+		channel = self.pop()
+		pointer = self.pop()
+		self.communicate(channel, pointer, count, True)
+
+	#Areg is the number of bytes, Breg the channel and Creg where the message is
+	def OUT(self):
+		if not self.isValidReg('Areg',True) or not self.isValidReg('Breg',True) or not self.isValidReg('Creg',True):
+			return
+		count = self.pop()
+		channel = self.pop()
+		pointer = self.pop()
+		self.communicate(channel, pointer, count, False)
+
+	#The word or byte in Areg is put in W[0] and sent from there down the channel in Breg
+	def OUTWORD(self):
+		if not self.isValidReg('Areg',True) or not self.isValidReg('Breg',True):
+			return
+		self.writeMem(self.Wptr, self.pop())
+		self.communicate(self.pop(), self.Wptr, self.bytesPerWord, False)
+
+	def OUTBYTE(self):
+		if not self.isValidReg('Areg',True) or not self.isValidReg('Breg',True):
+			return
+		self.writeByte(self.Wptr, self.pop())
+		self.communicate(self.pop(), self.Wptr, 1, False)
+
+	def communicate(self, channel, pointer, count, inputting):
+		count = self.fromSigned(count)
+		if count < 0:
+			report(self.line, self.column,f'At: {self.currentInstrucName}, {count} bytes can\'t be sent', RunTimeError)
+			self.haltFlag = True
+			return
+		if self.isLink(channel):
+			self.linkCommunicate(channel, pointer, count, inputting)
+			return
+		partner = self.readMem(channel)
+		if partner == None:
+			return
+		scheduler = self.scheduler
+		self.Oreg = 0
+		if partner == scheduler.notProcess:
+			self.writeMem(channel, (self.Wptr & self.wordMask) | self.priority)
+			self.writeMem(self.Wptr + stateSlot*self.bytesPerWord, pointer)
+			scheduler.stop()
+			return
+		partnerPointer = self.readMem(scheduler.slot(partner & ~1, stateSlot))
+		#An outputter that finds an ALTing process on the channel makes that guard ready
+		#and then waits for the ALT to choose it
+		if not inputting and scheduler.isAltState(partnerPointer):
+			scheduler.altReady(partner)
+			self.writeMem(channel, (self.Wptr & self.wordMask) | self.priority)
+			self.writeMem(self.Wptr + stateSlot*self.bytesPerWord, pointer)
+			scheduler.stop()
+			return
+		if inputting:
+			self.copyMessage(pointer, partnerPointer, count)
+		else:
+			self.copyMessage(partnerPointer, pointer, count)
+		self.writeMem(channel, scheduler.notProcess)
+		scheduler.enqueue(partner)
+		scheduler.preempt()
+
+	def isLink(self, channel):
+		return self.linkStart <= (channel & self.wordMask) < self.linkEnd
+
+	#The link a channel word belongs to, None if it isn't connected or can't be used this way
+	def linkFor(self, channel, inputting):
+		index = ((channel & self.wordMask) - self.linkStart) // self.bytesPerWord
+		if inputting and index >= 4:
+			link = self.inputLinks[index - 4]
+		elif not inputting and index < 4:
+			link = self.outputLinks[index]
+		else:
+			report(self.line, self.column,f'At: {self.currentInstrucName}, link channel {index} can\'t be used for {"input" if inputting else "output"}', RunTimeError)
+			self.haltFlag = True
+			return None
+		if link == None:
+			report(self.line, self.column,f'At: {self.currentInstrucName}, link {index % 4} isn\'t connected', RunTimeError)
+			self.haltFlag = True
+		return link
+
+	#A link carries messages to another VM, see network.py. The process always waits and
+	#the link runs it again once its message has gone
+	def linkCommunicate(self, channel, pointer, count, inputting):
+		link = self.linkFor(channel, inputting)
+		if link == None:
+			return
+		#The other end copies straight to or from our memory so the message has to fit
+		pointer = self.toSigned(pointer)
+		if not self.messageFits(pointer, count):
+			return
+		wdesc = (self.Wptr & self.wordMask) | self.priority
+		self.Oreg = 0
+		self.writeMem(channel, wdesc)
+		self.scheduler.stop()
+		if inputting:
+			link.input(wdesc, pointer, count)
+		else:
+			link.output(wdesc, pointer, count)
+
+	#A message of count bytes at address has to be inside memory, otherwise it's an error
+	def messageFits(self, address, count):
+		if address + count > len(self.memory):
+			report(self.line, self.column,f'At: {self.currentInstrucName}, a message of {count} bytes runs past the end of memory', RunTimeError)
 			self.haltFlag = True
-		elif self.Areg < -2**(self.bit-1):
-			report(self.line, self.column,f'At: {self.currentInstrucName} {self.Oreg+self}, Integer Underflow', RunTimeError)
-			self.haltFlag = True
\ No newline at end of file
+			return False
+		return True
+
+	#Messages are copied in one go however long they are
+	def copyMessage(self, destination, source, count):
+		destination = self.toSigned(destination)
+		source = self.toSigned(source)
+		if not self.messageFits(destination, count) or not self.messageFits(source, count):
+			return
+		if self.memoryTiming != None and self.memoryTiming.installed:
+			self.memoryTiming.copy(destination, source, count)
+		self.memory.copy(destination, source, count)
+
+	'''
+	Each priority has its own clock, see timers.py
+	'''
+	def LDTIMER(self):
+		self.push(self.scheduler.clock(self.priority))
+
+	#Wait until the clock reaches the time in Areg
+	def TIN(self):
+		if not self.isValidReg('Areg',True):
+			return
+		time = self.pop()
+		self.Oreg = 0
+		self.scheduler.waitUntil(time)
+
+	#Set both clocks to Areg
+	def STTIMER(self):
+		if not self.isValidReg('Areg',True):
+			return
+		self.scheduler.setClocks(self.pop())
+
+	'''
+	An ALT enables each of its guards, waits until one of them is ready and then disables
+	them again, the first ready guard it disables is the one chosen. As on the chip where
+	the ALT is up to is kept in its workspace:
+	W[0] holds the offset to the chosen guard's code, or NoneSelected
+	The state slot holds Enabling, Waiting or Ready
+	For a timer ALT the TLink slot holds TimeSet or TimeNotSet and the time slot holds the
+	earliest time enabled
+	Enabling a channel leaves the process's Wdesc in the channel word, so a process that
+	outputs on it finds the ALT and wakes it, see communicate
+	'''
+	def stateAddress(self, slot):
+		return self.Wptr + slot*self.bytesPerWord
+
+	def ALT(self):
+		self.writeMem(self.stateAddress(stateSlot), self.scheduler.enabling)
+
+	def TALT(self):
+		self.writeMem(self.stateAddress(stateSlot), self.scheduler.enabling)
+		self.writeMem(self.stateAddress(tlinkSlot), self.scheduler.timeNotSet)
+
+	#Areg is the guard and Breg the channel, Areg is left as the guard
+	def ENBC(self):
+		if not self.isValidReg('Areg',True) or not self.isValidReg('Breg',True):
+			return
+		guard = self.pop()
+		channel = self.pop()
+		if guard != 0 and self.isLink(channel):
+			link = self.linkFor(channel, True)
+			if link == None:
+				return
+			#The link keeps any message waiting for us, so the channel word only tells the
+			#link there's an ALT to wake
+			if link.ready():
+				self.writeMem(self.stateAddress(stateSlot), self.scheduler.ready)
+			else:
+				self.writeMem(channel, (self.Wptr & self.wordMask) | self.priority)
+		elif guard != 0:
+			scheduler = self.scheduler
+			wdesc = (self.Wptr & self.wordMask) | self.priority
+			word = self.readMem(channel)
+			if word == scheduler.notProcess:
+				self.writeMem(channel, wdesc)
+			elif word != wdesc:
+				#Someone is already waiting to output
+				self.writeMem(self.stateAddress(stateSlot), scheduler.ready)
+		self.push(guard)
+
+	#Areg is the guard
+	def ENBS(self):
+		if not self.isValidReg('Areg',True):
+			return
+		if self.Areg != 0:
+			self.writeMem(self.stateAddress(stateSlot), self.scheduler.ready)
+
+	#Areg is the guard and Breg the time, Areg is left as the guard
+	def ENBT(self):
+		if not self.isValidReg('Areg',True) or not self.isValidReg('Breg',True):
+			return
+		guard = self.pop()
+		time = self.pop()
+		if guard != 0:
+			scheduler = self.scheduler
+			#We keep the earliest time of any timer guard
+			if self.readMem(self.stateAddress(tlinkSlot)) == scheduler.timeNotSet:
+				self.writeMem(self.stateAddress(tlinkSlot), scheduler.timeSet)
+				self.writeMem(self.stateAddress(timeSlot), time)
+			elif self.fromSigned(time - self.readMem(self.stateAddress(timeSlot))) < 0:
+				self.writeMem(self.stateAddress(timeSlot), time)
+		self.push(guard)
+
+	#Wait until a guard is ready
+	def ALTWT(self):
+		scheduler = self.scheduler
+		self.writeMem(self.Wptr, noneSelected)
+		if self.readMem(self.stateAddress(stateSlot)) == scheduler.ready:
+			return
+		self.writeMem(self.stateAddress(stateSlot), scheduler.waiting)
+		self.Oreg = 0
+		scheduler.stop()
+
+	#Wait until a guard is ready or the earliest time enabled is reached
+	def TALTWT(self):
+		scheduler = self.scheduler
+		self.writeMem(self.Wptr, noneSelected)
+		if self.readMem(self.stateAddress(stateSlot)) == scheduler.ready:
+			return
+		if self.readMem(self.stateAddress(tlinkSlot)) == scheduler.timeSet:
+			cycle = scheduler.cycleAt(self.readMem(self.stateAddress(timeSlot)))
+			if cycle == None:
+				self.writeMem(self.stateAddress(stateSlot), scheduler.ready)
+				return
+			scheduler.timers.add((self.Wptr & self.wordMask) | self.priority, cycle, True)
+		self.writeMem(self.stateAddress(stateSlot), scheduler.waiting)
+		self.Oreg = 0
+		scheduler.stop()
+
+	#Choose a guard if it's ready and nothing has been chosen yet, Areg is the offset to the
+	#guard's code. Areg is left true if this guard was chosen
+	def selectGuard(self, offset, ready):
+		if ready and self.fromSigned(self.readMem(self.Wptr)) == noneSelected:
+			self.writeMem(self.Wptr, offset)
+			self.push(1)
+		else:
+			self.push(0)
+
+	#Areg is the offset, Breg the guard and Creg the channel
+	def DISC(self):
+		if not self.isValidReg('Areg',True) or not self.isValidReg('Breg',True) or not self.isValidReg('Creg',True):
+			return
+		offset = self.pop()
+		guard = self.pop()
+		channel = self.pop()
+		ready = False
+		if guard != 0:
+			word = self.readMem(channel)
+			if word == (self.Wptr & self.wordMask) | self.priority:
+				#We take ourselves off the channel
+				self.writeMem(channel, self.scheduler.notProcess)
+			elif word != self.scheduler.notProcess:
+				ready = True
+			if self.isLink(channel):
+				link = self.linkFor(channel, True)
+				ready = link != None and link.ready()
+		self.selectGuard(offset, ready)
+
+	#Areg is the offset and Breg the guard
+	def DISS(self):
+		if not self.isValidReg('Areg',True) or not self.isValidReg('Breg',True):
+			return
+		offset = self.pop()
+		guard = self.pop()
+		self.selectGuard(offset, guard != 0)
+
+	#Areg is the offset, Breg the guard and Creg the time
+	def DIST(self):
+		if not self.isValidReg('Areg',True) or not self.isValidReg('Breg',True) or not self.isValidReg('Creg',True):
+			return
+		scheduler = self.scheduler
+		offset = self.pop()
+		guard = self.pop()
+		time = self.pop()
+		scheduler.timers.remove((self.Wptr & self.wordMask) | self.priority)
+		self.selectGuard(offset, guard != 0 and scheduler.cycleAt(time) == None)
+
+	#Jump to the code of the chosen guard
+	def ALTEND(self):
+		self.Iptr = self.Iptr + self.fromSigned(self.readMem(self.Wptr))
\ No newline at end of file